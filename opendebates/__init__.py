@@ -3,3 +3,5 @@ from __future__ import absolute_import
 # This will make sure the app is always imported when
 # Django starts so that shared_task will use this app.
 from .celeryapp import app as celery_app  # noqa
+
+default_app_config = 'opendebates.apps.OpenDebatesConfig'
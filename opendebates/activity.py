@@ -0,0 +1,64 @@
+"""
+Which debates the periodic tasks work on.
+
+A debate is active while its questions can still change: while it is
+open to votes and questions and its debate_time is less than
+DEBATE_ACTIVE_DAYS days ago, and whenever it has had votes in the last
+DEBATE_ACTIVE_VOTE_HOURS hours. The periodic tasks in opendebates.tasks
+only recompute the active debates, in one subtask per debate.
+
+Once a debate is no longer active, its trending scores are computed one
+last time and then frozen (``Debate.scores_frozen``). They're recomputed
+again only if the debate becomes active again.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Debate, Vote
+
+
+ACTIVE_AFTER_DEBATE = datetime.timedelta(days=int(getattr(settings, 'DEBATE_ACTIVE_DAYS', 7)))
+RECENT_VOTES_WINDOW = datetime.timedelta(
+    hours=int(getattr(settings, 'DEBATE_ACTIVE_VOTE_HOURS', 24)))
+
+ACTIVE_DEBATES_CACHE_ENTRY = 'active_debate_ids'
+# Every dispatcher asks, once a minute or more; they can share the answer.
+ACTIVE_DEBATES_TIMEOUT = 60
+
+
+def active_debates(now=None):
+    """
+    Return a queryset of the active debates.
+    """
+    if now is None:
+        now = timezone.now()
+    # One EXISTS per debate, which stops at its first recent vote
+    recently_voted = Vote.objects.filter(
+        submission__category__debate=OuterRef('pk'),
+        created_at__gt=now - RECENT_VOTES_WINDOW,
+    )
+    # The answer changes with every vote, so don't let cache-machine keep it.
+    return Debate.objects.no_cache().annotate(
+        recently_voted=Exists(recently_voted),
+    ).filter(
+        Q(allow_voting_and_submitting_questions=True, debate_time__gt=now - ACTIVE_AFTER_DEBATE) |
+        Q(recently_voted=True)
+    )
+
+
+def active_debate_ids(now=None):
+    """
+    Return the set of the ids of the active debates. The current set is
+    cached for ACTIVE_DEBATES_TIMEOUT seconds.
+    """
+    if now is not None:
+        return set(active_debates(now).values_list('id', flat=True))
+    ids = cache.get(ACTIVE_DEBATES_CACHE_ENTRY)
+    if ids is None:
+        ids = set(active_debates().values_list('id', flat=True))
+        cache.set(ACTIVE_DEBATES_CACHE_ENTRY, ids, ACTIVE_DEBATES_TIMEOUT)
+    return ids
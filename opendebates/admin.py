@@ -125,6 +125,20 @@ class FlagAdmin(ModelAdmin):
     prefix.short_description = "Debate prefix"
 
 
+@register(models.DuplicateCandidate)
+class DuplicateCandidateAdmin(ModelAdmin):
+    list_display = ('id', 'prefix', 'to_remove', 'duplicate_of', 'score', 'created_at',
+                    'reviewed')
+    list_filter = ('to_remove__category__debate__prefix', 'reviewed')
+    list_select_related = ('to_remove__category__debate', 'duplicate_of')
+
+    raw_id_fields = ['to_remove', 'duplicate_of']
+
+    def prefix(self, obj):
+        return debate_link(obj.to_remove.category.debate)
+    prefix.short_description = "Debate prefix"
+
+
 @register(models.TopSubmissionCategory)
 class TopSubmissionCategoryAdmin(ModelAdmin):
     list_display = ('slug', 'prefix', 'title')
@@ -147,6 +161,7 @@ class DebateAdmin(ModelAdmin):
             'fields': ['site', 'prefix', 'theme', 'show_question_votes', 'show_total_votes',
                        'allow_sorting_by_votes',
                        'allow_voting_and_submitting_questions',
+                       'scoring_strategy',
                        'inline_css']
         }),
         ('Debate Details', {
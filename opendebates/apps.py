@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class OpenDebatesConfig(AppConfig):
+    name = 'opendebates'
+    verbose_name = 'Open Debates'
+
+    def ready(self):
+        from opendebates import signals  # noqa
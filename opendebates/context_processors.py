@@ -8,8 +8,9 @@ from django.utils.functional import SimpleLazyObject
 from django.utils.html import mark_safe
 from django.utils.timezone import now
 
-from .models import Category, Vote, NUMBER_OF_VOTES_CACHE_ENTRY
+from .models import Category, NUMBER_OF_VOTES_CACHE_ENTRY
 from .utils import get_voter, vote_needs_captcha
+from .votes_cast import get_votes_cast
 
 
 def voter(request):
@@ -20,10 +21,7 @@ def voter(request):
         voter = get_voter(request)
         if not voter:
             return '{}'
-        votes = Vote.objects.filter(
-            voter__email=voter['email'],
-        )
-        votes = [i.submission_id for i in votes]
+        votes = get_votes_cast(voter['email'])
         return mark_safe(json.dumps({"submissions": votes}))
 
     return {
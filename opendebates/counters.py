@@ -0,0 +1,211 @@
+"""
+Cache-backed vote counters.
+
+When ``settings.VOTE_BUFFERING`` is on, the vote view does not UPDATE the
+submission row on every vote. Instead the increments for ``votes``,
+``current_votes`` and ``local_votes`` are accumulated in the cache with
+atomic ``incr`` calls, and the ``flush_vote_buffer`` task periodically
+writes all pending increments to the database with a single UPDATE.
+
+To know which submissions have pending increments, every buffered vote
+also appends the submission id to a numbered slot (``vote_buffer_slot-N``,
+where N comes from an atomic ``incr`` on ``vote_buffer_seq``). The flush
+reads the slots written since the previous flush.
+
+The total number of votes of each debate (NUMBER_OF_VOTES in the
+templates) is also a cache counter: the views add to it with
+``count_vote`` and ``reconcile_vote_total`` resets it from the database
+now and then, to correct any drift.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Submission, Vote, NUMBER_OF_VOTES_CACHE_ENTRY
+
+
+logger = logging.getLogger(__name__)
+
+
+VOTE_BUFFER_CACHE_ENTRY = 'vote_buffer-{}-{}'
+VOTE_BUFFER_SEQ_CACHE_ENTRY = 'vote_buffer_seq'
+VOTE_BUFFER_SLOT_CACHE_ENTRY = 'vote_buffer_slot-{}'
+VOTE_BUFFER_FLUSHED_CACHE_ENTRY = 'vote_buffer_flushed'
+
+BUFFERED_FIELDS = ('votes', 'current_votes', 'local_votes')
+
+BUFFER_TIMEOUT = 24 * 3600
+VOTE_TOTAL_TIMEOUT = 24 * 3600
+
+# Never look at more than this many slots in one flush, even if the
+# "flushed" marker was evicted from the cache.
+MAX_SLOTS_PER_FLUSH = 100000
+
+# Slots are written right after the sequence number is incremented, so a
+# flush can race a vote and find an empty slot. Re-reading a few slots from
+# before the previous flush picks those up on the next run; it's harmless
+# otherwise because the pending increments have already been taken.
+SLOT_OVERLAP = 100
+
+
+def _incr(key, delta=1):
+    """
+    Atomically increment ``key``, creating it first if needed.
+
+    Raises ValueError if the cache backend can't hold the counter (e.g.
+    the DummyCache).
+    """
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, BUFFER_TIMEOUT)
+        return cache.incr(key, delta)
+
+
+def buffer_vote(submission_id, current, local):
+    """
+    Record one vote for ``submission_id`` in the cache.
+
+    ``current`` and ``local`` say whether the vote also counts towards
+    ``current_votes`` and ``local_votes``. Returns False if the cache
+    could not record the vote, in which case the caller must update the
+    database itself.
+    """
+    deltas = (1, int(bool(current)), int(bool(local)))
+    try:
+        # Before the increments: an unused slot is harmless, an increment
+        # without a slot isn't.
+        slot = _incr(VOTE_BUFFER_SEQ_CACHE_ENTRY)
+    except ValueError:
+        logger.warning("Unable to buffer vote for submission %s", submission_id)
+        return False
+    applied = []
+    try:
+        for field, delta in zip(BUFFERED_FIELDS, deltas):
+            if delta:
+                key = VOTE_BUFFER_CACHE_ENTRY.format(field, submission_id)
+                _incr(key, delta)
+                applied.append((key, delta))
+    except ValueError:
+        logger.warning("Unable to buffer vote for submission %s", submission_id)
+        # The caller updates the database instead, so the next flush
+        # mustn't count the vote too.
+        for key, delta in applied:
+            try:
+                cache.decr(key, delta)
+            except ValueError:
+                pass  # Evicted, along with the increment
+        return False
+    cache.set(VOTE_BUFFER_SLOT_CACHE_ENTRY.format(slot), submission_id, BUFFER_TIMEOUT)
+    return True
+
+
+def pending_votes(submission_id):
+    """
+    Return the number of votes for ``submission_id`` that are in the
+    cache but not yet written to the database.
+    """
+    return cache.get(VOTE_BUFFER_CACHE_ENTRY.format('votes', submission_id)) or 0
+
+
+def _take(values):
+    """
+    Subtract each value in ``values`` (a dict of cache key -> int) from
+    its counter, so increments that happen while we flush are kept for
+    the next flush.
+    """
+    taken = {}
+    for key, value in values.items():
+        if not value:
+            continue
+        try:
+            cache.decr(key, value)
+        except ValueError:
+            # Evicted since we read it; nothing left to take.
+            continue
+        taken[key] = value
+    return taken
+
+
+def _give_back(taken):
+    for key, value in taken.items():
+        try:
+            _incr(key, value)
+        except ValueError:
+            logger.error("Lost %d buffered votes for %s", value, key)
+
+
+def flush_vote_buffer():
+    """
+    Write all pending buffered increments to the database in a single
+    UPDATE. Returns the number of submissions updated.
+
+    Must not run concurrently with itself; see ``tasks.flush_vote_buffer``.
+    """
+    seq = cache.get(VOTE_BUFFER_SEQ_CACHE_ENTRY) or 0
+    flushed = cache.get(VOTE_BUFFER_FLUSHED_CACHE_ENTRY) or 0
+    if seq <= flushed:
+        return 0
+
+    start = max(flushed - SLOT_OVERLAP, seq - MAX_SLOTS_PER_FLUSH, 0) + 1
+    slots = cache.get_many([VOTE_BUFFER_SLOT_CACHE_ENTRY.format(n)
+                            for n in range(start, seq + 1)])
+    submission_ids = sorted(set(slots.values()))
+
+    keys = [VOTE_BUFFER_CACHE_ENTRY.format(field, submission_id)
+            for submission_id in submission_ids
+            for field in BUFFERED_FIELDS]
+    taken = _take(cache.get_many(keys))
+
+    rows = []
+    for submission_id in submission_ids:
+        deltas = [taken.get(VOTE_BUFFER_CACHE_ENTRY.format(field, submission_id), 0)
+                  for field in BUFFERED_FIELDS]
+        if any(deltas):
+            rows.append([submission_id] + deltas)
+
+    if rows:
+        table = Submission._meta.db_table
+        sql = """
+        UPDATE {table} AS s
+        SET votes = s.votes + d.votes,
+            current_votes = s.current_votes + d.current_votes,
+            local_votes = s.local_votes + d.local_votes
+        FROM (VALUES {values}) AS d (id, votes, current_votes, local_votes)
+        WHERE s.id = d.id
+        """.format(table=table, values=', '.join(['(%s, %s, %s, %s)'] * len(rows)))
+        params = [value for row in rows for value in row]
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, params)
+        except Exception:
+            _give_back(taken)
+            raise
+
+    cache.set(VOTE_BUFFER_FLUSHED_CACHE_ENTRY, seq, BUFFER_TIMEOUT)
+    logger.debug("Flushed buffered votes for %d submissions", len(rows))
+    return len(rows)
+
+
+def count_vote(debate_id, delta=1):
+    """
+    Add ``delta`` to the running vote total of the debate, if it's in the
+    cache. If it isn't, the next ``reconcile_vote_total`` will set it.
+    """
+    try:
+        cache.incr(NUMBER_OF_VOTES_CACHE_ENTRY.format(debate_id), delta)
+    except ValueError:
+        pass
+
+
+def reconcile_vote_total(debate):
+    """
+    Set the running vote total of ``debate`` from the database. Returns
+    the total.
+    """
+    # Votes cast between the count and the set are lost until the next
+    # reconciliation; the total is only displayed, so that's acceptable.
+    total = Vote.objects.filter(submission__category__debate=debate).count()
+    cache.set(NUMBER_OF_VOTES_CACHE_ENTRY.format(debate.id), total, VOTE_TOTAL_TIMEOUT)
+    return total
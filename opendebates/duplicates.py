@@ -0,0 +1,169 @@
+"""
+Near-duplicate detection for moderators.
+
+The text of each approved submission (its idea and keywords) is cut into
+shingles, pairs of consecutive words once the most common words are
+dropped. Its MinHash signature is the minimum of each of NUM_HASHES hash
+functions over the shingles; the fraction of equal values in two
+signatures estimates the Jaccard similarity of their shingles.
+
+To avoid comparing every pair of submissions, the signature is also cut
+into NUM_BANDS bands of rows, each hashed into one number (locality
+sensitive hashing). Submissions that are similar are very likely to
+share a band hash, and those that aren't very unlikely to, so only the
+submissions sharing a band are compared, found with the GIN index on
+SubmissionFingerprint.bands. The pairs whose estimated similarity is at
+least DUPLICATE_THRESHOLD are recorded as DuplicateCandidates, which the
+moderation page lists.
+
+The detection is incremental: ``find_duplicates`` only fingerprints the
+approved submissions that don't have a SubmissionFingerprint yet, and
+compares them with the ones that do. It works through them BATCH_SIZE at
+a time, so its memory doesn't grow with the size of the debate.
+"""
+import hashlib
+import re
+import struct
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.encoding import force_bytes
+
+from .models import DuplicateCandidate, Submission, SubmissionFingerprint
+
+
+NUM_HASHES = 128
+NUM_BANDS = 32
+ROWS_PER_BAND = NUM_HASHES // NUM_BANDS
+
+# With 32 bands of 4 rows, pairs with a similarity of 0.5 share a band 7
+# times out of 8, and pairs with a similarity of 0.7 almost always.
+DUPLICATE_THRESHOLD = float(getattr(settings, 'DUPLICATE_THRESHOLD', 0.5))
+
+BATCH_SIZE = 500
+
+SHINGLE_SIZE = 2
+
+STOP_WORDS = frozenset(
+    "a about an and are as at be but by can do does for from has have how i if in is it "
+    "its of on or our should so that the their them there they this to we what when where "
+    "which who why will with would you your".split()
+)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_SHINGLE_HASH = (1 << 32) - 1
+
+
+def _coefficient(name):
+    # Derived from md5 rather than the random module, so that signatures
+    # stay comparable across processes and Python versions.
+    return int(hashlib.md5(force_bytes(name)).hexdigest(), 16) % (MERSENNE_PRIME - 1) + 1
+
+
+# The hash functions: h(x) = (a * x + b) mod p
+HASH_FUNCTIONS = [(_coefficient('a%d' % n), _coefficient('b%d' % n)) for n in range(NUM_HASHES)]
+
+
+def shingles(text):
+    words = [word for word in WORD_RE.findall(text.lower()) if word not in STOP_WORDS]
+    if len(words) <= SHINGLE_SIZE:
+        return set([u' '.join(words)]) if words else set()
+    return set(u' '.join(words[n:n + SHINGLE_SIZE])
+               for n in range(len(words) - SHINGLE_SIZE + 1))
+
+
+def minhash(text):
+    """
+    Return the MinHash signature of ``text``, or an empty list if it has
+    no words.
+    """
+    hashes = [zlib.crc32(force_bytes(shingle)) & MAX_SHINGLE_HASH for shingle in shingles(text)]
+    if not hashes:
+        return []
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in HASH_FUNCTIONS]
+
+
+def band_hashes(signature):
+    """
+    Return the hash of each band of ``signature``, as signed 64-bit ints.
+    """
+    bands = []
+    for band in range(len(signature) // ROWS_PER_BAND):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        data = struct.pack('>I%dQ' % ROWS_PER_BAND, band, *rows)
+        bands.append(struct.unpack('>q', hashlib.md5(data).digest()[:8])[0])
+    return bands
+
+
+def similarity(signature, other):
+    """
+    Return the estimated Jaccard similarity of the texts of two signatures.
+    """
+    if not signature or len(signature) != len(other):
+        return 0.0
+    return sum(1 for a, b in zip(signature, other) if a == b) / float(len(signature))
+
+
+def fingerprint(submission_id, idea, keywords):
+    signature = minhash(u'%s %s' % (idea, keywords or u''))
+    return SubmissionFingerprint(submission_id=submission_id, minhash=signature,
+                                 bands=band_hashes(signature))
+
+
+def find_duplicates(debate, batch_size=BATCH_SIZE):
+    """
+    Fingerprint the new approved submissions of the debate, and record
+    the pairs of submissions that look like duplicates.
+
+    Returns the number of submissions fingerprinted, and of
+    DuplicateCandidates recorded.
+    """
+    submissions = Submission.objects.filter(
+        category__debate=debate,
+        approved=True,
+        duplicate_of__isnull=True,
+    )
+    fingerprinted = recorded = 0
+    while True:
+        batch = list(
+            submissions.filter(fingerprint__isnull=True)
+            .order_by('id')
+            .values_list('id', 'idea', 'keywords')[:batch_size]
+        )
+        if not batch:
+            break
+        fingerprints = [fingerprint(*row) for row in batch]
+        batch_ids = set(row[0] for row in batch)
+
+        candidates = []
+        with transaction.atomic():
+            SubmissionFingerprint.objects.bulk_create(fingerprints)
+            for new in fingerprints:
+                if not new.bands:
+                    continue
+                others = SubmissionFingerprint.objects.filter(
+                    submission__in=submissions,
+                    bands__overlap=new.bands,
+                ).exclude(
+                    submission_id=new.submission_id,
+                ).values_list('submission_id', 'minhash')
+                for other_id, other_minhash in others:
+                    if other_id in batch_ids and other_id > new.submission_id:
+                        # The pair is found again from the other side
+                        continue
+                    score = similarity(new.minhash, other_minhash)
+                    if score >= DUPLICATE_THRESHOLD:
+                        # The newer submission is the one to merge away
+                        candidates.append(DuplicateCandidate(
+                            to_remove_id=max(new.submission_id, other_id),
+                            duplicate_of_id=min(new.submission_id, other_id),
+                            score=score,
+                        ))
+            DuplicateCandidate.objects.bulk_create(candidates)
+
+        fingerprinted += len(fingerprints)
+        recorded += len(candidates)
+    return fingerprinted, recorded
@@ -0,0 +1,153 @@
+"""
+The per-debate "recent activity" feed.
+
+The vote and question views append a small event record to the feed of
+the debate as they happen; the recent activity view just reads it back.
+
+Each feed is a ring of FEED_SIZE slots in the cache. Appending takes the
+next sequence number with an atomic ``incr`` and writes the event to slot
+(sequence % FEED_SIZE), so concurrent appends never overwrite each other's
+events. ``rebuild_feed`` recreates a feed from the database, for when the
+cache was flushed or submissions were removed or merged. It keeps the
+events appended while it ran, and takes its slots after the current
+sequence number, so the sequence never goes backwards.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Submission, Vote
+
+
+logger = logging.getLogger(__name__)
+
+
+RECENT_EVENTS_SEQ_CACHE_ENTRY = 'recent_events_seq-{}'
+RECENT_EVENTS_SLOT_CACHE_ENTRY = 'recent_events_slot-{}-{}'
+
+FEED_SIZE = 10
+FEED_TIMEOUT = 24 * 3600
+
+SUBMISSION_EVENT = 'submission'
+VOTE_EVENT = 'vote'
+
+
+def make_event(kind, submission, voter, created_at):
+    return {
+        'kind': kind,
+        'submission_id': submission.id,
+        'voter_id': voter.id,
+        'user_name': voter.user_display_name(),
+        'title': submission.idea,
+        'url': submission.get_absolute_url(),
+        'created_at': created_at,
+    }
+
+
+def submission_event(submission):
+    return make_event(SUBMISSION_EVENT, submission, submission.voter, submission.created_at)
+
+
+def vote_event(vote):
+    return make_event(VOTE_EVENT, vote.submission, vote.voter, vote.created_at)
+
+
+def _event_id(event):
+    return (event['kind'], event['submission_id'], event['voter_id'], event['created_at'])
+
+
+def _slot_keys(debate_id, seq):
+    first = max(seq - FEED_SIZE + 1, 1)
+    return [RECENT_EVENTS_SLOT_CACHE_ENTRY.format(debate_id, n % FEED_SIZE)
+            for n in range(first, seq + 1)]
+
+
+def append_event(debate_id, event):
+    """
+    Add ``event`` to the feed of the debate. Does nothing if the feed isn't
+    in the cache; the next rebuild will pick the event up from the database.
+    """
+    try:
+        seq = cache.incr(RECENT_EVENTS_SEQ_CACHE_ENTRY.format(debate_id))
+    except ValueError:
+        return
+    key = RECENT_EVENTS_SLOT_CACHE_ENTRY.format(debate_id, seq % FEED_SIZE)
+    cache.set(key, event, FEED_TIMEOUT)
+
+
+def recent_events(debate_id):
+    """
+    Return the events of the feed, newest first, or None if the feed isn't
+    in the cache.
+    """
+    seq = cache.get(RECENT_EVENTS_SEQ_CACHE_ENTRY.format(debate_id))
+    if seq is None:
+        return None
+    events = cache.get_many(_slot_keys(debate_id, seq)).values()
+    return sorted(events, key=lambda event: event['created_at'], reverse=True)
+
+
+def rebuild_feed(debate):
+    """
+    Recreate the feed of ``debate`` from the database. Read it from the
+    master: a replica would miss the events just appended.
+    """
+    started = timezone.now()
+    votes = Vote.objects.select_related(
+        "voter",
+        "voter__user",
+        "submission__category",
+    ).filter(
+        submission__category__debate=debate,
+        submission__approved=True,
+        submission__duplicate_of__isnull=True,
+    ).exclude(
+        voter=F('submission__voter'),
+    ).order_by("-id")[:FEED_SIZE]
+    submissions = Submission.objects.select_related(
+        "voter",
+        "voter__user",
+        "category",
+    ).filter(
+        approved=True,
+        duplicate_of__isnull=True,
+        category__debate=debate,
+    ).order_by("-id")[:FEED_SIZE]
+
+    for vote in votes:
+        vote.submission._cached_debate = debate
+    for submission in submissions:
+        submission._cached_debate = debate
+    events = [vote_event(vote) for vote in votes] + \
+        [submission_event(submission) for submission in submissions]
+
+    # Keep the events appended since this started, which the queries may
+    # not have seen.
+    seq_key = RECENT_EVENTS_SEQ_CACHE_ENTRY.format(debate.id)
+    seq = cache.get(seq_key)
+    if seq is not None:
+        seen = set(_event_id(event) for event in events)
+        events.extend(event for event in cache.get_many(_slot_keys(debate.id, seq)).values()
+                      if event['created_at'] >= started and _event_id(event) not in seen)
+    # Oldest first, so the newest ones end up in the highest slots
+    events = sorted(events, key=lambda event: event['created_at'])[-FEED_SIZE:]
+
+    # Take the next sequence numbers for them, so that appends from now on
+    # come after them.
+    try:
+        seq = cache.incr(seq_key, len(events))
+    except ValueError:
+        # incr doesn't extend a timeout, so the sequence doesn't have one
+        cache.add(seq_key, 0, None)
+        seq = cache.incr(seq_key, len(events))
+    first = seq - len(events) + 1
+    entries = {}
+    for n, event in enumerate(events, start=first):
+        entries[RECENT_EVENTS_SLOT_CACHE_ENTRY.format(debate.id, n % FEED_SIZE)] = event
+    # Older slots of the ring would still be read with them
+    stale = set(_slot_keys(debate.id, seq)) - set(entries)
+    cache.delete_many(list(stale))
+    cache.set_many(entries, FEED_TIMEOUT)
+    return events
@@ -13,6 +13,11 @@ REDIS_HOST
 NORECAPTCHA_SITE_KEY
 NORECAPTCHA_SECRET_KEY
 USE_CAPTCHA ("0" or "1")
+VOTE_BUFFERING ("0" or "1")
+KEYSET_PAGINATION ("0" or "1")
+RANKING_CACHE ("0" or "1")
+SEARCH_CACHE ("0" or "1")
+DUPLICATE_DETECTION ("0" or "1")
 MIXPANEL_KEY
 OPTIMIZELY_KEY
 """
@@ -62,6 +67,8 @@ CACHES = {}
 CACHES["default"] = {
     "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
     "LOCATION": "%s:11211" % os.getenv("MEMCACHED_HOST", "memcached"),
+    # For the atomic release of the periodic task locks (opendebates.periodic)
+    "OPTIONS": {"cache_cas": True},
     # 'VERSION': '{{ current_changeset }}',
 }
 CACHES["session"] = {
@@ -108,6 +115,11 @@ if "DBBACKUP_STORAGE" in os.environ:
 NORECAPTCHA_SITE_KEY = os.getenv("NORECAPTCHA_SITE_KEY")
 NORECAPTCHA_SECRET_KEY = os.getenv("NORECAPTCHA_SECRET_KEY")
 USE_CAPTCHA = bool(int(os.getenv("USE_CAPTCHA", "0")))
+VOTE_BUFFERING = bool(int(os.getenv("VOTE_BUFFERING", "0")))
+KEYSET_PAGINATION = bool(int(os.getenv("KEYSET_PAGINATION", "0")))
+RANKING_CACHE = bool(int(os.getenv("RANKING_CACHE", "0")))
+SEARCH_CACHE = bool(int(os.getenv("SEARCH_CACHE", "0")))
+DUPLICATE_DETECTION = bool(int(os.getenv("DUPLICATE_DETECTION", "0")))
 MIXPANEL_KEY = os.getenv("MIXPANEL_KEY")
 OPTIMIZELY_KEY = os.getenv("OPTIMIZELY_KEY")
 
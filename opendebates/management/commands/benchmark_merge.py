@@ -0,0 +1,105 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.timezone import now
+
+from opendebates.merging import merge_submissions
+from opendebates.models import Category, Debate, Submission, Vote, Voter
+
+
+class Rollback(Exception):
+    pass
+
+
+def legacy_merge(to_remove, duplicate_of, debate):
+    # The merge as moderator_views.merge used to do it, for comparison.
+    votes_already_cast = list(Vote.objects.filter(
+        submission=duplicate_of).values_list("voter_id", flat=True))
+    votes_to_merge = Vote.objects.filter(submission=to_remove).exclude(
+        voter__in=votes_already_cast)
+    if debate.previous_debate_time:
+        current_votes_to_merge = votes_to_merge.filter(
+            created_at__gt=debate.previous_debate_time).count()
+    else:
+        current_votes_to_merge = votes_to_merge.count()
+    if debate.debate_state:
+        local_votes_to_merge = votes_to_merge.filter(voter__state=debate.debate_state).count()
+    else:
+        local_votes_to_merge = 0
+    duplicate_of.votes += votes_to_merge.count()
+    duplicate_of.current_votes += current_votes_to_merge
+    duplicate_of.local_votes += local_votes_to_merge
+    duplicate_of.save()
+    votes_to_merge.update(original_merged_submission=to_remove, submission=duplicate_of)
+    to_remove.duplicate_of = duplicate_of
+    to_remove.moderated_at = now()
+    to_remove.save()
+
+
+class Command(BaseCommand):
+    help = ("Time merging two large synthetic submissions, with the merge engine and with "
+            "the previous implementation. Nothing is kept in the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debate', help="Prefix of the debate to use (default: the first)")
+        parser.add_argument('--votes', type=int, default=100000,
+                            help="Number of votes on each submission")
+        parser.add_argument('--overlap', type=float, default=0.1,
+                            help="Fraction of voters who voted for both submissions")
+
+    def handle(self, *args, **options):
+        debates = Debate.objects.all()
+        if options['debate']:
+            debates = debates.filter(prefix=options['debate'])
+        debate = debates.order_by('id').first()
+        if debate is None:
+            raise CommandError("No debate found")
+        category = Category.objects.filter(debate=debate).first()
+        if category is None:
+            raise CommandError("Debate %s has no categories" % debate)
+
+        for label, merge in (('merge engine', merge_submissions), ('legacy', legacy_merge)):
+            try:
+                with transaction.atomic():
+                    to_remove, duplicate_of = self.create_submissions(
+                        category, options['votes'], options['overlap'])
+                    start = time.time()
+                    merge(to_remove, duplicate_of, debate)
+                    seconds = time.time() - start
+                    raise Rollback
+            except Rollback:
+                pass
+            self.stdout.write("%-15s %8.3f s" % (label, seconds))
+
+    def create_submissions(self, category, votes, overlap):
+        created_at = now()
+        shared = int(votes * overlap)
+        stamp = int(time.time() * 1000)
+        voters = Voter.objects.bulk_create([
+            Voter(email='benchmark-%d-%d@example.com' % (stamp, n), zip='00000', state='NY')
+            for n in range(votes * 2 - shared)
+        ])
+        if not voters[0].pk:
+            # Older backends don't return the ids from bulk_create
+            voters = list(Voter.objects.filter(
+                email__startswith='benchmark-%d-' % stamp).order_by('id'))
+        submissions = []
+        for n, submission_voters in enumerate((voters[:votes], voters[votes - shared:])):
+            submission = Submission.objects.create(
+                category=category,
+                idea='Benchmark question %d' % n,
+                headline='Benchmark question %d' % n,
+                voter=submission_voters[0],
+                created_at=created_at,
+                ip_address='127.0.0.1',
+                approved=True,
+                votes=votes,
+            )
+            Vote.objects.bulk_create([
+                Vote(submission=submission, voter=voter, created_at=created_at,
+                     ip_address='127.0.0.1')
+                for voter in submission_voters
+            ], batch_size=10000)
+            submissions.append(submission)
+        return submissions
@@ -0,0 +1,118 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from opendebates import scoring, scoring_strategies
+from opendebates.models import Category, Debate, Submission, Vote, Voter
+
+
+VOTERS_SQL = """
+INSERT INTO {voter} (email, zip, state, source, created_at, phone_number, unsubscribed)
+SELECT 'benchmark-' || %s || '-' || n || '@example.com', '00000', 'NY', 'benchmark_scoring',
+       %s, '', false
+FROM generate_series(1, %s) AS n
+"""
+
+# Each submission gets votes from a random number of the voters, spread
+# over the last three days.
+VOTES_SQL = """
+INSERT INTO {vote} (submission_id, voter_id, created_at, source, ip_address, sessionid,
+                    request_headers, is_suspicious, is_invalid)
+SELECT s.id, r.id, %(now)s - random() * INTERVAL '3 days', 'benchmark_scoring', '127.0.0.1',
+       '', NULL, false, false
+FROM (SELECT id, row_number() OVER (ORDER BY id) AS n FROM {voter}
+      WHERE source = 'benchmark_scoring') AS r
+INNER JOIN (SELECT id, (random() * 2 * %(per_submission)s)::int AS votes FROM {submission}
+            WHERE "id" = ANY(%(submissions)s)) AS s
+    ON r.n <= s.votes
+"""
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Score a debate of synthetic submissions and votes with each trending score "
+            "backend, and report the time each takes. Nothing is kept in the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debate', help="Prefix of the debate to use (default: the first)")
+        parser.add_argument('--votes', type=int, default=5000000)
+        parser.add_argument('--submissions', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        if scoring.numpy is None:
+            raise CommandError("The numpy backend needs numpy to be installed")
+        debates = Debate.objects.all()
+        if options['debate']:
+            debates = debates.filter(prefix=options['debate'])
+        debate = debates.order_by('id').first()
+        if debate is None:
+            raise CommandError("No debate found")
+        category = Category.objects.filter(debate=debate).first()
+        if category is None:
+            raise CommandError("Debate %s has no categories" % debate)
+        number = options['submissions']
+        per_submission = options['votes'] // number
+        now = timezone.now()
+
+        try:
+            with transaction.atomic():
+                start = time.time()
+                voter = Voter.objects.create(
+                    email='benchmark-%d@example.com' % int(time.time() * 1000), zip='00000')
+                Submission.objects.bulk_create([
+                    Submission(category=category, idea='Benchmark question %d' % n,
+                               headline='Benchmark question %d' % n, voter=voter,
+                               created_at=now - scoring.SCORE_WINDOW * (n % 100 + 1),
+                               ip_address='127.0.0.1', approved=True,
+                               source='benchmark_scoring')
+                    for n in range(number)
+                ], batch_size=1000)
+                submission_ids = list(Submission.objects.filter(
+                    source='benchmark_scoring').values_list('id', flat=True))
+                with connection.cursor() as cursor:
+                    cursor.execute(VOTERS_SQL.format(voter=Voter._meta.db_table),
+                                   [voter.id, now, 2 * per_submission])
+                    cursor.execute(VOTES_SQL.format(vote=Vote._meta.db_table,
+                                                    voter=Voter._meta.db_table,
+                                                    submission=Submission._meta.db_table),
+                                   {'now': now, 'per_submission': per_submission,
+                                    'submissions': submission_ids})
+                    votes = cursor.rowcount
+                    cursor.execute("ANALYZE %s" % Vote._meta.db_table)
+                self.stdout.write("created %d submissions and %d votes in %.1f seconds" % (
+                    number, votes, time.time() - start))
+
+                where, params = scoring.DEBATE_WHERE, [debate.id]
+
+                start = time.time()
+                with connection.cursor() as cursor:
+                    cursor.execute(scoring.SCORE_SQL.format(where=where), [now, now] + params)
+                self.stdout.write("sql:   %.2f seconds" % (time.time() - start))
+
+                # The votes are only visible to this transaction, so read them
+                # from the master here instead of a replica.
+                start = time.time()
+                ids, scores = scoring.compute_scores(where, params, now, connection.alias)
+                computed = time.time()
+                scoring.write_scores(ids.tolist(), scores.tolist())
+                done = time.time()
+                self.stdout.write("numpy: %.2f seconds (%.2f reading and computing, "
+                                  "%.2f writing)" % (done - start, computed - start,
+                                                     done - computed))
+
+                # The other strategies share one read of the vote buckets
+                start = time.time()
+                aggregates = scoring.vote_buckets(where, params, now, connection.alias)
+                self.stdout.write("vote buckets: %.2f seconds" % (time.time() - start))
+                for name in sorted(scoring_strategies.STRATEGIES):
+                    start = time.time()
+                    scoring_strategies.compute_scores(name, debate, aggregates)
+                    self.stdout.write("%s: %.2f seconds" % (name, time.time() - start))
+                raise Rollback
+        except Rollback:
+            pass
@@ -0,0 +1,111 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from opendebates.models import Category, Debate, Submission, Voter
+
+
+WORDS = (
+    "tax economy jobs health care insurance immigration reform border climate energy "
+    "education student loans college veterans military defense foreign policy trade "
+    "tariffs wages minimum infrastructure roads bridges water farmers rural housing "
+    "rent mortgage retirement social security medicare medicaid drug prices opioid "
+    "police justice prison voting rights election campaign finance privacy internet "
+    "guns safety schools teachers science research space technology small business"
+).split()
+
+QUERIES = [
+    ('plain', 'health care', False),
+    ('plain', 'student loans college', False),
+    ('prefix', 'immig', True),
+    ('prefix', 'clim ener', True),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Grow a synthetic corpus of submissions and report the time of relevance-ranked "
+            "searches at each size, and whether they use the search index. The time should "
+            "follow the number of matches, not the size of the corpus. Nothing is kept in "
+            "the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debate', help="Prefix of the debate to use (default: the first)")
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help="Comma-separated corpus sizes (default: 1000,10000,100000)")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        debates = Debate.objects.all()
+        if options['debate']:
+            debates = debates.filter(prefix=options['debate'])
+        debate = debates.order_by('id').first()
+        if debate is None:
+            raise CommandError("No debate found")
+        category = Category.objects.filter(debate=debate).first()
+        if category is None:
+            raise CommandError("Debate %s has no categories" % debate)
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        rng = random.Random(0)
+
+        self.stdout.write("%10s %-8s %-24s %8s %10s  %s" % (
+            'corpus', 'mode', 'query', 'matches', 'ms/search', 'plan'))
+        try:
+            with transaction.atomic():
+                voter = Voter.objects.create(
+                    email='benchmark-%d@example.com' % int(time.time() * 1000), zip='00000')
+                created = 0
+                for size in sizes:
+                    self.add_submissions(category, voter, size - created, rng)
+                    created = size
+                    with connection.cursor() as cursor:
+                        cursor.execute("ANALYZE %s" % Submission._meta.db_table)
+                    for mode, term, prefix in QUERIES:
+                        self.time_search(debate, size, mode, term, prefix,
+                                         options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def add_submissions(self, category, voter, number, rng):
+        created_at = now()
+        batch = []
+        for n in range(number):
+            idea = ' '.join(rng.choice(WORDS) for i in range(rng.randint(8, 30)))
+            batch.append(Submission(
+                category=category, idea=idea, headline=idea[:80], keywords='benchmark',
+                voter=voter, created_at=created_at, ip_address='127.0.0.1', approved=True,
+                votes=int(rng.paretovariate(1.2)) - 1, source='benchmark_search',
+            ))
+        for start in range(0, len(batch), 1000):
+            Submission.objects.bulk_create(batch[start:start + 1000])
+        # bulk_create skips save(), which is what fills in the search_vector
+        Submission.objects.filter(
+            source='benchmark_search', search_vector__isnull=True,
+        ).update(search_vector=Submission._search_vectors)
+
+    def time_search(self, debate, size, mode, term, prefix, repeat):
+        ideas = Submission.objects.filter(
+            category__debate=debate, approved=True, duplicate_of__isnull=True,
+        ).ranked_search(term, prefix=prefix)
+        page = ideas.values_list('id', flat=True)[:25]
+        start = time.time()
+        for i in range(repeat):
+            list(page.all())
+        seconds = (time.time() - start) / repeat
+        matches = ideas.count()
+
+        sql, params = page.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        table = Submission._meta.db_table
+        scan = 'seq scan' if 'Seq Scan on %s' % table in plan else 'index'
+        self.stdout.write("%10d %-8s %-24s %8d %10.2f  %s" % (
+            size, mode, term, matches, seconds * 1000, scan))
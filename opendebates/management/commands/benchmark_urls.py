@@ -0,0 +1,36 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.urls import clear_url_caches, resolve, reverse
+
+from opendebates.resolvers import PrefixedUrlconf, get_prefixed_urlconf
+
+
+class Command(BaseCommand):
+    help = "Time resolving and reversing a prefixed URL with and without the urlconf registry."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='benchmark')
+        parser.add_argument('--number', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        number = options['number']
+        path = '/%s/questions/1/' % prefix
+
+        def per_request(make_urlconf):
+            # What one request does: resolve the path, then reverse a
+            # couple of URLs while rendering.
+            def run():
+                urlconf = make_urlconf(prefix)
+                resolve(path, urlconf=urlconf)
+                reverse('list_ideas', urlconf=urlconf)
+                reverse('vote', kwargs={'id': 1}, urlconf=urlconf)
+            return run
+
+        for label, make_urlconf in (('new urlconf per request', PrefixedUrlconf),
+                                    ('registry', get_prefixed_urlconf)):
+            clear_url_caches()
+            seconds = timeit.timeit(per_request(make_urlconf), number=number)
+            self.stdout.write("%-25s %8.1f us/request" % (label, seconds / number * 1e6))
+        clear_url_caches()
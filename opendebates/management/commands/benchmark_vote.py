@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from opendebates.models import Category, Debate, Submission, Voter
+from opendebates.voting import record_vote
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Record votes for a synthetic submission and report the queries and time per "
+            "vote. Nothing is kept in the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debate', help="Prefix of the debate to use (default: the first)")
+        parser.add_argument('--votes', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        debates = Debate.objects.all()
+        if options['debate']:
+            debates = debates.filter(prefix=options['debate'])
+        debate = debates.order_by('id').first()
+        if debate is None:
+            raise CommandError("No debate found")
+        category = Category.objects.filter(debate=debate).first()
+        if category is None:
+            raise CommandError("Debate %s has no categories" % debate)
+        number = options['votes']
+
+        try:
+            with transaction.atomic():
+                submitter = Voter.objects.create(
+                    email='benchmark-%d@example.com' % int(time.time() * 1000), zip='00000')
+                submission = Submission.objects.create(
+                    category=category,
+                    idea='Benchmark question',
+                    headline='Benchmark question',
+                    voter=submitter,
+                    created_at=now(),
+                    ip_address='127.0.0.1',
+                    approved=True,
+                )
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.time()
+                    for n in range(number):
+                        record_vote(submission, debate,
+                                    email='benchmark-%d-%d@example.com' % (submission.id, n),
+                                    zip='00000', ip_address='127.0.0.1',
+                                    sessionid='benchmark-%d' % n)
+                    seconds = time.time() - start
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write("votes:            %d" % number)
+        self.stdout.write("queries per vote: %.2f" % (len(queries) / float(number)))
+        self.stdout.write("ms per vote:      %.2f" % (seconds / number * 1000))
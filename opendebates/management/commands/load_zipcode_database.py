@@ -1,16 +1,69 @@
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
 from opendebates.models import ZipCode
-import csv
+from opendebates.zipcodes import invalidate_zipcodes
+
+
+STAGING_TABLE = 'opendebates_zipcode_staging'
+
+UPSERT_SQL = """
+WITH upserted AS (
+    INSERT INTO {table} AS z (zip, city, state)
+    SELECT DISTINCT ON (zip) zip, city, state FROM {staging} ORDER BY zip
+    ON CONFLICT (zip) DO UPDATE SET city = excluded.city, state = excluded.state
+    WHERE (z.city, z.state) IS DISTINCT FROM (excluded.city, excluded.state)
+    RETURNING xmax = 0 AS inserted
+)
+SELECT
+    COALESCE(SUM(CASE WHEN inserted THEN 1 ELSE 0 END), 0),
+    COALESCE(SUM(CASE WHEN inserted THEN 0 ELSE 1 END), 0)
+FROM upserted
+"""
+
+DELETE_SQL = """
+DELETE FROM {table} AS z
+WHERE NOT EXISTS (SELECT 1 FROM {staging} AS s WHERE s.zip = z.zip)
+"""
 
 
 class Command(BaseCommand):
+    help = ("Load ZIP codes from CSV files of zip,city,state lines. Rows are streamed into "
+            "the database with COPY, then merged into the ZipCode table.")
 
     def add_arguments(self, parser):
         parser.add_argument('csv_location', nargs='+')
+        parser.add_argument(
+            '--mode', choices=['merge', 'replace'], default='merge',
+            help="merge: add new ZIP codes and update changed ones (default). "
+                 "replace: also delete ZIP codes that aren't in the files.")
 
     def handle(self, *args, **options):
-        fp = open(options['csv_location'][0])
-        lines = csv.reader(fp)
-        for line in lines:
-            z = ZipCode(zip=line[0], city=line[1], state=line[2])
-            z.save()
+        start = time.time()
+        table = ZipCode._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE {staging} (zip varchar(10), city varchar(255), "
+                "state varchar(255)) ON COMMIT DROP".format(staging=STAGING_TABLE))
+            for location in options['csv_location']:
+                with open(location, 'rb') as fp:
+                    cursor.copy_expert(
+                        "COPY {staging} (zip, city, state) FROM STDIN WITH (FORMAT csv)"
+                        .format(staging=STAGING_TABLE), fp)
+            cursor.execute(UPSERT_SQL.format(table=table, staging=STAGING_TABLE))
+            inserted, updated = cursor.fetchone()
+            deleted = 0
+            if options['mode'] == 'replace':
+                cursor.execute(DELETE_SQL.format(table=table, staging=STAGING_TABLE))
+                deleted = cursor.rowcount
+
+        if inserted or updated or deleted:
+            # The rows didn't go through the ORM, so invalidate the cached
+            # ZipCode queries and lookup tables once, for the whole model.
+            ZipCode.objects.invalidate(ZipCode(pk=0), is_new_instance=True, model_cls=ZipCode)
+            invalidate_zipcodes()
+
+        self.stdout.write("%d inserted, %d updated, %d deleted in %.1f seconds" % (
+            inserted, updated, deleted, time.time() - start))
@@ -1,8 +1,14 @@
 from django.core.management.base import BaseCommand
 
-from opendebates.tasks import update_trending_scores
+from opendebates.tasks import trending_score_updates, update_debate_trending_scores
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help="Recompute every submission, not just the ones that changed.")
+
     def handle(self, *args, **options):
-        update_trending_scores()
+        # One debate after the other, without going through the workers
+        for kwargs in trending_score_updates(full=options['full']):
+            update_debate_trending_scores(**kwargs)
@@ -0,0 +1,111 @@
+"""
+Merging a duplicate submission into another one.
+
+``merge_submissions`` moves the votes of the duplicate to the submission
+it duplicates, except the votes of voters who already voted for that
+submission, and adds the moved votes to its tallies. The move and the
+total/current/local breakdown of the moved votes are a single
+``UPDATE ... RETURNING`` statement, so a merge costs the same number of
+queries however many votes are involved, and no voter ids are loaded
+into Python.
+
+Everything runs in one transaction. Both submission rows are locked
+first, which makes concurrent votes for either submission wait for the
+merge to finish (inserting a vote locks the submission row it points to).
+"""
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from .models import Submission, Vote, Voter
+
+
+# The outcome of a merge: the number of votes moved, how many of those
+# count towards current_votes and local_votes, and the number of votes left
+# on the duplicate because their voter already voted for the other one.
+MergeReport = namedtuple('MergeReport', ['moved', 'current', 'local', 'kept'])
+
+MERGE_VOTES_SQL = """
+WITH moved AS (
+    UPDATE {vote} AS v
+    SET submission_id = %(duplicate_of)s,
+        original_merged_submission_id = %(to_remove)s
+    FROM {voter} AS r
+    WHERE v.submission_id = %(to_remove)s
+    AND r.id = v.voter_id
+    AND NOT EXISTS (
+        SELECT 1 FROM {vote} AS t
+        WHERE t.submission_id = %(duplicate_of)s AND t.voter_id = v.voter_id
+    )
+    RETURNING v.created_at, r.state
+)
+SELECT
+    COUNT(*),
+    COALESCE(SUM({current}), 0),
+    COALESCE(SUM({local}), 0),
+    (SELECT COUNT(*) FROM {vote} WHERE submission_id = %(to_remove)s)
+FROM moved
+"""
+
+
+def merge_votes(to_remove, duplicate_of, previous_debate_time=None, local_state=None):
+    """
+    Move the votes of ``to_remove`` to ``duplicate_of`` and return a
+    MergeReport. Only updates the votes; see ``merge_submissions``.
+    """
+    params = {'to_remove': to_remove.pk, 'duplicate_of': duplicate_of.pk}
+    if previous_debate_time:
+        current = "CASE WHEN created_at > %(previous_debate_time)s THEN 1 ELSE 0 END"
+        params['previous_debate_time'] = previous_debate_time
+    else:
+        current = "1"
+    if local_state:
+        local = "CASE WHEN state = %(local_state)s THEN 1 ELSE 0 END"
+        params['local_state'] = local_state
+    else:
+        local = "0"
+    sql = MERGE_VOTES_SQL.format(
+        vote=Vote._meta.db_table,
+        voter=Voter._meta.db_table,
+        current=current,
+        local=local,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        moved, current_votes, local_votes, total = cursor.fetchone()
+    # The subquery sees the votes as they were before the UPDATE
+    return MergeReport(moved, int(current_votes), int(local_votes), total - moved)
+
+
+def merge_submissions(to_remove, duplicate_of, debate):
+    """
+    Merge ``to_remove`` into ``duplicate_of``: move the votes, update the
+    tallies and keywords of ``duplicate_of``, and mark ``to_remove`` as a
+    duplicate. Both instances are refreshed from the database before they
+    are changed. Returns a MergeReport.
+    """
+    with transaction.atomic():
+        # Lock in a consistent order so two merges can't deadlock
+        list(Submission.objects.select_for_update().filter(
+            pk__in=[to_remove.pk, duplicate_of.pk]).order_by('pk').values_list('pk'))
+        to_remove.refresh_from_db()
+        duplicate_of.refresh_from_db()
+
+        report = merge_votes(to_remove, duplicate_of,
+                             previous_debate_time=debate.previous_debate_time,
+                             local_state=debate.debate_state)
+
+        # The rows are locked, so the refreshed tallies are still current
+        duplicate_of.keywords = (duplicate_of.keywords or '') \
+            + " " + to_remove.idea \
+            + " " + (to_remove.keywords or '')
+        duplicate_of.has_duplicates = True
+        duplicate_of.votes += report.moved
+        duplicate_of.current_votes += report.current
+        duplicate_of.local_votes += report.local
+        duplicate_of.save()
+        to_remove.duplicate_of = duplicate_of
+        to_remove.moderated_at = now()
+        to_remove.save()
+    return report
@@ -1,7 +1,7 @@
 from django.http import Http404
 from django.utils.deprecation import MiddlewareMixin
 
-from opendebates.resolvers import PrefixedUrlconf
+from opendebates.resolvers import get_prefixed_urlconf
 from opendebates.utils import get_debate
 
 
@@ -13,7 +13,7 @@ class DebateMiddleware(MiddlewareMixin):
     def process_request(self, request):
         request.debate = get_debate(request)
         if request.debate:
-            request.urlconf = PrefixedUrlconf(request.debate.prefix)
+            request.urlconf = get_prefixed_urlconf(request.debate.prefix)
 
     def process_view(self, request, view_func, view_args, view_kwargs):
         if 'prefix' in view_kwargs:
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.25 on 2026-10-18 12:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opendebates', '0006_duplicate_detection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='debate',
+            name='scoring_strategy',
+            field=models.CharField(choices=[(b'hot', b'Hot: votes, recent votes and age'), (b'bayesian', b'Bayesian average of votes per hour'), (b'decay', b'Votes with exponential decay'), (b'local', b'Hot, with extra weight for votes from the debate state')], default=b'hot', help_text=b'How the Trending Now order of the questions is computed', max_length=32),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.25 on 2026-10-18 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opendebates', '0007_debate_scoring_strategy'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='submission',
+            name='random_id',
+        ),
+    ]
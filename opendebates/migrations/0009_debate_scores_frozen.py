@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.25 on 2026-10-18 13:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opendebates', '0008_remove_submission_random_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='debate',
+            name='scores_frozen',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
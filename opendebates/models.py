@@ -1,11 +1,15 @@
 # coding=utf-8
 import datetime
+import re
 from django.db import models
+from django.db.models import F, FloatField, Func
 from django.conf import settings
 from django.core.signing import Signer
 from django.urls import reverse
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.indexes import GinIndex
-from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.contrib.postgres.search import (SearchQuery, SearchRank, SearchVector,
+                                            SearchVectorField)
 from django.contrib.sites.models import Site
 from urllib import quote_plus
 from django.utils.http import urlquote
@@ -18,7 +22,12 @@ from opendebates import site_defaults
 
 
 NUMBER_OF_VOTES_CACHE_ENTRY = 'number_of_votes-{}'
-RECENT_EVENTS_CACHE_ENTRY = 'recent_events_cache_entry-{}'
+
+# How much votes count in the relevance of search results; 0 ranks on the
+# text alone. See SubmissionQuerySet.ranked_search.
+SEARCH_VOTES_WEIGHT = float(getattr(settings, 'SEARCH_VOTES_WEIGHT', 0.0))
+
+SEARCH_WORD_RE = re.compile(r'\w+', re.UNICODE)
 
 
 class Category(CachingMixin, models.Model):
@@ -51,6 +60,13 @@ class FlatPageMetadataOverride(models.Model):
 
 class Debate(CachingMixin, models.Model):
     THEME_CHOICES = [(theme, theme) for theme in settings.SITE_THEMES]
+    # See opendebates.scoring_strategies
+    SCORING_STRATEGY_CHOICES = [
+        ('hot', 'Hot: votes, recent votes and age'),
+        ('bayesian', 'Bayesian average of votes per hour'),
+        ('decay', 'Votes with exponential decay'),
+        ('local', 'Hot, with extra weight for votes from the debate state'),
+    ]
 
     site = models.ForeignKey(Site, related_name='debates', on_delete=models.CASCADE)
     prefix = models.SlugField()
@@ -60,6 +76,12 @@ class Debate(CachingMixin, models.Model):
     show_total_votes = models.BooleanField(default=True, blank=True)
     allow_sorting_by_votes = models.BooleanField(default=True, blank=True)
     allow_voting_and_submitting_questions = models.BooleanField(default=True, blank=True)
+    scoring_strategy = models.CharField(
+        max_length=32, choices=SCORING_STRATEGY_CHOICES, default='hot',
+        help_text="How the Trending Now order of the questions is computed",
+    )
+    # Set once the debate is no longer active; see opendebates.activity
+    scores_frozen = models.BooleanField(default=False, editable=False)
     debate_time = models.DateTimeField(
         default=datetime.datetime(2099, 1, 1),
         help_text="Enter time that debate starts in timezone %s" % settings.TIME_ZONE,
@@ -120,9 +142,66 @@ class Debate(CachingMixin, models.Model):
         return u'/'.join([self.site.domain, self.prefix])
 
 
+class PrefixSearchQuery(SearchQuery):
+    """
+    A SearchQuery matching every word of the term as a prefix, so that
+    "immig ref" matches "immigration reform", for type-ahead. With
+    ``any_word``, matching any of the words is enough.
+    """
+
+    def __init__(self, value, any_word=False, **extra):
+        operator = u' | ' if any_word else u' & '
+        value = operator.join(u'%s:*' % word for word in SEARCH_WORD_RE.findall(value))
+        super(PrefixSearchQuery, self).__init__(value, **extra)
+
+    # The value is already in tsquery syntax, with only word characters;
+    # plainto_tsquery would drop the operators.
+    function = 'to_tsquery'
+
+    def as_sql(self, compiler, connection):
+        # SearchQuery.as_sql with the function above
+        params = [self.value]
+        if self.config:
+            config_sql, config_params = compiler.compile(self.config)
+            template = '{}({}::regconfig, %s)'.format(self.function, config_sql)
+            params = config_params + params
+        else:
+            template = '{}(%s)'.format(self.function)
+        if self.invert:
+            template = '!!({})'.format(template)
+        return template, params
+
+
+class SearchRankCD(SearchRank):
+    # Cover density ranking, which rewards the words of the query being
+    # close together; normalization 1 keeps long submissions from
+    # outranking short ones just by repeating words.
+    function = 'ts_rank_cd'
+    template = '%(function)s(%(expressions)s, 1)'
+
+
 class SubmissionQuerySet(models.QuerySet):
-    def search(self, term):
-        return self.filter(search_vector=term)
+    def search(self, term, prefix=False):
+        return self.filter(search_vector=PrefixSearchQuery(term) if prefix else term)
+
+    def ranked_search(self, term, prefix=False, votes_weight=None):
+        """
+        Search for ``term``, ordered by relevance: the ts_rank_cd of the
+        search_vector, times ``1 + votes_weight * ln(1 + votes)``.
+
+        Only the matches are ranked, and they are found with the GIN index
+        on search_vector.
+        """
+        if votes_weight is None:
+            votes_weight = SEARCH_VOTES_WEIGHT
+        query = PrefixSearchQuery(term) if prefix else SearchQuery(term)
+        relevance = SearchRankCD(F('search_vector'), query)
+        if votes_weight:
+            relevance = relevance * (1 + votes_weight * Func(
+                F('votes') + 1, function='LN', output_field=FloatField()))
+        # Not "rank", which is the submission's place in the trending list
+        return self.filter(search_vector=query).annotate(
+            relevance=relevance).order_by('-relevance', '-votes', '-id')
 
 
 class Submission(models.Model):
@@ -168,8 +247,6 @@ class Submission(models.Model):
     score = models.FloatField(default=0, db_index=True)
     rank = models.FloatField(default=0, db_index=True)
 
-    random_id = models.FloatField(default=0, db_index=True)
-
     # A field in the database that is used when searching this model. Instead of
     # searching all of the relevant fields each time a user searches, we prepopulate
     # the search_vector field (based on Submission._search_vectors) anytime a
@@ -444,6 +521,42 @@ class Flag(models.Model):
         ]
 
 
+class SubmissionFingerprint(models.Model):
+    """
+    The MinHash signature of the text of a submission, and the LSH band
+    hashes used to find the submissions with similar text. See
+    opendebates.duplicates.
+    """
+    submission = models.OneToOneField(Submission, primary_key=True, related_name='fingerprint',
+                                      on_delete=models.CASCADE)
+    minhash = ArrayField(models.BigIntegerField())
+    bands = ArrayField(models.BigIntegerField())
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['bands'])
+        ]
+
+
+class DuplicateCandidate(models.Model):
+    """
+    A pair of submissions whose text is similar enough that moderators
+    may want to merge them, found by the find_duplicates task.
+    """
+    to_remove = models.ForeignKey(Submission, related_name='duplicate_candidates',
+                                  on_delete=models.CASCADE)
+    duplicate_of = models.ForeignKey(Submission, related_name='+', on_delete=models.CASCADE)
+    # The estimated Jaccard similarity of the texts, from 0 to 1
+    score = models.FloatField()
+    created_at = models.DateTimeField(default=now)
+    reviewed = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = [
+            ('to_remove', 'duplicate_of'),
+        ]
+
+
 class TopSubmissionCategory(models.Model):
     debate = models.ForeignKey('Debate', related_name='top_categories', on_delete=models.CASCADE)
 
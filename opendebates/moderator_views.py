@@ -2,7 +2,7 @@ from djangohelpers.lib import rendered_with, allow_http
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.db.models import Count
+from django.db.models import Count, Q
 from django.http import HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, redirect
 from django.utils.translation import ugettext as _
@@ -10,7 +10,9 @@ from django.utils.timezone import now
 
 from opendebates_emails.models import send_email
 from .forms import ModerationForm, TopSubmissionForm
-from .models import Submission, Vote, Flag
+from .merging import merge_submissions
+from .models import DuplicateCandidate, Submission, Flag
+from .votes_cast import invalidate_merged_votes_cast
 
 
 @rendered_with("opendebates/moderation/preview.html")
@@ -66,36 +68,8 @@ def merge(request):
         if request.POST.get("send_email") == "yes":
             send_email("your_idea_is_duplicate", {"idea": to_remove})
     elif request.POST.get("action").lower() == "merge":
-        votes_already_cast = list(Vote.objects.filter(
-            submission=duplicate_of).values_list("voter_id", flat=True))
-        votes_to_merge = Vote.objects.filter(submission=to_remove).exclude(
-            voter__in=votes_already_cast)
-
-        previous_debate_time = request.debate.previous_debate_time
-        if previous_debate_time:
-            current_votes_to_merge = votes_to_merge.filter(
-                created_at__gt=previous_debate_time).count()
-        else:
-            current_votes_to_merge = votes_to_merge.count()
-
-        local_state = request.debate.debate_state
-        if local_state:
-            local_votes_to_merge = votes_to_merge.filter(voter__state=local_state).count()
-        else:
-            local_votes_to_merge = 0
-
-        duplicate_of.keywords = (duplicate_of.keywords or '') \
-            + " " + to_remove.idea \
-            + " " + (to_remove.keywords or '')
-        duplicate_of.has_duplicates = True
-        duplicate_of.votes += votes_to_merge.count()
-        duplicate_of.current_votes += current_votes_to_merge
-        duplicate_of.local_votes += local_votes_to_merge
-        duplicate_of.save()
-        votes_to_merge.update(original_merged_submission=to_remove, submission=duplicate_of)
-        to_remove.duplicate_of = duplicate_of
-        to_remove.moderated_at = now()
-        to_remove.save()
+        merge_submissions(to_remove, duplicate_of, request.debate)
+        invalidate_merged_votes_cast(to_remove, duplicate_of)
         msg = _(u'Question has been merged.')
         if request.POST.get("send_email") == "yes":
             send_email("your_idea_is_merged", {"idea": to_remove})
@@ -109,6 +83,12 @@ def merge(request):
         duplicate_of=duplicate_of,
         reviewed=False
     ).update(reviewed=True)
+    # and the duplicate candidates of the pair, either way around
+    DuplicateCandidate.objects.filter(
+        Q(to_remove=to_remove, duplicate_of=duplicate_of) |
+        Q(to_remove=duplicate_of, duplicate_of=to_remove),
+        reviewed=False
+    ).update(reviewed=True)
 
     messages.info(request, msg)
     return redirect('moderation_home')
@@ -169,9 +149,21 @@ def home(request):
         to_remove__category__debate=request.debate
     ).exclude(duplicate_of=None).exclude(reviewed=True).order_by('id')
 
+    # likely duplicates found by the find_duplicates task, most similar
+    # first, while both submissions are still up
+    duplicate_candidates = DuplicateCandidate.objects.filter(
+        to_remove__category__debate=request.debate,
+        reviewed=False,
+        to_remove__approved=True,
+        to_remove__duplicate_of=None,
+        duplicate_of__approved=True,
+        duplicate_of__duplicate_of=None,
+    ).select_related('to_remove', 'duplicate_of').order_by('-score', 'id')
+
     return {
         'flagged_for_removal': flagged_for_removal,
         'merge_flags': merge_flags,
+        'duplicate_candidates': duplicate_candidates,
     }
 
 
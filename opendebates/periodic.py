@@ -0,0 +1,137 @@
+"""
+Overlap protection and instrumentation for the periodic tasks.
+
+``@periodic(name)`` wraps the function of a task that runs on the
+schedule of the ``name`` entry of CELERYBEAT_SCHEDULE, either for one
+debate (its first argument is the debate id) or, with
+``per_debate=False``, for the whole site:
+
+* Only one run of the task for the same debate runs at a time. Each run
+  takes a lock in the cache, which expires after ``lock_timeout`` seconds
+  (three intervals by default) in case a worker dies holding it. A run
+  that finds the lock taken is skipped, and a run only releases its own
+  lock. On memcached with the client's ``cache_cas`` option on, the
+  release is atomic; on other caches, a lock that expires and is taken
+  by another run just as the first one finishes can still be released
+  early, so keep ``lock_timeout`` well above the task's running time.
+* A run that takes longer than the interval makes the next runs back off:
+  they're skipped for one more interval, doubling with each slow run in a
+  row up to MAX_BACKOFF_INTERVALS intervals. A run that finishes within
+  the interval ends the backoff.
+* Each run reports its duration and the rows it touched (the number the
+  task function returns, if any), and each skipped run is counted. The
+  metrics are logged, and recorded as New Relic custom metrics under
+  Custom/Tasks/<name>/ when the agent is installed.
+* Errors are logged and counted instead of propagating, so that one
+  debate doesn't stop the others.
+"""
+import functools
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    import newrelic.agent
+except ImportError:  # The metrics are only logged then
+    newrelic = None
+
+
+logger = logging.getLogger(__name__)
+
+
+TASK_LOCK_CACHE_ENTRY = 'task_lock-{}-{}'
+TASK_BACKOFF_CACHE_ENTRY = 'task_backoff-{}-{}'
+
+MAX_BACKOFF_INTERVALS = 16
+
+# For the tasks that aren't in the schedule
+DEFAULT_INTERVAL = 60
+
+
+def task_interval(name):
+    """
+    Return the number of seconds between the scheduled runs of ``name``.
+    """
+    entry = settings.CELERYBEAT_SCHEDULE.get(name)
+    if entry is None:
+        return DEFAULT_INTERVAL
+    schedule = entry['schedule']
+    if hasattr(schedule, 'total_seconds'):
+        return schedule.total_seconds()
+    return float(schedule)
+
+
+def record_metric(name, metric, value):
+    logger.debug("task %s: %s=%s", name, metric, value)
+    if newrelic is not None:
+        newrelic.agent.record_custom_metric('Custom/Tasks/%s/%s' % (name, metric), value)
+
+
+def release_lock(lock, token):
+    """
+    Delete ``lock`` if it still holds ``token``.
+    """
+    client = getattr(cache, '_cache', None)
+    if getattr(client, 'cache_cas', False):
+        # python-memcached: cas fails if the lock changed since gets, and
+        # a negative expiry makes memcached drop the item.
+        key = cache.make_key(lock)
+        try:
+            if client.gets(key) == token:
+                client.cas(key, token, -1)
+        finally:
+            client.cas_ids.pop(key, None)
+    elif cache.get(lock) == token:
+        cache.delete(lock)
+
+
+def periodic(name, per_debate=True, lock_timeout=None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            debate_id = (args[0] if args else kwargs['debate_id']) if per_debate else 'all'
+            interval = task_interval(name)
+            lock = TASK_LOCK_CACHE_ENTRY.format(name, debate_id)
+            backoff_key = TASK_BACKOFF_CACHE_ENTRY.format(name, debate_id)
+
+            backoff = cache.get(backoff_key)
+            if backoff is not None and backoff[0] > time.time():
+                logger.debug("%s: backing off for debate %s", name, debate_id)
+                record_metric(name, 'skipped', 1)
+                return None
+            # The token marks the lock as this run's, so that a run whose
+            # lock expired doesn't release the next run's.
+            token = uuid.uuid4().hex
+            if not cache.add(lock, token, lock_timeout or 3 * interval):
+                logger.debug("%s: already running for debate %s", name, debate_id)
+                record_metric(name, 'skipped', 1)
+                return None
+
+            start = time.time()
+            try:
+                rows = func(*args, **kwargs)
+            except Exception:
+                logger.exception("Unexpected error in %s for debate %s", name, debate_id)
+                record_metric(name, 'errors', 1)
+                rows = None
+            finally:
+                release_lock(lock, token)
+            duration = time.time() - start
+
+            record_metric(name, 'duration', duration)
+            if rows is not None:
+                record_metric(name, 'rows', rows)
+            if duration > interval:
+                intervals = min(2 * backoff[1] if backoff else 1, MAX_BACKOFF_INTERVALS)
+                logger.warning("%s took %.1f seconds for debate %s; skipping the next "
+                               "%.0f seconds", name, duration, debate_id, intervals * interval)
+                cache.set(backoff_key, (time.time() + intervals * interval, intervals),
+                          MAX_BACKOFF_INTERVALS * 2 * interval)
+            elif backoff is not None:
+                cache.delete(backoff_key)
+            return rows
+        return wrapper
+    return decorator
@@ -18,6 +18,7 @@ urlpatterns = [
     url(r'^category/(?P<cat_id>\d+)/search/$', views.category_search, name="category_search"),
     url(r'^search/$', views.search_ideas, name="search_ideas"),
     url(r'^questions/$', views.questions, name="questions"),
+    url(r'^questions/similar/$', views.similar, name="similar_questions"),
     # url(r'^candidates/$', views.list_candidates', name="candidates"),
 
     url(r'^moderation/remove/$', moderator_views.remove, name="moderation_remove"),
@@ -0,0 +1,184 @@
+"""
+Precomputed rankings of the question lists.
+
+For every debate, ``update_rankings`` computes the ordered list of
+submission ids for each sort option, for the whole debate and for each
+category, with and without the "citations only" filter. Each list is
+stored in the cache as a packed array of ints.
+
+The list views then page through a ``RankedSubmissions`` sequence, which
+slices the id list and only fetches the rows of the current page.
+
+The random sort isn't precomputed: ``get_random_ranking`` computes the
+order of a list once per random sort window, the first time it's asked
+for, whether or not RANKING_CACHE is on. Ordering by the hash in the
+database would hash and sort every submission of the list on every page.
+"""
+import logging
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Submission
+from .utils import (RANDOM_SORT_SECONDS, SORT_ORDERINGS, pack_ids, random_key, random_seed,
+                    unpack_ids)
+
+
+logger = logging.getLogger(__name__)
+
+
+RANKING_CACHE_ENTRY = 'ranking-{}-{}-{}-{}'
+RANDOM_RANKING_CACHE_ENTRY = 'random_ranking-{}-{}-{}-{}'
+
+# Rankings are rebuilt every minute; keep them a little longer than that
+# so a late rebuild doesn't send every list view back to the database.
+RANKING_TIMEOUT = 5 * 60
+# The rankings of debates that are no longer active are rebuilt only when
+# they're missing. Let them expire now and then, so that moderation still
+# reaches them.
+FROZEN_RANKING_TIMEOUT = int(getattr(settings, 'FROZEN_RANKING_TIMEOUT', 60 * 60))
+
+# Every sort but random, which get_random_ranking takes care of
+RANKED_SORTS = [sort for sort in SORT_ORDERINGS if sort != 'random']
+
+RankingRow = namedtuple('RankingRow', [
+    'id', 'category_id', 'citation_verified', 'editors_pick', 'score',
+    'created_at', 'votes', 'local_votes', 'current_votes',
+])
+
+
+def ranking_key(debate_id, category_id, sort, citations_only):
+    return RANKING_CACHE_ENTRY.format(
+        debate_id, category_id or 'all', sort, 1 if citations_only else 0)
+
+
+def rank(rows, sort):
+    """
+    Return the ids of ``rows`` in the same order as ``utils.sort_list``.
+    """
+    ordering = SORT_ORDERINGS[sort]
+    column = ordering[0].lstrip('-')
+    reverse = ordering[0].startswith('-')
+    ordered = sorted(rows, key=lambda row: (getattr(row, column), row.id), reverse=reverse)
+    return [row.id for row in ordered]
+
+
+def build_rankings(debate):
+    """
+    Return a dict of cache key -> packed id list for every list of
+    ``debate`` in each of RANKED_SORTS.
+    """
+    rows = [RankingRow(*values) for values in Submission.objects.filter(
+        category__debate=debate,
+        approved=True,
+        duplicate_of__isnull=True,
+    ).values_list(*RankingRow._fields)]
+
+    subsets = {None: rows}
+    for row in rows:
+        subsets.setdefault(row.category_id, []).append(row)
+
+    rankings = {}
+    for category_id, category_rows in subsets.items():
+        cited_rows = [row for row in category_rows if row.citation_verified]
+        for citations_only, subset in ((False, category_rows), (True, cited_rows)):
+            for sort in RANKED_SORTS:
+                key = ranking_key(debate.id, category_id, sort, citations_only)
+                rankings[key] = pack_ids(rank(subset, sort))
+    return rankings
+
+
+def update_rankings(debate, timeout=RANKING_TIMEOUT, frozen=False):
+    """
+    Store the rankings of ``debate``. Frozen rankings are kept for
+    FROZEN_RANKING_TIMEOUT.
+    """
+    if frozen:
+        timeout = FROZEN_RANKING_TIMEOUT
+    rankings = build_rankings(debate)
+    cache.set_many(rankings, timeout)
+    logger.debug("update_rankings: stored %d rankings for %s", len(rankings), debate)
+    return len(rankings)
+
+
+def has_rankings(debate):
+    return cache.get(ranking_key(debate.id, None, 'trending', False)) is not None
+
+
+class RankedSubmissions(object):
+    """
+    A sequence of Submissions backed by a precomputed list of ids.
+
+    Slicing it fetches only the sliced rows. Submissions that were removed
+    or merged after the ranking was computed are skipped.
+    """
+
+    def __init__(self, ids, queryset=None):
+        self.ids = ids
+        if queryset is None:
+            queryset = Submission.objects.filter(
+                approved=True,
+                duplicate_of__isnull=True,
+            ).select_related("voter", "category", "voter__user")
+        self.queryset = queryset
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = list(self.ids[index])
+            submissions = self.queryset.in_bulk(ids)
+            return [submissions[id] for id in ids if id in submissions]
+        return self[index:index + 1][0]
+
+
+def get_ranked_submissions(debate, sort, citations_only, category_id=None):
+    """
+    Return the precomputed ranking as a RankedSubmissions, or None if it
+    isn't available.
+    """
+    if sort == 'random':
+        return get_random_ranking(debate, citations_only, category_id)
+    if not settings.RANKING_CACHE or sort not in SORT_ORDERINGS:
+        return None
+    data = cache.get(ranking_key(debate.id, category_id, sort, citations_only))
+    if data is None:
+        return None
+    return RankedSubmissions(unpack_ids(data))
+
+
+def get_random_ranking(debate, citations_only, category_id=None, seed=None):
+    """
+    Return the random sort of a list in the window ``seed`` (by default
+    the current one) as a RankedSubmissions. Only the ids of the list are
+    read, once per window; the ranking is kept for two windows, for the
+    cursors made near the end of one.
+    """
+    if seed is None:
+        seed = random_seed()
+    key = RANDOM_RANKING_CACHE_ENTRY.format(
+        debate.id, category_id or 'all', 1 if citations_only else 0, seed)
+    data = cache.get(key)
+    if data is None:
+        ids = Submission.objects.filter(
+            category__debate=debate,
+            approved=True,
+            duplicate_of__isnull=True,
+        )
+        if category_id:
+            ids = ids.filter(category=category_id)
+        if citations_only:
+            ids = ids.filter(citation_verified=True)
+        ids = sorted(ids.values_list('id', flat=True),
+                     key=lambda id: (random_key(id, seed), id), reverse=True)
+        data = pack_ids(ids)
+        cache.set(key, data, 2 * RANDOM_SORT_SECONDS)
+    return RankedSubmissions(unpack_ids(data))
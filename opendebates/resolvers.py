@@ -1,22 +1,69 @@
+import threading
+from collections import OrderedDict
 from importlib import import_module
 
 from django.conf.urls import url, include
+from django.urls import clear_url_caches
+
+
+# The most prefixed urlconfs to keep; a site has a handful of debates.
+MAX_PREFIXED_URLCONFS = 100
 
 
 class PrefixedUrlconf(object):
     def __init__(self, prefix):
         self.prefix = prefix
+        self._urlpatterns = None
 
     @property
     def urlpatterns(self):
-        url_module = import_module('opendebates.urls')
-
-        return [
-            pattern
-            if (
-                not hasattr(pattern, 'urlconf_name') or
-                getattr(pattern.urlconf_name, '__name__', None) != 'opendebates.prefixed_urls'
-            ) else
-            url(r'^{}/'.format(self.prefix), include('opendebates.prefixed_urls'))
-            for pattern in url_module.urlpatterns
-        ]
+        if self._urlpatterns is None:
+            url_module = import_module('opendebates.urls')
+
+            self._urlpatterns = [
+                pattern
+                if (
+                    not hasattr(pattern, 'urlconf_name') or
+                    getattr(pattern.urlconf_name, '__name__', None) != 'opendebates.prefixed_urls'
+                ) else
+                url(r'^{}/'.format(self.prefix), include('opendebates.prefixed_urls'))
+                for pattern in url_module.urlpatterns
+            ]
+        return self._urlpatterns
+
+
+class UrlconfRegistry(object):
+    """
+    Keeps one PrefixedUrlconf per prefix.
+
+    Django caches a resolver (with its reverse lookup tables) per urlconf
+    object, so handing out the same urlconf for a prefix on every request
+    lets those caches hit. Least recently used prefixes are dropped past
+    ``max_size``.
+    """
+
+    def __init__(self, max_size=MAX_PREFIXED_URLCONFS):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.urlconfs = OrderedDict()
+
+    def get(self, prefix):
+        with self.lock:
+            try:
+                urlconf = self.urlconfs.pop(prefix)
+            except KeyError:
+                urlconf = PrefixedUrlconf(prefix)
+                if len(self.urlconfs) >= self.max_size:
+                    self.urlconfs.popitem(last=False)
+                    # Django's resolver cache is unbounded; drop the
+                    # resolver of the evicted urlconf with the rest.
+                    clear_url_caches()
+            self.urlconfs[prefix] = urlconf
+        return urlconf
+
+
+registry = UrlconfRegistry()
+
+
+def get_prefixed_urlconf(prefix):
+    return registry.get(prefix)
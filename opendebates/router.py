@@ -1,12 +1,24 @@
+import logging
+import os
 import random
 import threading
+import time
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
 from django.utils.deprecation import MiddlewareMixin
 
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
+
+
+logger = logging.getLogger(__name__)
+
 
 # The name of the session variable or cookie used by the middleware
 PINNING_KEY = getattr(settings, 'MASTER_PINNING_KEY', 'master_db_pinned')
@@ -16,19 +28,84 @@ PINNING_KEY = getattr(settings, 'MASTER_PINNING_KEY', 'master_db_pinned')
 # behind, so keep a user who has written to the database on the master
 # database for longer than that after their last write.
 PINNING_SECONDS = int(getattr(settings, 'MASTER_PINNING_SECONDS', 10))
+
+# If set, only read from replicas that are at most this many seconds behind
+# the master, as sampled by a ReplicaMonitor in the background, and read
+# from the master if none are. If None, rotate through all the replicas.
+MAX_LAG_SECONDS = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', None)
+if MAX_LAG_SECONDS is not None:
+    MAX_LAG_SECONDS = float(MAX_LAG_SECONDS)
+
+# How often the ReplicaMonitor samples the lag of each replica.
+LAG_SAMPLE_SECONDS = float(getattr(settings, 'REPLICA_LAG_SAMPLE_SECONDS', 5))
+
+# If True, pin a user by the master's WAL position after their write (in
+# a cookie) instead of by time (in the session): their reads go to any
+# replica that has replayed past that position, and to the master only
+# if none has. The cookie expires after LSN_PINNING_SECONDS, by which time
+# every healthy replica should have caught up.
+LSN_PINNING = getattr(settings, 'LSN_PINNING', False)
+LSN_PINNING_SECONDS = int(getattr(settings, 'LSN_PINNING_SECONDS', 60))
+
 READONLY_METHODS = ['GET', 'HEAD']
 
 READMOSTLY_MODELS = ['Zipcode', 'Category']
 
 
-class RoutingState(threading.local):
+class ContextLocal(object):
+    """
+    Attributes that are local to the current execution context.
+
+    With ``contextvars`` (Python 3.7+) that's the current thread, greenlet
+    or asyncio task. Without it, it's the current thread; under gevent,
+    ``threading.local`` is greenlet-local once the standard library is
+    monkey-patched, as the gevent worker classes of gunicorn and Celery do.
+
+    Values are copied on write, so a context that inherits another one's
+    values (e.g. a new asyncio task) never changes the original's.
+    """
+    def __init__(self, **defaults):
+        object.__setattr__(self, '_defaults', defaults)
+        if ContextVar is not None:
+            object.__setattr__(self, '_var', ContextVar('%s-%d' % (type(self).__name__, id(self))))
+        else:
+            object.__setattr__(self, '_local', threading.local())
+
+    def _get_values(self):
+        if ContextVar is not None:
+            return self._var.get(self._defaults)
+        return getattr(self._local, 'values', self._defaults)
+
+    def _set_values(self, values):
+        if ContextVar is not None:
+            self._var.set(values)
+        else:
+            self._local.values = values
+
+    def __getattr__(self, name):
+        try:
+            return self._get_values()[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        values = dict(self._get_values())
+        values[name] = value
+        self._set_values(values)
+
+
+class RoutingState(ContextLocal):
     """
-    Per-thread routing state:
-    subclass 'threading.local' so that we can set default values.
+    Per-context routing state.
     """
     def __init__(self):
-        self.read_write = True
-        self.written = False
+        super(RoutingState, self).__init__(
+            read_write=True,
+            written=False,
+            read_db=None,
+            min_lsn=None,
+            lsn_db=None,
+        )
 
     def is_readwrite(self):
         return self.read_write
@@ -48,6 +125,19 @@ class RoutingState(threading.local):
     def was_written(self):
         return self.written
 
+    def set_read_db(self, db):
+        self.read_db = db
+
+    def get_read_db(self):
+        return self.read_db
+
+    def set_min_lsn(self, lsn):
+        self.min_lsn = lsn
+        self.lsn_db = None
+
+    def get_min_lsn(self):
+        return self.min_lsn
+
 
 state = RoutingState()
 
@@ -76,25 +166,210 @@ def was_db_written():
     return state.was_written()
 
 
+def get_read_db():
+    """
+    Return the database the last read of this thread was routed to, e.g.
+    for logging which database served a request.
+    """
+    return state.get_read_db()
+
+
+def parse_lsn(lsn):
+    """
+    Convert a PostgreSQL LSN like '16/B374D848' to an int, or return None
+    if ``lsn`` isn't one.
+    """
+    try:
+        high, low = lsn.split('/')
+        return (int(high, 16) << 32) + int(low, 16)
+    except (AttributeError, ValueError):
+        return None
+
+
+def wal_function(connection, name, old_name):
+    # The WAL functions were renamed in PostgreSQL 10
+    return name if connection.pg_version >= 100000 else old_name
+
+
+def current_lsn(db):
+    """
+    Return the current WAL position of the master ``db``, as a string.
+    """
+    connection = connections[db]
+    function = wal_function(connection, 'pg_current_wal_lsn', 'pg_current_xlog_location')
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT %s()' % function)
+        return cursor.fetchone()[0]
+
+
+def replay_lsn(db):
+    """
+    Return the WAL position the replica ``db`` has replayed, as an int.
+    """
+    connection = connections[db]
+    function = wal_function(connection, 'pg_last_wal_replay_lsn', 'pg_last_xlog_replay_location')
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT %s()' % function)
+        return parse_lsn(cursor.fetchone()[0])
+
+
+def pinning_seconds():
+    # A user must stay on the master until the replicas we may read from
+    # have caught up with their write.
+    if MAX_LAG_SECONDS is None:
+        return PINNING_SECONDS
+    return max(PINNING_SECONDS, MAX_LAG_SECONDS)
+
+
+class ReplicaMonitor(object):
+    """
+    Samples the replication lag of the replica databases in a background
+    thread, every LAG_SAMPLE_SECONDS.
+
+    A replica whose lag can't be sampled (e.g. it's down), or whose last
+    sample is too old, has an unknown lag and should not be read from.
+    """
+
+    # Zero if the replica has replayed everything the master had written
+    # when the sample started (on a quiet master the last replayed
+    # transaction can be arbitrarily old), otherwise the age of the last
+    # transaction it replayed. Comparing with the master rather than with
+    # what the replica received catches a replica whose WAL receiver
+    # disconnected: it replays everything it received, then falls further
+    # and further behind.
+    LAG_SQL = """
+    SELECT pg_is_in_recovery(), {replayed}() >= %s::pg_lsn,
+        EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+    """
+
+    def __init__(self, dbs, interval=None):
+        self.dbs = list(dbs)
+        self.interval = LAG_SAMPLE_SECONDS if interval is None else interval
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def measure_lag(self, db):
+        """
+        Return the lag of ``db`` in seconds, or None if it's behind the
+        master but hasn't replayed any transaction yet.
+        """
+        master_lsn = current_lsn(settings.MASTER_DATABASE)
+        connection = connections[db]
+        with connection.cursor() as cursor:
+            cursor.execute(self.LAG_SQL.format(
+                replayed=wal_function(
+                    connection, 'pg_last_wal_replay_lsn', 'pg_last_xlog_replay_location'),
+            ), [master_lsn])
+            replica, caught_up, lag = cursor.fetchone()
+        if not replica or caught_up:
+            return 0.0
+        return None if lag is None else float(lag)
+
+    def record(self, db, lag):
+        with self.lock:
+            self.samples[db] = (lag, time.time())
+
+    def sample(self):
+        for db in self.dbs:
+            try:
+                lag = self.measure_lag(db)
+            except Exception:
+                logger.warning("Unable to sample the replication lag of %s", db, exc_info=True)
+                connections[db].close()
+                lag = None
+            self.record(db, lag)
+
+    def lag(self, db):
+        """
+        Return the last sampled lag of ``db`` in seconds, or None if unknown.
+        """
+        with self.lock:
+            lag, sampled_at = self.samples.get(db, (None, 0))
+        if time.time() - sampled_at > self.interval * 3:
+            return None
+        return lag
+
+    def run(self):
+        while True:
+            self.sample()
+            time.sleep(self.interval)
+
+    def start(self):
+        """
+        Start sampling in this process, if not started yet. Safe to call on
+        every query; threads don't survive a fork, so this also restarts
+        sampling in forked worker processes.
+        """
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.samples = {}
+        thread = threading.Thread(target=self.run, name='replica-monitor')
+        thread.daemon = True
+        thread.start()
+
+
+def weighted_choice(weights):
+    """
+    Return one key of the dict ``weights``, chosen with a probability
+    proportional to its value.
+    """
+    total = sum(weights.values())
+    point = random.uniform(0, total)
+    for key, weight in weights.items():
+        point -= weight
+        if point <= 0:
+            return key
+    return key
+
+
 class DBRoutingMiddleware(MiddlewareMixin):
     def process_request(self, request):
         clear_db_written_flag()
+        state.set_read_db(None)
+        state.set_min_lsn(None)
         pinned_until = request.session.get(PINNING_KEY, False)
         pinned = pinned_until and pinned_until > datetime.now()
         if pinned or request.method not in READONLY_METHODS:
             set_thread_readwrite_db()
         else:
             set_thread_readonly_db()
+            if LSN_PINNING:
+                state.set_min_lsn(parse_lsn(request.COOKIES.get(PINNING_KEY)))
         return None
 
     def process_response(self, request, response):
+        read_db = get_read_db()
+        if read_db:
+            logger.debug("Request read from %s", read_db)
         if was_db_written():
-            # Keep the user on the master database for at least PINNING_SECONDS after a write
-            request.session[PINNING_KEY] = datetime.now() + timedelta(seconds=PINNING_SECONDS)
+            if LSN_PINNING:
+                self.pin_lsn(request, response)
+            else:
+                # Keep the user on the master database for a while after a write
+                request.session[PINNING_KEY] = \
+                    datetime.now() + timedelta(seconds=pinning_seconds())
             clear_db_written_flag()
+        state.set_min_lsn(None)
         set_thread_readwrite_db()
         return response
 
+    def pin_lsn(self, request, response):
+        # Keep the user's reads on databases that have replayed their write
+        try:
+            lsn = current_lsn(settings.MASTER_DATABASE)
+        except Exception:
+            logger.warning("Unable to read the WAL position of the master", exc_info=True)
+            # Fall back to pinning by time
+            request.session[PINNING_KEY] = \
+                datetime.now() + timedelta(seconds=pinning_seconds())
+            return
+        response.set_cookie(PINNING_KEY, lsn, max_age=LSN_PINNING_SECONDS, httponly=True)
+
 
 class DBRouter(object):
     def __init__(self):
@@ -111,30 +386,88 @@ class DBRouter(object):
         self.read_dbs = list(settings.DATABASE_POOL.keys())
         random.shuffle(self.read_dbs)
         self.next_db_index = 0
+        self.next_db_lock = threading.Lock()
         if not self.read_dbs:
             # No replicas?  Punt.
             self.read_dbs = [self.master_db]
 
         self.pool = self.read_dbs + [self.master_db]
 
+        self.weights = dict((db, settings.DATABASE_POOL[db] or 1)
+                            for db in settings.DATABASE_POOL)
+        self.monitor = None
+        if MAX_LAG_SECONDS is not None and self.weights:
+            self.monitor = ReplicaMonitor(self.weights.keys())
+
     def roundrobin_readonly_db(self):
         # Round-robin through the read DBs
-        db = self.read_dbs[self.next_db_index]
-        self.next_db_index = (self.next_db_index + 1) % len(self.read_dbs)
+        with self.next_db_lock:
+            db = self.read_dbs[self.next_db_index]
+            self.next_db_index = (self.next_db_index + 1) % len(self.read_dbs)
+        return db
+
+    def lag_aware_readonly_db(self):
+        # Pick one of the replicas that are caught up enough, by weight
+        self.monitor.start()
+        weights = {}
+        for db, weight in self.weights.items():
+            lag = self.monitor.lag(db)
+            if lag is not None and lag <= MAX_LAG_SECONDS:
+                weights[db] = weight
+        if not weights:
+            return self.master_db
+        return weighted_choice(weights)
+
+    def readonly_db(self):
+        if self.monitor is None:
+            return self.roundrobin_readonly_db()
+        return self.lag_aware_readonly_db()
+
+    def caught_up_db(self, min_lsn):
+        """
+        Return a replica that has replayed the WAL up to ``min_lsn``, or the
+        master if none has. The choice is kept for the rest of the request.
+        """
+        if state.lsn_db is not None:
+            return state.lsn_db
+        if self.monitor is not None:
+            self.monitor.start()
+            replicas = [db for db in self.weights
+                        if self.monitor.lag(db) is not None and
+                        self.monitor.lag(db) <= MAX_LAG_SECONDS]
+        else:
+            replicas = [db for db in self.read_dbs if db != self.master_db]
+        random.shuffle(replicas)
+        db = self.master_db
+        for replica in replicas:
+            try:
+                lsn = replay_lsn(replica)
+            except Exception:
+                logger.warning("Unable to read the WAL position of %s", replica, exc_info=True)
+                continue
+            if lsn is not None and lsn >= min_lsn:
+                db = replica
+                break
+        state.lsn_db = db
         return db
 
     def db_to_use(self, model):
         if is_thread_readwrite():
             return self.master_db
-        else:
-            return self.roundrobin_readonly_db()
+        min_lsn = state.get_min_lsn()
+        if min_lsn is not None:
+            return self.caught_up_db(min_lsn)
+        return self.readonly_db()
 
     def db_for_read(self, model, **hints):
         # For a few models that hardly ever ever change, ignore pinning
         # and if we're reading, always go to the replica DB.
         if model._meta.object_name in READMOSTLY_MODELS:
-            return self.roundrobin_readonly_db()
-        return self.db_to_use(model)
+            db = self.readonly_db()
+        else:
+            db = self.db_to_use(model)
+        state.set_read_db(db)
+        return db
 
     def db_for_write(self, model, **hints):
         set_db_written_flag()
@@ -168,9 +501,11 @@ def readwrite_db():
     was_readwrite = is_thread_readwrite()
     if not was_readwrite:
         set_thread_readwrite_db()
-    yield
-    if not was_readwrite:
-        set_thread_readonly_db()
+    try:
+        yield
+    finally:
+        if not was_readwrite:
+            set_thread_readonly_db()
 
 
 @contextmanager
@@ -186,6 +521,8 @@ def readonly_db():
     was_read_only = not is_thread_readwrite()
     if not was_read_only:
         set_thread_readonly_db()
-    yield
-    if not was_read_only:
-        set_thread_readwrite_db()
+    try:
+        yield
+    finally:
+        if not was_read_only:
+            set_thread_readwrite_db()
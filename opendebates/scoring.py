@@ -0,0 +1,292 @@
+"""
+Trending scores.
+
+The trending score of a submission depends on its total number of votes,
+the votes it received in the last 2 and 4 hours, and its age. Instead of
+recomputing every submission on every run, ``update_trending_scores``
+only recomputes the submissions of one debate whose score inputs may
+have changed since the previous run:
+
+* submissions with a vote created after (previous run - 4 hours), since
+  their total or their 2h/4h windows have moved, and
+* submissions that had duplicates merged into them since (previous run -
+  4 hours).
+
+The rest of the debate keeps its score until the next full refresh
+(every ``TRENDING_FULL_REFRESH_SECONDS``), which applies the age decay
+and random jitter to every submission. So that the recomputed scores
+stay comparable with the others, they use the submissions' ages at the
+last full refresh; the decay moves the whole order at once, at each
+refresh. Strategies other than "hot" whose vote buckets reach back
+further than 4 hours still drift until the next refresh.
+
+There are two backends, chosen with ``TRENDING_SCORE_BACKEND``:
+
+* "sql" (the default) computes and writes the scores in one UPDATE on
+  the master, and
+* "numpy" streams the votes from a replica with a server-side cursor,
+  counts them per submission with numpy, and only sends the master one
+  UPDATE of the final scores. Choosing it without numpy installed raises
+  ImproperlyConfigured.
+
+The ``benchmark_scoring`` command compares them. Both compute the "hot"
+formula; debates that chose another ``Debate.scoring_strategy`` are
+scored from the vote buckets of ``vote_buckets`` instead (see
+opendebates.scoring_strategies).
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections, router
+from django.utils import timezone
+
+from . import scoring_strategies
+from .models import Submission, Vote
+from .router import readonly_db
+from .scoring_strategies import (AGE_EXPONENT, BUCKET_SECONDS, MIN_VOTES, NUM_BUCKETS,
+                                 RECENT_WINDOWS, SubmissionVotes)
+
+try:
+    import numpy
+except ImportError:  # Only the numpy backend needs it
+    numpy = None
+
+
+logger = logging.getLogger(__name__)
+
+
+TRENDING_LAST_RUN_CACHE_ENTRY = 'trending_scores_last_run-{}'
+TRENDING_LAST_REFRESH_CACHE_ENTRY = 'trending_scores_last_refresh-{}'
+
+# How often to recompute every submission of a debate.
+FULL_REFRESH_SECONDS = int(getattr(settings, 'TRENDING_FULL_REFRESH_SECONDS', 3600))
+
+SCORE_BACKEND = getattr(settings, 'TRENDING_SCORE_BACKEND', 'sql')
+if SCORE_BACKEND not in ('sql', 'numpy'):
+    raise ImproperlyConfigured("Unknown TRENDING_SCORE_BACKEND %r" % SCORE_BACKEND)
+if SCORE_BACKEND == 'numpy' and numpy is None:
+    raise ImproperlyConfigured("TRENDING_SCORE_BACKEND is 'numpy', but numpy is not installed")
+
+# The widest recency window used in the score formula.
+SCORE_WINDOW = datetime.timedelta(hours=4)
+
+# Votes fetched from the server-side cursor at a time
+FETCH_SIZE = 100000
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+SCORE_SQL = """
+UPDATE opendebates_submission
+SET score=q.score
+FROM
+(
+SELECT
+s."id",
+CASE WHEN
+(COUNT(v.id) < 15) THEN 0 ELSE
+((Count(v."id") + Sum(CASE WHEN v.created_at > NOW() - INTERVAL '2 HOUR' THEN 1 ELSE 0 END)*200 + Sum(CASE WHEN v.created_at > NOW() - INTERVAL '4 HOUR' THEN 1 ELSE 0 END)*100)) / EXTRACT(EPOCH FROM (CASE WHEN MIN(s.created_at) < %s THEN %s ELSE NOW() END) - MIN(s.created_at))^1.5*(1+RANDOM()) END AS score
+FROM
+opendebates_submission AS s
+INNER JOIN opendebates_vote AS v ON v.submission_id = s."id"
+WHERE {where}
+GROUP BY
+s."id"
+) q
+WHERE
+q."id" = opendebates_submission."id";
+"""  # noqa
+
+DEBATE_WHERE = 's.category_id IN (SELECT id FROM opendebates_category WHERE debate_id = %s)'
+SUBMISSIONS_WHERE = 's."id" = ANY(%s)'
+
+SUBMISSIONS_SQL = """
+SELECT s."id", EXTRACT(EPOCH FROM s.created_at)::float8
+FROM opendebates_submission AS s
+WHERE {where}
+ORDER BY s."id"
+"""
+
+VOTES_SQL = """
+SELECT v.submission_id, EXTRACT(EPOCH FROM v.created_at)::float8
+FROM opendebates_vote AS v
+INNER JOIN opendebates_submission AS s ON s."id" = v.submission_id
+WHERE {where}
+"""
+
+VOTE_BUCKETS_SQL = """
+SELECT s."id", EXTRACT(EPOCH FROM (CASE WHEN s.created_at < %s THEN %s ELSE %s END) - s.created_at)::float8,
+       s.local_votes,
+       GREATEST(0, LEAST(FLOOR(EXTRACT(EPOCH FROM %s - v.created_at) / %s), %s))::int AS bucket,
+       COUNT(*)
+FROM opendebates_submission AS s
+INNER JOIN opendebates_vote AS v ON v.submission_id = s."id"
+WHERE {where}
+GROUP BY s."id", bucket
+ORDER BY s."id"
+"""
+
+WRITE_SCORES_SQL = """
+UPDATE opendebates_submission AS s
+SET score = q.score
+FROM (SELECT unnest(%s::integer[]) AS "id", unnest(%s::float8[]) AS score) AS q
+WHERE s."id" = q."id"
+"""
+
+
+def changed_submission_ids(debate, since):
+    """
+    Return the ids of the submissions in ``debate`` whose score may have
+    changed since ``since``.
+    """
+    voted = Vote.objects.filter(
+        submission__category__debate=debate,
+        created_at__gt=since - SCORE_WINDOW,
+    ).values_list('submission_id', flat=True).distinct()
+    # Like the votes, so that merges a lagging replica hasn't seen yet
+    # are still picked up on the next runs.
+    merged_into = Submission.objects.filter(
+        category__debate=debate,
+        duplicates__moderated_at__gt=since - SCORE_WINDOW,
+    ).values_list('id', flat=True).distinct()
+    return set(voted) | set(merged_into)
+
+
+def compute_scores(where, params, now, using, age_at=None):
+    """
+    Compute the trending scores of the submissions matching ``where``
+    from their votes in the ``using`` database, with numpy, and their
+    ages at ``age_at`` (see ``update_trending_scores``). Returns an array
+    of the ids of the submissions with votes, and one of their scores.
+    """
+    db = connections[using]
+    with db.cursor() as cursor:
+        cursor.execute(SUBMISSIONS_SQL.format(where=where), params)
+        submissions = numpy.array(cursor.fetchall(), dtype=numpy.float64).reshape(-1, 2)
+    ids = submissions[:, 0].astype(numpy.int64)
+    if not len(ids):
+        return ids, submissions[:, 1]
+    age_at = ((age_at or now) - EPOCH).total_seconds()
+    now = (now - EPOCH).total_seconds()
+
+    # Histogram the votes by submission: the total, and the votes in each
+    # recent window. Only one batch of votes is in memory at a time.
+    total = numpy.zeros(len(ids), dtype=numpy.int64)
+    recent = [numpy.zeros(len(ids), dtype=numpy.int64) for window in RECENT_WINDOWS]
+    with db.chunked_cursor() as cursor:
+        cursor.execute(VOTES_SQL.format(where=where), params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            votes = numpy.array(rows, dtype=numpy.float64)
+            vote_ids = votes[:, 0].astype(numpy.int64)
+            # The votes are read in a later snapshot than the submissions:
+            # drop the votes of submissions that weren't in it, rather than
+            # counting them on a neighbour.
+            index = numpy.minimum(numpy.searchsorted(ids, vote_ids), len(ids) - 1)
+            found = ids[index] == vote_ids
+            index = index[found]
+            age = now - votes[found, 1]
+            total += numpy.bincount(index, minlength=len(ids))
+            for counts, (seconds, weight) in zip(recent, RECENT_WINDOWS):
+                counts += numpy.bincount(index[age < seconds], minlength=len(ids))
+
+    weighted = total.astype(numpy.float64)
+    for counts, (seconds, weight) in zip(recent, RECENT_WINDOWS):
+        weighted += counts * weight
+    created_at = submissions[:, 1]
+    age = numpy.where(created_at < age_at, age_at, now) - created_at
+    scores = weighted / age ** AGE_EXPONENT * (1 + numpy.random.random_sample(len(ids)))
+    scores[total < MIN_VOTES] = 0
+    # Like SCORE_SQL, leave the submissions without votes alone
+    voted = total > 0
+    return ids[voted], scores[voted]
+
+
+def vote_buckets(where, params, now, using, age_at=None):
+    """
+    Return a SubmissionVotes for each submission matching ``where`` that
+    has votes, read in one pass over its votes in the ``using`` database,
+    with its age at ``age_at`` (see ``update_trending_scores``).
+    """
+    age_at = age_at or now
+    aggregates = []
+    with connections[using].cursor() as cursor:
+        cursor.execute(VOTE_BUCKETS_SQL.format(where=where),
+                       [age_at, age_at, now, now, BUCKET_SECONDS, NUM_BUCKETS] + params)
+        for id, age, local_votes, bucket, count in cursor.fetchall():
+            if not aggregates or aggregates[-1].id != id:
+                aggregates.append(SubmissionVotes(id, age, local_votes))
+            aggregates[-1].buckets[bucket] = count
+    return aggregates
+
+
+def write_scores(ids, scores):
+    """
+    Set the scores of the submissions ``ids`` in one statement.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(WRITE_SCORES_SQL, [list(ids), list(scores)])
+        return cursor.rowcount
+
+
+def update_trending_scores(debate, full=False):
+    """
+    Recompute the trending scores of ``debate``. Returns the number of
+    submissions updated.
+
+    Does a full refresh if ``full`` is True, if the debate has never been
+    scored, or if the last full refresh is older than FULL_REFRESH_SECONDS.
+    """
+    now = timezone.now()
+    last_run = cache.get(TRENDING_LAST_RUN_CACHE_ENTRY.format(debate.id))
+    last_refresh = cache.get(TRENDING_LAST_REFRESH_CACHE_ENTRY.format(debate.id))
+    if last_run is None or last_refresh is None or \
+            (now - last_refresh).total_seconds() >= FULL_REFRESH_SECONDS:
+        full = True
+
+    # Between full refreshes, the ages in the formula are taken at the last
+    # full refresh, like those of the submissions that aren't recomputed,
+    # so that the age decay doesn't reorder them. Only the submissions
+    # created since then are aged up to now.
+    if full:
+        age_at = now
+        where, params = DEBATE_WHERE, [debate.id]
+    else:
+        age_at = last_refresh
+        # A lagging replica is fine here: votes and merges it hasn't seen
+        # yet are still inside the window on the next run.
+        with readonly_db():
+            submission_ids = sorted(changed_submission_ids(debate, last_run))
+        if not submission_ids:
+            cache.set(TRENDING_LAST_RUN_CACHE_ENTRY.format(debate.id), now, None)
+            return 0
+        where, params = SUBMISSIONS_WHERE, [submission_ids]
+
+    if debate.scoring_strategy != 'hot':
+        # The same replica lag argument holds for the votes themselves.
+        with readonly_db():
+            aggregates = vote_buckets(where, params, now, router.db_for_read(Vote), age_at)
+            ids, scores = scoring_strategies.compute_scores(
+                debate.scoring_strategy, debate, aggregates)
+        updated = write_scores(ids, scores)
+    elif SCORE_BACKEND == 'numpy':
+        if numpy is None:
+            raise ImproperlyConfigured("The numpy score backend needs numpy to be installed")
+        with readonly_db():
+            ids, scores = compute_scores(where, params, now, router.db_for_read(Vote), age_at)
+        updated = write_scores(ids.tolist(), scores.tolist())
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute(SCORE_SQL.format(where=where), [age_at, age_at] + params)
+            updated = cursor.rowcount
+
+    cache.set(TRENDING_LAST_RUN_CACHE_ENTRY.format(debate.id), now, None)
+    if full:
+        cache.set(TRENDING_LAST_REFRESH_CACHE_ENTRY.format(debate.id), now, None)
+    logger.debug("update_trending_scores: %s %d submissions for %s",
+                 "refreshed" if full else "updated", updated, debate)
+    return updated
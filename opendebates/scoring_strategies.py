@@ -0,0 +1,169 @@
+"""
+Trending score strategies.
+
+Each debate picks how the trending scores of its submissions are
+computed with ``Debate.scoring_strategy``. A strategy is a function
+registered under a name with ``@strategy``, which takes the debate and
+the vote aggregates of the submissions being scored, and returns their
+scores by id.
+
+Every strategy works from the same aggregate, a SubmissionVotes per
+submission: its age, its local votes, and its votes counted in hourly
+buckets (see ``opendebates.scoring.vote_buckets``). The aggregate is
+built with a single scan of the debate's votes, so adding a strategy
+doesn't add another scan of the votes table.
+
+The "hot" strategy is the original formula. For debates using it, the
+"sql" and "numpy" backends of opendebates.scoring compute the same
+formula without building the aggregate.
+"""
+import math
+import random
+
+from django.conf import settings
+from django.db import connection
+
+
+# The width and number of the vote buckets; older votes all go in one
+# extra bucket at the end.
+BUCKET_SECONDS = 3600
+NUM_BUCKETS = 48
+
+# The hot formula: 0 below MIN_VOTES, otherwise
+# (votes + sum(weight * votes in the last window seconds)) / age^AGE_EXPONENT,
+# times a random jitter between 1 and 2.
+MIN_VOTES = 15
+RECENT_WINDOWS = [(2 * 3600, 200), (4 * 3600, 100)]  # (seconds, weight)
+AGE_EXPONENT = 1.5
+
+# How many hours of the debate's average vote rate a new submission
+# starts with, in the bayesian strategy.
+BAYESIAN_PRIOR_HOURS = float(getattr(settings, 'SCORING_BAYESIAN_PRIOR_HOURS', 24))
+
+# After how many hours a vote counts half, in the decay strategy.
+DECAY_HALF_LIFE_HOURS = float(getattr(settings, 'SCORING_DECAY_HALF_LIFE_HOURS', 12))
+
+# How much more a vote from the debate state counts, in the local strategy.
+LOCAL_VOTE_WEIGHT = float(getattr(settings, 'SCORING_LOCAL_VOTE_WEIGHT', 2))
+
+
+class SubmissionVotes(object):
+    """
+    The votes of one submission, as seen at one point in time.
+    """
+
+    def __init__(self, id, age, local_votes):
+        self.id = id
+        # In seconds
+        self.age = age
+        self.local_votes = local_votes
+        self.buckets = [0] * (NUM_BUCKETS + 1)
+
+    @property
+    def votes(self):
+        return sum(self.buckets)
+
+    def recent(self, seconds):
+        """
+        Return the number of votes in the last ``seconds`` (rounded down
+        to a number of buckets).
+        """
+        return sum(self.buckets[:seconds // BUCKET_SECONDS])
+
+
+STRATEGIES = {}
+
+
+def strategy(name):
+    def register(func):
+        STRATEGIES[name] = func
+        return func
+    return register
+
+
+def compute_scores(name, debate, aggregates):
+    """
+    Return the ids of the submissions in ``aggregates``, and their
+    scores according to the strategy ``name``.
+    """
+    scores = STRATEGIES[name](debate, aggregates)
+    ids = [submission.id for submission in aggregates]
+    return ids, [scores[id] for id in ids]
+
+
+def _hot(submission, votes):
+    if submission.votes < MIN_VOTES:
+        return 0.0
+    weighted = votes + sum(weight * submission.recent(seconds)
+                           for seconds, weight in RECENT_WINDOWS)
+    return weighted / max(submission.age, 1) ** AGE_EXPONENT * (1 + random.random())
+
+
+@strategy('hot')
+def hot(debate, aggregates):
+    return dict((submission.id, _hot(submission, submission.votes))
+                for submission in aggregates)
+
+
+@strategy('local')
+def local(debate, aggregates):
+    """
+    The hot formula, counting each vote from the debate state
+    1 + LOCAL_VOTE_WEIGHT times.
+    """
+    return dict((submission.id,
+                 _hot(submission, submission.votes + LOCAL_VOTE_WEIGHT * submission.local_votes))
+                for submission in aggregates)
+
+
+AVERAGE_RATE_SQL = """
+SELECT SUM(s.votes), SUM(GREATEST(EXTRACT(EPOCH FROM NOW() - s.created_at), 1)) / 3600
+FROM opendebates_submission AS s
+INNER JOIN opendebates_category AS c ON c."id" = s.category_id
+WHERE c.debate_id = %s AND s.votes > 0
+"""
+
+
+def average_vote_rate(debate):
+    """
+    Return the average votes per hour of the submissions of the debate
+    that have votes, from their running totals.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(AVERAGE_RATE_SQL, [debate.id])
+        votes, hours = cursor.fetchone()
+    if not votes:
+        return 0.0
+    return float(votes) / float(hours)
+
+
+@strategy('bayesian')
+def bayesian(debate, aggregates):
+    """
+    Votes per hour, as if each submission had also been up for
+    BAYESIAN_PRIOR_HOURS more hours at the average rate of the debate.
+    New submissions with a handful of votes don't jump ahead of
+    established ones until their rate holds up.
+    """
+    if not aggregates:
+        return {}
+    prior_votes = average_vote_rate(debate) * BAYESIAN_PRIOR_HOURS
+    return dict((submission.id, (submission.votes + prior_votes) /
+                 (max(submission.age, 1) / 3600.0 + BAYESIAN_PRIOR_HOURS))
+                for submission in aggregates)
+
+
+@strategy('decay')
+def decay(debate, aggregates):
+    """
+    The votes, each counting half as much every DECAY_HALF_LIFE_HOURS
+    since it was cast. Votes older than the buckets count as if they were
+    exactly NUM_BUCKETS hours old.
+    """
+    hours_per_bucket = BUCKET_SECONDS / 3600.0
+    weights = [math.pow(0.5, (n + 0.5) * hours_per_bucket / DECAY_HALF_LIFE_HOURS)
+               for n in range(NUM_BUCKETS)]
+    weights.append(math.pow(0.5, NUM_BUCKETS * hours_per_bucket / DECAY_HALF_LIFE_HOURS))
+    return dict((submission.id, sum(count * weight
+                                    for count, weight in zip(submission.buckets, weights)))
+                for submission in aggregates)
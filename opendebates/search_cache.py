@@ -0,0 +1,78 @@
+"""
+Cached search results.
+
+The search views store the ranked ids of the submissions matching a
+search in the cache for SEARCH_CACHE_TIMEOUT seconds, keyed on the
+debate, category, sort, "citations only" and prefix flags and the
+normalized search terms, and page through them with a ``RankedSubmissions``. Repeated
+searches for the same terms, however they're capitalized or ordered,
+cost a single cache ``get_many``.
+
+Each entry also records the search generation of its debate, which
+changes whenever a submission of the debate is saved or deleted (created,
+merged, removed, ...; see ``opendebates.signals``), making every cached
+search of the debate stale.
+"""
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
+
+from .ranking import RankedSubmissions
+from .utils import pack_ids, unpack_ids
+
+
+SEARCH_CACHE_ENTRY = 'search-{}-{}-{}-{}-{}-{}'
+SEARCH_GENERATION_CACHE_ENTRY = 'search_generation-{}'
+
+# Vote counts in cached results go stale, so keep them briefly.
+SEARCH_CACHE_TIMEOUT = int(getattr(settings, 'SEARCH_CACHE_TIMEOUT', 60))
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_search_term(term):
+    """
+    Return the words of ``term`` the way the full text search sees them:
+    lowercase and in no particular order.
+    """
+    return u' '.join(sorted(set(WORD_RE.findall(term.lower()))))
+
+
+def search_key(debate_id, term, sort, citations_only, category_id=None, prefix=False):
+    digest = hashlib.md5(force_bytes(normalize_search_term(term))).hexdigest()
+    return SEARCH_CACHE_ENTRY.format(
+        debate_id, category_id or 'all', sort, 1 if citations_only else 0,
+        1 if prefix else 0, digest)
+
+
+def cached_search(debate, term, sort, citations_only, ideas, category_id=None, prefix=False):
+    """
+    Return the results of the search ``ideas`` (a sorted and searched
+    queryset) as a RankedSubmissions, from the cache if possible.
+
+    Returns ``ideas`` itself if the search cache is off.
+    """
+    if not settings.SEARCH_CACHE:
+        return ideas
+    key = search_key(debate.id, term, sort, citations_only, category_id, prefix)
+    generation_key = SEARCH_GENERATION_CACHE_ENTRY.format(debate.id)
+    values = cache.get_many([key, generation_key])
+    generation = values.get(generation_key, 0)
+    entry = values.get(key)
+    if entry is not None and entry[0] == generation:
+        return RankedSubmissions(unpack_ids(entry[1]))
+
+    ids = list(ideas.values_list('id', flat=True))
+    cache.set(key, (generation, pack_ids(ids)), SEARCH_CACHE_TIMEOUT)
+    return RankedSubmissions(ids)
+
+
+def invalidate_search(debate_id):
+    """
+    Make every cached search of the debate stale.
+    """
+    cache.set(SEARCH_GENERATION_CACHE_ENTRY.format(debate_id), time.time(), None)
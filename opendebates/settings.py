@@ -29,6 +29,18 @@ FIXTURE_DIRS = [os.path.join(BASE_DIR, 'fixtures')]
 # Both DOMAIN variables are overwritten in local_settings.py
 
 SUBMISSIONS_PER_PAGE = 25
+# Page the question lists with "next page" cursors (keyed on the sort column
+# and id) instead of page numbers. Old ?page= links keep working either way.
+KEYSET_PAGINATION = False
+# Serve the question lists from per-debate rankings precomputed every minute
+# by the update_rankings task (see opendebates.ranking).
+RANKING_CACHE = False
+# Cache the ranked ids of search results for a minute (see
+# opendebates.search_cache).
+SEARCH_CACHE = False
+# Look for near-duplicate submissions every 10 minutes and list them on the
+# moderation page (see opendebates.duplicates).
+DUPLICATE_DETECTION = False
 
 SITE_THEMES = ['testing', 'florida']
 SITE_THEME_NAME = 'florida'
@@ -168,13 +180,42 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERYBEAT_SCHEDULE = {
     'update_recent_events': {
         'task': 'opendebates.tasks.update_recent_events',
-        'schedule': timedelta(seconds=10),
+        # The views keep the feeds current; this only reconciles them.
+        'schedule': timedelta(minutes=5),
         'options': {
-            # If no worker runs it within 60 seconds, throw it away; more
+            # If no worker runs it within 5 minutes, throw it away; more
             # tasks will already have been scheduled.
+            'expires': 60 * 5,  # seconds
+        }
+    },
+    'flush_vote_buffer': {
+        'task': 'opendebates.tasks.flush_vote_buffer',
+        'schedule': timedelta(seconds=10),
+        'options': {
+            'expires': 60,  # seconds
+        }
+    },
+    'update_rankings': {
+        'task': 'opendebates.tasks.update_rankings',
+        'schedule': timedelta(minutes=1),
+        'options': {
             'expires': 60,  # seconds
         }
     },
+    'reconcile_vote_totals': {
+        'task': 'opendebates.tasks.reconcile_vote_totals',
+        'schedule': timedelta(minutes=15),
+        'options': {
+            'expires': 60 * 15,  # seconds
+        }
+    },
+    'find_duplicates': {
+        'task': 'opendebates.tasks.find_duplicates',
+        'schedule': timedelta(minutes=10),
+        'options': {
+            'expires': 60 * 10,  # seconds
+        }
+    },
     'update_trending_scores': {
         'task': 'opendebates.tasks.update_trending_scores',
         'schedule': timedelta(minutes=10),
@@ -328,6 +369,11 @@ OPTIMIZELY_KEY = None
 # Turn this off to never use CAPTCHA
 USE_CAPTCHA = True
 
+# Accumulate vote counts in the cache and write them to the database
+# periodically (see opendebates.counters), instead of updating the
+# submission row on every vote. Requires a cache that supports incr().
+VOTE_BUFFERING = False
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -0,0 +1,36 @@
+"""
+Signal handlers that keep the caches in sync with the database.
+"""
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, Debate, Submission, ZipCode
+from .search_cache import invalidate_search
+from .utils import invalidate_debates
+from .zipcodes import invalidate_zipcodes
+
+
+@receiver(post_save, sender=Debate)
+@receiver(post_delete, sender=Debate)
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def debate_changed(sender, **kwargs):
+    invalidate_debates()
+
+
+@receiver(post_save, sender=ZipCode)
+@receiver(post_delete, sender=ZipCode)
+def zipcode_changed(sender, **kwargs):
+    invalidate_zipcodes()
+
+
+@receiver(post_save, sender=Submission)
+@receiver(post_delete, sender=Submission)
+def submission_changed(sender, instance, **kwargs):
+    try:
+        debate_id = instance.category.debate_id
+    except Category.DoesNotExist:
+        # The whole category is being deleted
+        return
+    invalidate_search(debate_id)
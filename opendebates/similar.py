@@ -0,0 +1,92 @@
+"""
+Questions similar to the one being written.
+
+As a user types the headline of a new question, the question form asks
+for the approved submissions of the debate that look like it, so that
+they can vote for an existing question instead of submitting a duplicate
+that moderators would have to merge later.
+
+The lookup is a full text search that matches any word of the headline
+as a prefix, ranked with ts_rank_cd, so it uses the GIN index on
+search_vector. The results are cached per debate and normalized headline
+for SIMILAR_QUESTIONS_TIMEOUT seconds, and go stale with the debate's
+search generation (see ``opendebates.search_cache``), since it changes
+whenever a submission is created, merged or removed.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+
+from .models import PrefixSearchQuery, SearchRankCD, Submission
+from .search_cache import SEARCH_GENERATION_CACHE_ENTRY, WORD_RE
+
+
+SIMILAR_QUESTIONS_CACHE_ENTRY = 'similar_questions-{}-{}-{}'
+
+SIMILAR_QUESTIONS_TIMEOUT = int(getattr(settings, 'SIMILAR_QUESTIONS_TIMEOUT', 60))
+SIMILAR_QUESTIONS_LIMIT = int(getattr(settings, 'SIMILAR_QUESTIONS_LIMIT', 5))
+
+# Shorter words are mostly stop words, and as prefixes they would match
+# most of the debate.
+MIN_WORD_LENGTH = 3
+# Headlines are at most 80 characters; don't search for more than that.
+MAX_TEXT_LENGTH = 200
+
+
+def similar_words(text):
+    """
+    Return the words of ``text`` used to look for similar questions,
+    lowercase and sorted.
+    """
+    words = WORD_RE.findall(text[:MAX_TEXT_LENGTH].lower())
+    return sorted(set(word for word in words if len(word) >= MIN_WORD_LENGTH))
+
+
+def find_similar(debate, words, limit):
+    query = PrefixSearchQuery(u' '.join(words), any_word=True)
+    ideas = Submission.objects.filter(
+        category__debate=debate,
+        approved=True,
+        duplicate_of__isnull=True,
+        search_vector=query,
+    ).annotate(
+        similarity=SearchRankCD(F('search_vector'), query),
+    ).order_by('-similarity', '-votes', '-id')
+    return [
+        {
+            'id': id,
+            'headline': headline,
+            'votes': votes,
+            'url': reverse('show_idea', kwargs={'prefix': debate.prefix, 'id': id},
+                           urlconf=settings.ROOT_URLCONF),
+        }
+        for id, headline, votes in ideas.values_list('id', 'headline', 'votes')[:limit]
+    ]
+
+
+def similar_questions(debate, text, limit=None):
+    """
+    Return up to ``limit`` (default SIMILAR_QUESTIONS_LIMIT) approved
+    submissions of the debate similar to ``text``, most similar first, as
+    dicts of id, headline, votes and url.
+    """
+    limit = limit or SIMILAR_QUESTIONS_LIMIT
+    words = similar_words(text)
+    if not words:
+        return []
+    digest = hashlib.md5(force_bytes(u' '.join(words))).hexdigest()
+    key = SIMILAR_QUESTIONS_CACHE_ENTRY.format(debate.id, limit, digest)
+    generation_key = SEARCH_GENERATION_CACHE_ENTRY.format(debate.id)
+    values = cache.get_many([key, generation_key])
+    generation = values.get(generation_key, 0)
+    entry = values.get(key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+
+    questions = find_similar(debate, words, limit)
+    cache.set(key, (generation, questions), SIMILAR_QUESTIONS_TIMEOUT)
+    return questions
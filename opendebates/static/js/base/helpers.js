@@ -383,6 +383,44 @@
     }
   }
   $('#add_question').on('keyup', 'textarea', updateTextLimitCounts);
+
+  /* While a headline is being written, show the existing questions that
+     look like it, so the user can vote for one instead of submitting a
+     duplicate. */
+  var similarTimer = null;
+  var similarText = '';
+  function showSimilarQuestions() {
+    var text = $.trim($('#headline').val());
+    if (text === similarText) {
+      return;
+    }
+    similarText = text;
+    var $similar = $('#similar-questions');
+    if (text.length < 10) {
+      $similar.addClass('hidden');
+      return;
+    }
+    $.getJSON(ODebates.paths.similar, {q: text}).done(function(data) {
+      if (text !== similarText) {
+        /* A newer request is on its way */
+        return;
+      }
+      var $list = $similar.find('ul').empty();
+      $.each(data.questions, function(i, question) {
+        var $link = $('<a target="_blank">').attr('href', question.url).text(question.headline);
+        var $item = $('<li>').append($link);
+        if (question.votes !== null) {
+          $item.append($('<span class="votes">').text(' (' + question.votes + ')'));
+        }
+        $list.append($item);
+      });
+      $similar.toggleClass('hidden', data.questions.length === 0);
+    });
+  }
+  $('#add_question').on('keyup', '#headline', function() {
+    clearTimeout(similarTimer);
+    similarTimer = setTimeout(showSimilarQuestions, 300);
+  });
   $('#add_question textarea').each(updateTextLimitCounts);
 
   $('#search-full').one('keyup click', function() {
@@ -2,117 +2,184 @@ from __future__ import absolute_import
 import logging
 
 from celery import shared_task
+from django.conf import settings
 from django.core.cache import cache
 from django.core import management
-from django.db import connection
-from django.db.models import F
 
-from opendebates.models import Vote, Submission, Debate, RECENT_EVENTS_CACHE_ENTRY, \
-    NUMBER_OF_VOTES_CACHE_ENTRY
+from opendebates import activity, counters, duplicates, feed, ranking, scoring
+from opendebates.models import Debate, NUMBER_OF_VOTES_CACHE_ENTRY
+from opendebates.periodic import periodic
 from opendebates.router import set_thread_readonly_db, set_thread_readwrite_db
 
 
-sql2 = """
-UPDATE opendebates_submission
-SET random_id=random()
-"""
-
-sql = """
-UPDATE opendebates_submission
-SET score=q.score
-FROM
-(
-SELECT
-s."id",
-CASE WHEN
-(COUNT(v.id) < 15) THEN 0 ELSE
-((Count(v."id") + Sum(CASE WHEN v.created_at > NOW() - INTERVAL '2 HOUR' THEN 1 ELSE 0 END)*200 + Sum(CASE WHEN v.created_at > NOW() - INTERVAL '4 HOUR' THEN 1 ELSE 0 END)*100)) / EXTRACT(EPOCH FROM (NOW() - MIN(s.created_at)))^1.5*(1+RANDOM()) END AS score
-FROM
-opendebates_submission AS s
-INNER JOIN opendebates_vote AS v ON v.submission_id = s."id"
-GROUP BY
-s."id"
-) q
-WHERE
-q."id" = opendebates_submission."id";
-"""  # noqa
+logger = logging.getLogger(__name__)
 
 
-logger = logging.getLogger(__name__)
+@shared_task
+def update_recent_events():
+    """
+    Reconcile the recent activity feeds with the database, and restore
+    vote totals that dropped out of the cache.
+
+    The vote and question views append to the feeds as things happen (see
+    opendebates.feed); this catches up on removed and merged submissions,
+    and on feeds that dropped out of the cache. Debates that are no longer
+    active only get their feed and vote total restored if they're missing.
+    """
+    active = activity.active_debate_ids()
+    for debate_id in Debate.objects.no_cache().values_list('id', flat=True):
+        if debate_id in active or feed.recent_events(debate_id) is None or \
+                cache.get(NUMBER_OF_VOTES_CACHE_ENTRY.format(debate_id)) is None:
+            update_debate_recent_events.delay(debate_id)
+
+
+@shared_task
+@periodic('update_recent_events')
+def update_debate_recent_events(debate_id):
+    debate = Debate.objects.get(id=debate_id)
+    logger.debug("update_recent_events: started for %s" % debate)
+
+    # On the master, which has the events the views just appended
+    events = feed.rebuild_feed(debate)
 
+    try:
+        # No middleware on tasks, so this won't get set otherwise.
+        # Tell the DB router this thread only needs to read the DB, not write.
+        set_thread_readonly_db()
 
-exception_logged = False
+        # The views keep the vote total up to date; only count the
+        # votes if it dropped out of the cache.
+        if cache.get(NUMBER_OF_VOTES_CACHE_ENTRY.format(debate.id)) is None:
+            counters.reconcile_vote_total(debate)
+
+        logger.debug("There are %d entries" % len(events))
+        return len(events)
+    finally:
+        # Be a good citizen and reset the worker's thread to the default state
+        set_thread_readwrite_db()
 
 
 @shared_task
-def update_recent_events():
+def reconcile_vote_totals():
     """
-    Compute recent events and other statistics and cache them.
+    Correct any drift of the running vote totals of the active debates.
     """
-    for debate in Debate.objects.all():
-        logger.debug("update_recent_events: started for %s" % debate)
-
-        try:
-            # No middleware on tasks, so this won't get set otherwise.
-            # Tell the DB router this thread only needs to read the DB, not write.
-            # We run this task frequently, so it's worthwhile.
-            set_thread_readonly_db()
-
-            votes = Vote.objects.select_related(
-                "voter",
-                "voter__user",
-                "submission__category",
-            ).filter(
-                submission__category__debate=debate,
-                submission__approved=True,
-                submission__duplicate_of__isnull=True,
-            ).exclude(
-                voter=F('submission__voter'),
-            ).order_by("-id")[:10]
-            submissions = Submission.objects.select_related(
-                "voter",
-                "voter__user",
-                "category",
-            ).filter(
-                approved=True,
-                duplicate_of__isnull=True,
-                category__debate=debate,
-            ).order_by("-id")[:10]
-
-            entries = list(votes) + list(submissions)
-            entries = sorted(entries, key=lambda x: x.created_at, reverse=True)[:10]
-
-            cache.set(RECENT_EVENTS_CACHE_ENTRY.format(debate.id),
-                      entries, 24*3600)
-
-            number_of_votes = Vote.objects.filter(
-                submission__category__debate=debate).count()
-            cache.set(NUMBER_OF_VOTES_CACHE_ENTRY.format(debate.id),
-                      number_of_votes, 24*3600)
-
-            logger.debug("There are %d entries" % len(entries))
-            logger.debug("There are %d votes" % number_of_votes)
-        except Exception:
-            # This task runs too frequently to report a recurring problem every time
-            # it happens.
-            global exception_logged
-            if not exception_logged:
-                logger.exception("Unexpected exception in update_recent_events for %s" % debate)
-                exception_logged = True
-        finally:
-            # Be a good citizen and reset the worker's thread to the default state
-            set_thread_readwrite_db()
+    for debate_id in activity.active_debate_ids():
+        reconcile_debate_vote_total.delay(debate_id)
 
 
 @shared_task
-def update_trending_scores():
+@periodic('reconcile_vote_totals')
+def reconcile_debate_vote_total(debate_id):
+    debate = Debate.objects.get(id=debate_id)
+    try:
+        set_thread_readonly_db()
+        total = counters.reconcile_vote_total(debate)
+        logger.debug("There are %d votes in %s" % (total, debate))
+    finally:
+        set_thread_readwrite_db()
+
+
+def trending_score_updates(full=False):
+    """
+    Return the keyword arguments of update_debate_trending_scores for each
+    debate to score now: the active debates, and the debates that just
+    stopped being active, for the last time.
+    """
+    active = activity.active_debate_ids()
+    updates = [dict(debate_id=debate_id, full=full) for debate_id in sorted(active)]
+    finished = Debate.objects.no_cache().filter(
+        scores_frozen=False,
+    ).exclude(
+        id__in=active,
+    ).order_by('id').values_list('id', flat=True)
+    updates.extend(dict(debate_id=debate_id, full=True, freeze=True) for debate_id in finished)
+    return updates
+
+
+@shared_task
+def update_trending_scores(full=False):
     logger.debug("update_trending_scores: started")
+    for kwargs in trending_score_updates(full):
+        update_debate_trending_scores.delay(**kwargs)
+
+
+@shared_task
+@periodic('update_trending_scores')
+def update_debate_trending_scores(debate_id, full=False, freeze=False):
+    # Not from cache-machine, which doesn't see the update() below
+    debate = Debate.objects.no_cache().get(id=debate_id)
+    updated = scoring.update_trending_scores(debate, full=full)
+    if debate.scores_frozen != freeze:
+        # update() rather than save(), which would invalidate every
+        # cached copy of the debate.
+        Debate.objects.filter(id=debate_id).update(scores_frozen=freeze)
+        logger.info("update_trending_scores: %s the scores of %s" % (
+            "froze" if freeze else "unfroze", debate))
+    return updated
+
+
+# Two flushes running at once would both take the same increments.
+@shared_task
+@periodic('flush_vote_buffer', per_debate=False, lock_timeout=60)
+def flush_vote_buffer():
+    """
+    Write the vote increments buffered in the cache to the database.
+    """
+    return counters.flush_vote_buffer()
+
+
+@shared_task
+def update_rankings():
+    """
+    Precompute the ordered submission ids of every question list.
+
+    The rankings of debates that are no longer active are only computed
+    when they're missing, and expire after FROZEN_RANKING_TIMEOUT.
+    """
+    if not settings.RANKING_CACHE:
+        return
+    active = activity.active_debate_ids()
+    for debate in Debate.objects.no_cache().all():
+        if debate.id in active:
+            update_debate_rankings.delay(debate.id)
+        elif not ranking.has_rankings(debate):
+            update_debate_rankings.delay(debate.id, frozen=True)
+
+
+@shared_task
+@periodic('update_rankings')
+def update_debate_rankings(debate_id, frozen=False):
+    debate = Debate.objects.get(id=debate_id)
+    set_thread_readonly_db()
     try:
-        with connection.cursor() as cursor:
-            cursor.execute(sql)
-            cursor.execute(sql2)
-    except Exception:
-        logger.exception("Unexpected error in update_trending_scores")
+        return ranking.update_rankings(debate, frozen=frozen)
+    finally:
+        set_thread_readwrite_db()
+
+
+@shared_task
+def find_duplicates():
+    """
+    Record the likely duplicates among new submissions of the active
+    debates, for moderators.
+    """
+    if not settings.DUPLICATE_DETECTION:
+        return
+    for debate_id in activity.active_debate_ids():
+        find_debate_duplicates.delay(debate_id)
+
+
+# A run fingerprints the submissions it started with until it's done, so
+# give it longer than the interval before another one may start.
+@shared_task
+@periodic('find_duplicates', lock_timeout=60 * 30)
+def find_debate_duplicates(debate_id):
+    debate = Debate.objects.get(id=debate_id)
+    fingerprinted, recorded = duplicates.find_duplicates(debate)
+    logger.debug("find_duplicates: %d new submissions and %d candidates in %s" % (
+        fingerprinted, recorded, debate))
+    return fingerprinted
 
 
 @shared_task(ignore_result=True)
@@ -0,0 +1,93 @@
+import datetime
+
+from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from django.utils import timezone
+from mock import patch
+
+from opendebates import activity
+from opendebates.models import Debate, Submission
+from opendebates.tasks import update_trending_scores
+from .factories import CategoryFactory, SubmissionFactory, VoteFactory, SiteFactory, DebateFactory
+
+
+class ActiveDebatesTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.now = timezone.now()
+        self.long_ago = self.now - datetime.timedelta(days=30)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def debate(self, debate_time, open=True):
+        return DebateFactory(site=self.site, debate_time=debate_time,
+                             allow_voting_and_submitting_questions=open)
+
+    def vote(self, debate, created_at):
+        submission = SubmissionFactory(category=CategoryFactory(debate=debate))
+        VoteFactory(submission=submission, created_at=created_at)
+
+    def test_active_debates(self):
+        upcoming = self.debate(self.now + datetime.timedelta(days=1))
+        just_finished = self.debate(self.now - datetime.timedelta(days=1))
+        still_voting = self.debate(self.long_ago, open=False)
+        self.vote(still_voting, self.now)
+        self.debate(self.now + datetime.timedelta(days=1), open=False)
+        finished = self.debate(self.long_ago)
+        self.vote(finished, self.long_ago)
+
+        self.assertEqual({upcoming.id, just_finished.id, still_voting.id},
+                         activity.active_debate_ids(self.now))
+
+    def test_cached(self):
+        upcoming = self.debate(self.now + datetime.timedelta(days=1))
+        with patch('opendebates.activity.cache', new=LocMemCache('active-test', {})):
+            self.assertEqual({upcoming.id}, activity.active_debate_ids())
+            with self.assertNumQueries(0):
+                self.assertEqual({upcoming.id}, activity.active_debate_ids())
+
+
+class FrozenScoresTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        long_ago = timezone.now() - datetime.timedelta(days=30)
+        self.active = DebateFactory(site=self.site, debate_time=timezone.now())
+        self.finished = DebateFactory(site=self.site, debate_time=long_ago)
+        self.active_submission = SubmissionFactory(
+            category=CategoryFactory(debate=self.active), created_at=long_ago)
+        self.finished_submission = SubmissionFactory(
+            category=CategoryFactory(debate=self.finished), created_at=long_ago)
+        for i in range(15):
+            VoteFactory(submission=self.active_submission, created_at=long_ago)
+            VoteFactory(submission=self.finished_submission, created_at=long_ago)
+
+        patcher = patch('opendebates.scoring.cache', new=LocMemCache('activity-test', {}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def score(self, submission):
+        return Submission.objects.get(pk=submission.pk).score
+
+    def test_finished_debate_is_scored_once(self):
+        update_trending_scores()
+        self.assertGreater(self.score(self.finished_submission), 0)
+        self.assertTrue(Debate.objects.no_cache().get(pk=self.finished.pk).scores_frozen)
+        self.assertFalse(Debate.objects.no_cache().get(pk=self.active.pk).scores_frozen)
+
+        Submission.objects.update(score=0)
+        update_trending_scores(full=True)
+        self.assertEqual(0, self.score(self.finished_submission))
+        self.assertGreater(self.score(self.active_submission), 0)
+
+    def test_reactivated_debate_is_unfrozen(self):
+        update_trending_scores()
+        VoteFactory(submission=self.finished_submission, created_at=timezone.now())
+        Submission.objects.update(score=0)
+        update_trending_scores(full=True)
+        self.assertGreater(self.score(self.finished_submission), 0)
+        self.assertFalse(Debate.objects.no_cache().get(pk=self.finished.pk).scores_frozen)
@@ -0,0 +1,158 @@
+import json
+import os
+
+from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from opendebates import counters
+from opendebates.models import Submission, NUMBER_OF_VOTES_CACHE_ENTRY
+from opendebates.tasks import reconcile_vote_totals
+from .factories import SubmissionFactory, SiteFactory, DebateFactory, VoteFactory
+from .utilities import reset_session
+
+
+class VoteBufferTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.submission = SubmissionFactory()
+        self.other_submission = SubmissionFactory()
+
+        self.cache = LocMemCache('vote-buffer-test', {})
+        patcher = patch('opendebates.counters.cache', new=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def test_buffer_vote_does_not_touch_db(self):
+        self.assertTrue(counters.buffer_vote(self.submission.id, current=True, local=False))
+        self.assertEqual(1, counters.pending_votes(self.submission.id))
+        refetched = Submission.objects.get(pk=self.submission.pk)
+        self.assertEqual(self.submission.votes, refetched.votes)
+
+    def test_flush(self):
+        counters.buffer_vote(self.submission.id, current=True, local=True)
+        counters.buffer_vote(self.submission.id, current=False, local=False)
+        counters.buffer_vote(self.other_submission.id, current=True, local=False)
+
+        self.assertEqual(2, counters.flush_vote_buffer())
+
+        refetched = Submission.objects.get(pk=self.submission.pk)
+        self.assertEqual(self.submission.votes + 2, refetched.votes)
+        self.assertEqual(self.submission.current_votes + 1, refetched.current_votes)
+        self.assertEqual(self.submission.local_votes + 1, refetched.local_votes)
+        refetched = Submission.objects.get(pk=self.other_submission.pk)
+        self.assertEqual(self.other_submission.votes + 1, refetched.votes)
+        self.assertEqual(0, counters.pending_votes(self.submission.id))
+
+    def test_flush_twice_does_not_double_count(self):
+        counters.buffer_vote(self.submission.id, current=True, local=False)
+        counters.flush_vote_buffer()
+        self.assertEqual(0, counters.flush_vote_buffer())
+        refetched = Submission.objects.get(pk=self.submission.pk)
+        self.assertEqual(self.submission.votes + 1, refetched.votes)
+
+    def test_failed_buffering_is_undone(self):
+        incr = self.cache.incr
+
+        def fail_on_current_votes(key, delta=1):
+            if key.startswith(counters.VOTE_BUFFER_CACHE_ENTRY.format('current_votes', '')):
+                raise ValueError
+            return incr(key, delta)
+
+        with patch.object(self.cache, 'incr', side_effect=fail_on_current_votes):
+            self.assertFalse(counters.buffer_vote(self.submission.id, current=True, local=False))
+        self.assertEqual(0, counters.pending_votes(self.submission.id))
+        self.assertEqual(0, counters.flush_vote_buffer())
+
+    def test_unsupported_cache(self):
+        with patch.object(self.cache, 'incr', side_effect=ValueError):
+            with patch.object(self.cache, 'add'):
+                self.assertFalse(counters.buffer_vote(self.submission.id, True, True))
+
+
+@override_settings(VOTE_BUFFERING=True)
+class BufferedVoteViewTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.submission = SubmissionFactory()
+        self.cache = LocMemCache('vote-buffer-view-test', {})
+        patcher = patch('opendebates.counters.cache', new=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ['NORECAPTCHA_TESTING'] = 'True'
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+        del os.environ['NORECAPTCHA_TESTING']
+
+    def test_vote_is_buffered(self):
+        reset_session(self.client)
+        data = {
+            'email': 'anon@example.com',
+            'zipcode': '12345',
+            'g-recaptcha-response': 'PASSED'
+        }
+        rsp = self.client.post(self.submission.get_absolute_url(), data=data,
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(200, rsp.status_code)
+        # The response tally includes the buffered vote ...
+        self.assertEqual(self.submission.votes + 1, json.loads(rsp.content)['tally'])
+        # ... but the database is only updated by the flush.
+        refetched = Submission.objects.get(pk=self.submission.pk)
+        self.assertEqual(self.submission.votes, refetched.votes)
+        counters.flush_vote_buffer()
+        refetched = Submission.objects.get(pk=self.submission.pk)
+        self.assertEqual(self.submission.votes + 1, refetched.votes)
+
+
+class VoteTotalTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.submission = SubmissionFactory()
+        self.key = NUMBER_OF_VOTES_CACHE_ENTRY.format(self.debate.id)
+        self.cache = LocMemCache('vote-total-test', {})
+        patcher = patch('opendebates.counters.cache', new=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ['NORECAPTCHA_TESTING'] = 'True'
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+        del os.environ['NORECAPTCHA_TESTING']
+
+    def test_count_vote_without_total(self):
+        counters.count_vote(self.debate.id)
+        self.assertIsNone(self.cache.get(self.key))
+
+    def test_count_vote(self):
+        self.cache.set(self.key, 10)
+        counters.count_vote(self.debate.id)
+        self.assertEqual(11, self.cache.get(self.key))
+
+    def test_reconcile(self):
+        VoteFactory(submission=self.submission)
+        VoteFactory(submission=self.submission)
+        self.cache.set(self.key, 10)
+        reconcile_vote_totals()
+        self.assertEqual(2, self.cache.get(self.key))
+
+    def test_vote_view_counts_vote(self):
+        self.cache.set(self.key, 10)
+        reset_session(self.client)
+        data = {
+            'email': 'anon@example.com',
+            'zipcode': '12345',
+            'g-recaptcha-response': 'PASSED'
+        }
+        rsp = self.client.post(self.submission.get_absolute_url(), data=data,
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(200, rsp.status_code)
+        self.assertEqual(11, self.cache.get(self.key))
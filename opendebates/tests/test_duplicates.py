@@ -0,0 +1,66 @@
+from django.contrib.sites.models import Site
+from django.test import TestCase
+
+from opendebates.duplicates import (NUM_BANDS, NUM_HASHES, band_hashes, find_duplicates,
+                                    minhash, similarity)
+from opendebates.models import DuplicateCandidate, SubmissionFingerprint
+from .factories import SubmissionFactory, SiteFactory, DebateFactory, CategoryFactory
+
+
+QUESTION = ("What will you do to lower the price of prescription drugs for seniors "
+            "on fixed incomes")
+SIMILAR_QUESTION = ("How would you lower the price of prescription drugs for seniors "
+                    "living on fixed incomes?")
+OTHER_QUESTION = "Should the minimum wage be raised in every state, and by how much"
+
+
+class MinHashTest(TestCase):
+    def test_signature(self):
+        signature = minhash(QUESTION)
+        self.assertEqual(NUM_HASHES, len(signature))
+        self.assertEqual(signature, minhash(QUESTION.upper()))
+        self.assertEqual(NUM_BANDS, len(band_hashes(signature)))
+        self.assertEqual([], minhash(u'?!'))
+
+    def test_similarity(self):
+        signature = minhash(QUESTION)
+        self.assertEqual(1.0, similarity(signature, signature))
+        self.assertGreater(similarity(signature, minhash(SIMILAR_QUESTION)), 0.6)
+        self.assertLess(similarity(signature, minhash(OTHER_QUESTION)), 0.2)
+        self.assertEqual(0.0, similarity([], []))
+
+
+class FindDuplicatesTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.category = CategoryFactory(debate=self.debate)
+        self.first = SubmissionFactory(category=self.category, idea=QUESTION)
+        self.other = SubmissionFactory(category=self.category, idea=OTHER_QUESTION)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def test_finds_duplicates(self):
+        second = SubmissionFactory(category=self.category, idea=SIMILAR_QUESTION)
+        self.assertEqual((3, 1), find_duplicates(self.debate, batch_size=2))
+        candidate = DuplicateCandidate.objects.get()
+        self.assertEqual(second, candidate.to_remove)
+        self.assertEqual(self.first, candidate.duplicate_of)
+        self.assertGreater(candidate.score, 0.6)
+
+    def test_incremental(self):
+        self.assertEqual((2, 0), find_duplicates(self.debate))
+        self.assertEqual(2, SubmissionFingerprint.objects.count())
+        second = SubmissionFactory(category=self.category, idea=SIMILAR_QUESTION)
+        self.assertEqual((1, 1), find_duplicates(self.debate))
+        self.assertEqual(second, DuplicateCandidate.objects.get().to_remove)
+        self.assertEqual((0, 0), find_duplicates(self.debate))
+
+    def test_ignores_unapproved_and_other_debates(self):
+        SubmissionFactory(category=self.category, idea=SIMILAR_QUESTION, approved=False)
+        other_debate = DebateFactory(site=self.site)
+        SubmissionFactory(category=CategoryFactory(debate=other_debate), idea=SIMILAR_QUESTION)
+        self.assertEqual((2, 0), find_duplicates(self.debate))
+        self.assertEqual((1, 0), find_duplicates(other_debate))
+        self.assertFalse(DuplicateCandidate.objects.exists())
@@ -0,0 +1,68 @@
+import datetime
+
+from django.contrib.sites.models import Site
+from django.db.models import F
+from django.test import TestCase
+from django.utils import timezone
+
+from opendebates.merging import MergeReport, merge_submissions
+from opendebates.models import Submission, Vote
+from .factories import SubmissionFactory, SiteFactory, DebateFactory, VoteFactory, VoterFactory
+
+
+class MergeSubmissionsTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site, debate_state='FL')
+        self.to_remove = SubmissionFactory(votes=0, current_votes=0)
+        self.duplicate_of = SubmissionFactory(votes=0, current_votes=0)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def vote(self, submission, voter, **kwargs):
+        VoteFactory(submission=submission, voter=voter, **kwargs)
+        Submission.objects.filter(pk=submission.pk).update(votes=F('votes') + 1)
+
+    def test_merge(self):
+        shared_voter = VoterFactory(state='FL')
+        local_voter = VoterFactory(state='FL')
+        other_voter = VoterFactory(state='NY')
+        self.vote(self.to_remove, shared_voter)
+        self.vote(self.to_remove, local_voter)
+        self.vote(self.to_remove, other_voter)
+        self.vote(self.duplicate_of, shared_voter)
+
+        report = merge_submissions(self.to_remove, self.duplicate_of, self.debate)
+
+        self.assertEqual(MergeReport(moved=2, current=2, local=1, kept=1), report)
+        remaining = Submission.objects.get(pk=self.duplicate_of.pk)
+        self.assertEqual(3, remaining.votes)
+        self.assertEqual(2, remaining.current_votes)
+        self.assertEqual(1, remaining.local_votes)
+        self.assertTrue(remaining.has_duplicates)
+        self.assertIn(self.to_remove.idea, remaining.keywords)
+        merged = Submission.objects.get(pk=self.to_remove.pk)
+        self.assertEqual(self.duplicate_of, merged.duplicate_of)
+        self.assertIsNotNone(merged.moderated_at)
+        self.assertEqual(
+            set([local_voter.pk, other_voter.pk]),
+            set(Vote.objects.filter(original_merged_submission=merged)
+                .values_list('voter_id', flat=True)))
+        self.assertEqual(1, Vote.objects.filter(submission=merged).count())
+
+    def test_merge_with_previous_debate(self):
+        self.debate.previous_debate_time = timezone.now() - datetime.timedelta(days=1)
+        self.debate.save()
+        old = timezone.now() - datetime.timedelta(days=2)
+        self.vote(self.to_remove, VoterFactory(state='NY'), created_at=old)
+        self.vote(self.to_remove, VoterFactory(state='NY'))
+
+        report = merge_submissions(self.to_remove, self.duplicate_of, self.debate)
+
+        self.assertEqual(MergeReport(moved=2, current=1, local=0, kept=0), report)
+        self.assertEqual(1, Submission.objects.get(pk=self.duplicate_of.pk).current_votes)
+
+    def test_merge_without_votes(self):
+        report = merge_submissions(self.to_remove, self.duplicate_of, self.debate)
+        self.assertEqual(MergeReport(moved=0, current=0, local=0, kept=0), report)
@@ -9,7 +9,7 @@ from django.test import TestCase
 from django.utils import timezone
 from mock import patch
 
-from opendebates.models import Submission, Vote, Flag, ZipCode
+from opendebates.models import DuplicateCandidate, Submission, Vote, Flag, ZipCode
 from opendebates_emails.tests.factories import EmailTemplateFactory
 from .factories import (UserFactory, VoterFactory, SubmissionFactory, RemovalFlagFactory,
                         MergeFlagFactory, SiteFactory, DebateFactory, CategoryFactory)
@@ -464,6 +464,9 @@ class ModerationTest(TestCase):
         # pretend a user created a merge flag
         flag = MergeFlagFactory(to_remove=self.first_submission,
                                 duplicate_of=self.second_submission)
+        # and the duplicate detection found the pair
+        candidate = DuplicateCandidate.objects.create(
+            to_remove=self.second_submission, duplicate_of=self.first_submission, score=0.8)
         # now let's reject the merge
         data = {
             'to_remove': self.first_submission.pk,
@@ -479,6 +482,8 @@ class ModerationTest(TestCase):
         # and Flag is now marked reviewed
         refetched_flag = Flag.objects.get(pk=flag.pk)
         self.assertEqual(refetched_flag.reviewed, True)
+        # and so is the duplicate candidate
+        self.assertTrue(DuplicateCandidate.objects.get(pk=candidate.pk).reviewed)
 
     def test_preview_missing_submission(self):
         data = {
@@ -596,6 +601,26 @@ class ModerationHomeTest(TestCase):
         self.assertIn(merge, qs)
         self.assertNotIn(merge2, qs)
 
+    def test_duplicate_candidates(self):
+        cat = CategoryFactory(debate=self.debate)
+        first, second, third = SubmissionFactory.create_batch(size=3, category=cat)
+        removed = SubmissionFactory(category=cat, approved=False)
+        other_debate_cat = CategoryFactory(debate=DebateFactory(site=self.site))
+        likely = DuplicateCandidate.objects.create(to_remove=second, duplicate_of=first,
+                                                   score=0.9)
+        less_likely = DuplicateCandidate.objects.create(to_remove=third, duplicate_of=first,
+                                                        score=0.6)
+        DuplicateCandidate.objects.create(to_remove=third, duplicate_of=second, score=0.7,
+                                          reviewed=True)
+        DuplicateCandidate.objects.create(to_remove=removed, duplicate_of=first, score=0.9)
+        DuplicateCandidate.objects.create(
+            to_remove=SubmissionFactory(category=other_debate_cat),
+            duplicate_of=SubmissionFactory(category=other_debate_cat), score=0.9)
+
+        rsp = self.client.get(self.url)
+        self.assertEqual(OK, rsp.status_code)
+        self.assertEqual([likely, less_likely], list(rsp.context['duplicate_candidates']))
+
 
 class RemovalFlagTest(TestCase):
     def setUp(self):
@@ -6,6 +6,7 @@ from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.utils import override_settings
+from mock import patch
 
 from .factories import SubmissionFactory, SiteFactory, DebateFactory
 from .utilities import patch_cache_templatetag
@@ -107,3 +108,87 @@ class PaginationTest(TestCase):
         self.assertEqual(['foo'], qs.get('baz'))
         self.assertEqual(['2'], qs.get('page'))
         self.assertEqual(5, len(qs.keys()))
+
+
+@override_settings(SUBMISSIONS_PER_PAGE=2, KEYSET_PAGINATION=True)
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+
+        # Two submissions tie on votes, to exercise the id tiebreaker
+        self.ideas = [SubmissionFactory(votes=votes) for votes in (5, 3, 3, 1)]
+
+        self.url = reverse('list_ideas', kwargs={'prefix': self.debate.prefix})
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def find_next_link(self, content):
+        link = re.search(r'<a href="([^"]*)" rel="next nofollow" class="endless_page_link">', content)
+        return link.groups()[0].replace('&amp;', '&') if link else None
+
+    def test_pages_follow_sort_order(self):
+        seen = []
+        url = self.url + '?sort=-votes'
+        while url:
+            rsp = self.client.get(url)
+            seen.extend(idea.id for idea in rsp.context['page'].object_list)
+            link = self.find_next_link(rsp.content)
+            url = self.url + link if link else None
+        expected = [self.ideas[0].id, self.ideas[2].id, self.ideas[1].id, self.ideas[3].id]
+        self.assertEqual(expected, seen)
+
+    @patch('opendebates.utils.random_seed', return_value=42)
+    def test_random_pages_cover_every_submission(self, random_seed):
+        seen = []
+        url = self.url + '?sort=random'
+        while url:
+            rsp = self.client.get(url)
+            seen.extend(idea.id for idea in rsp.context['page'].object_list)
+            link = self.find_next_link(rsp.content)
+            url = self.url + link if link else None
+        self.assertEqual(sorted(idea.id for idea in self.ideas), sorted(seen))
+
+    def test_random_cursor_keeps_its_window(self):
+        with patch('opendebates.utils.random_seed', return_value=42):
+            rsp = self.client.get(self.url + '?sort=random')
+        seen = [idea.id for idea in rsp.context['page'].object_list]
+        link = self.find_next_link(rsp.content)
+        # The window changes before the next page
+        with patch('opendebates.utils.random_seed', return_value=43):
+            rsp = self.client.get(self.url + link)
+        seen.extend(idea.id for idea in rsp.context['page'].object_list)
+        self.assertEqual(sorted(idea.id for idea in self.ideas), sorted(seen))
+
+    @patch_cache_templatetag()
+    def test_cached_page_is_not_queried(self):
+        rsp = self.client.get(self.url + '?sort=-votes')
+        self.assertEqual(2, len(rsp.context['page'].object_list))
+        rsp = self.client.get(self.url + '?sort=-votes')
+        # Served from the idea_list fragment cache
+        self.assertNotIn('_page', rsp.context['page'].__dict__)
+
+    def test_next_link_has_cursor(self):
+        rsp = self.client.get(self.url + '?sort=-date&source=foo')
+        link = self.find_next_link(rsp.content)
+        qs = urlparse.parse_qs(urlparse.urlparse(link).query)
+        self.assertEqual(['foo'], qs.get('source'))
+        self.assertIn('cursor', qs)
+        self.assertNotIn('endless_page_link">2<', rsp.content)
+
+    def test_cursor_for_other_sort_starts_over(self):
+        rsp = self.client.get(self.url + '?sort=-votes')
+        link = self.find_next_link(rsp.content)
+        rsp = self.client.get(self.url + link.replace('sort=-votes', 'sort=%2Bvotes'))
+        self.assertEqual(self.ideas[3].id, rsp.context['page'].object_list[0].id)
+
+    def test_bad_cursor_starts_over(self):
+        rsp = self.client.get(self.url + '?sort=-votes&cursor=garbage')
+        self.assertEqual(200, rsp.status_code)
+        self.assertEqual(self.ideas[0].id, rsp.context['page'].object_list[0].id)
+
+    def test_offset_links_still_work(self):
+        rsp = self.client.get(self.url + '?sort=-votes&page=2')
+        self.assertIsNone(rsp.context['page'])
+        self.assertIn('endless_page_link', rsp.content)
@@ -0,0 +1,104 @@
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from mock import Mock, patch
+
+from opendebates import periodic
+
+
+class PeriodicTest(TestCase):
+    def setUp(self):
+        self.cache = LocMemCache('periodic-test', {})
+        patcher = patch('opendebates.periodic.cache', new=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('opendebates.periodic.record_metric')
+        self.record_metric = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('opendebates.periodic.task_interval', return_value=60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.func = Mock(return_value=7)
+        self.func.__name__ = 'test_task'
+        self.task = periodic.periodic('test_task')(self.func)
+
+    def clock(self, *times):
+        # Not time.time itself, which the cache uses too
+        clock = Mock()
+        clock.time.side_effect = list(times)
+        return patch('opendebates.periodic.time', new=clock)
+
+    def metrics(self):
+        return [call[0][1:] for call in self.record_metric.call_args_list]
+
+    def test_run(self):
+        with self.clock(100, 112):
+            self.assertEqual(7, self.task(1, full=True))
+        self.func.assert_called_once_with(1, full=True)
+        self.assertEqual([('duration', 12), ('rows', 7)], self.metrics())
+        # The lock is released
+        self.assertIsNone(self.cache.get(periodic.TASK_LOCK_CACHE_ENTRY.format('test_task', 1)))
+
+    def test_locked(self):
+        self.cache.add(periodic.TASK_LOCK_CACHE_ENTRY.format('test_task', 1), True)
+        self.assertIsNone(self.task(1))
+        self.assertFalse(self.func.called)
+        self.assertEqual([('skipped', 1)], self.metrics())
+        # Other debates aren't
+        self.assertEqual(7, self.task(2))
+
+    def test_expired_lock(self):
+        lock = periodic.TASK_LOCK_CACHE_ENTRY.format('test_task', 1)
+
+        def run(*args, **kwargs):
+            # The lock expires, and another run takes it
+            self.cache.set(lock, 'other')
+            return 7
+        self.func.side_effect = run
+        self.task(1)
+        self.assertEqual('other', self.cache.get(lock))
+
+    def test_release_with_cas(self):
+        client = Mock(cache_cas=True, cas_ids={})
+        with patch('opendebates.periodic.cache', new=Mock(_cache=client)) as cache:
+            cache.make_key.return_value = ':1:lock'
+            client.gets.return_value = 'token'
+            periodic.release_lock('lock', 'token')
+            client.cas.assert_called_once_with(':1:lock', 'token', -1)
+
+            # Another run's lock is left alone
+            client.cas.reset_mock()
+            client.gets.return_value = 'other'
+            periodic.release_lock('lock', 'token')
+            self.assertFalse(client.cas.called)
+            self.assertFalse(cache.delete.called)
+
+    def test_error(self):
+        self.func.side_effect = ValueError
+        self.assertIsNone(self.task(1))
+        self.assertIn(('errors', 1), self.metrics())
+        self.assertIsNone(self.cache.get(periodic.TASK_LOCK_CACHE_ENTRY.format('test_task', 1)))
+
+    def test_backoff(self):
+        # Takes 100 seconds: the next minute of runs is skipped
+        with self.clock(0, 100, 100):
+            self.task(1)
+        with self.clock(150, 150):
+            self.assertIsNone(self.task(1))
+        self.assertEqual(1, self.func.call_count)
+
+        # Slow again: the backoff doubles
+        with self.clock(200, 200, 300, 300):
+            self.task(1)
+        with self.clock(400, 400):
+            self.assertIsNone(self.task(1))
+        self.assertEqual(2, self.func.call_count)
+
+        # A fast run ends it
+        with self.clock(500, 500, 510):
+            self.task(1)
+        with self.clock(520, 520):
+            self.task(1)
+        self.assertEqual(4, self.func.call_count)
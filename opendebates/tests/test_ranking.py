@@ -0,0 +1,99 @@
+from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from opendebates import ranking
+from opendebates.utils import SORT_ORDERINGS, pack_ids, random_key, sort_list, unpack_ids
+from opendebates.models import Submission
+from .factories import CategoryFactory, SubmissionFactory, SiteFactory, DebateFactory
+
+
+@override_settings(RANKING_CACHE=True)
+class RankingTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.category1 = CategoryFactory(debate=self.debate)
+        self.category2 = CategoryFactory(debate=self.debate)
+        self.ideas = [
+            SubmissionFactory(category=self.category1, votes=3, score=1.5, citation_verified=True),
+            SubmissionFactory(category=self.category2, votes=3, score=0.5),
+            SubmissionFactory(category=self.category1, votes=7, score=2.5, editors_pick=True),
+            SubmissionFactory(category=self.category2, votes=1, score=0.5),
+        ]
+        # Not listed
+        SubmissionFactory(category=self.category1, approved=False)
+        SubmissionFactory(category=self.category1, duplicate_of=self.ideas[0])
+        SubmissionFactory(category=CategoryFactory(debate=DebateFactory(site=self.site)))
+
+        self.cache = LocMemCache('ranking-test', {})
+        patcher = patch('opendebates.ranking.cache', new=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    # The random sort must be in the same window for both
+    @patch('opendebates.utils.random_seed', return_value=42)
+    @patch('opendebates.ranking.random_seed', return_value=42)
+    def test_rankings_match_sort_list(self, ranking_seed, utils_seed):
+        ranking.update_rankings(self.debate)
+        for sort in SORT_ORDERINGS:
+            for citations_only in (False, True):
+                for category_id in (None, self.category1.id, self.category2.id):
+                    queryset = Submission.objects.filter(category__debate=self.debate)
+                    if category_id:
+                        queryset = queryset.filter(category=category_id)
+                    expected = [idea.id for idea in sort_list(citations_only, sort, queryset)]
+                    ranked = ranking.get_ranked_submissions(self.debate, sort, citations_only,
+                                                            category_id=category_id)
+                    self.assertEqual(expected, list(ranked.ids), (sort, citations_only, category_id))
+
+    def test_slice_fetches_page(self):
+        ranking.update_rankings(self.debate)
+        ranked = ranking.get_ranked_submissions(self.debate, '-votes', False)
+        self.assertEqual(4, ranked.count())
+        with self.assertNumQueries(1):
+            page = ranked[1:3]
+        self.assertEqual([self.ideas[1].id, self.ideas[0].id], [idea.id for idea in page])
+
+    def test_slice_skips_removed(self):
+        ranking.update_rankings(self.debate)
+        Submission.objects.filter(pk=self.ideas[2].pk).update(approved=False)
+        ranked = ranking.get_ranked_submissions(self.debate, '-votes', False)
+        self.assertEqual([self.ideas[1].id, self.ideas[0].id], [idea.id for idea in ranked[0:3]])
+
+    def test_frozen(self):
+        with patch.object(self.cache, 'set_many', wraps=self.cache.set_many) as set_many:
+            ranking.update_rankings(self.debate, frozen=True)
+        self.assertEqual(ranking.FROZEN_RANKING_TIMEOUT, set_many.call_args[0][1])
+        self.assertIsNotNone(ranking.get_ranked_submissions(self.debate, '-votes', False))
+
+    @override_settings(RANKING_CACHE=False)
+    @patch('opendebates.ranking.random_seed', return_value=42)
+    def test_random_ranking(self, random_seed):
+        with self.assertNumQueries(1):
+            ranked = ranking.get_ranked_submissions(self.debate, 'random', False)
+        expected = sorted((idea.id for idea in self.ideas),
+                          key=lambda id: (random_key(id, 42), id), reverse=True)
+        self.assertEqual(expected, list(ranked.ids))
+        # Computed once per window
+        with self.assertNumQueries(0):
+            ranking.get_ranked_submissions(self.debate, 'random', False)
+        ranked = ranking.get_random_ranking(self.debate, False, seed=43)
+        self.assertEqual(sorted(expected), sorted(ranked.ids))
+
+    def test_miss(self):
+        self.assertIsNone(ranking.get_ranked_submissions(self.debate, '-votes', False))
+
+    @override_settings(RANKING_CACHE=False)
+    def test_disabled(self):
+        ranking.update_rankings(self.debate)
+        self.assertIsNone(ranking.get_ranked_submissions(self.debate, '-votes', False))
+
+    def test_pack_roundtrip(self):
+        ids = [1, 5, 2 ** 31 - 1, 3]
+        self.assertEqual(ids, list(unpack_ids(pack_ids(ids))))
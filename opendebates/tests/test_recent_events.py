@@ -1,15 +1,20 @@
+import datetime
 from functools import partial
 from httplib import OK
 
 from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.utils import timezone
 
 import mock
 
-from ..models import RECENT_EVENTS_CACHE_ENTRY, NUMBER_OF_VOTES_CACHE_ENTRY
+from .. import feed
+from ..models import NUMBER_OF_VOTES_CACHE_ENTRY
 from ..tasks import update_recent_events
-from .factories import CategoryFactory, SubmissionFactory, VoteFactory, SiteFactory, DebateFactory
+from .factories import (CategoryFactory, SubmissionFactory, VoteFactory, VoterFactory, SiteFactory,
+                        DebateFactory)
 
 
 # Force the reverse() used here in the tests to always use the full
@@ -34,52 +39,100 @@ class RecentEventsTest(TestCase):
         self.vote2 = VoteFactory(submission=sub2)
         self.vote3 = VoteFactory(submission=sub2)
 
+        self.cache = LocMemCache('recent-events-test', {})
+        patcher = mock.patch('opendebates.feed.cache', new=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def tearDown(self):
         Site.objects.clear_cache()
 
+    def event_ids(self, events):
+        return [(event['kind'], event['submission_id'], event['voter_id']) for event in events]
+
     def test_computing_recent_events(self):
-        mock_cache = mock.MagicMock()
-        with mock.patch('opendebates.tasks.cache', new=mock_cache):
-            update_recent_events()
-
-        mock_cache.set.assert_any_call(
-            RECENT_EVENTS_CACHE_ENTRY.format(self.mode1.id),
-            [self.vote1, self.vote1.submission],
-            24*3600
-        )
-        mock_cache.set.assert_any_call(
-            RECENT_EVENTS_CACHE_ENTRY.format(self.mode2.id),
-            [self.vote3, self.vote2, self.vote2.submission],
-            24*3600
-        )
-
-        mock_cache.set.assert_any_call(
-            NUMBER_OF_VOTES_CACHE_ENTRY.format(self.mode1.id),
-            1,
-            24*3600
-        )
-        mock_cache.set.assert_any_call(
-            NUMBER_OF_VOTES_CACHE_ENTRY.format(self.mode2.id),
-            2,
-            24*3600
-        )
+        with mock.patch('opendebates.tasks.cache', new=self.cache):
+            with mock.patch('opendebates.counters.cache', new=self.cache):
+                update_recent_events()
+
+        self.assertEqual(
+            [feed.vote_event(self.vote1), feed.submission_event(self.vote1.submission)],
+            feed.recent_events(self.mode1.id))
+        self.assertEqual(
+            self.event_ids([feed.vote_event(self.vote3), feed.vote_event(self.vote2),
+                            feed.submission_event(self.vote2.submission)]),
+            self.event_ids(feed.recent_events(self.mode2.id)))
+
+        # Missing vote totals are restored
+        self.assertEqual(1, self.cache.get(NUMBER_OF_VOTES_CACHE_ENTRY.format(self.mode1.id)))
+        self.assertEqual(2, self.cache.get(NUMBER_OF_VOTES_CACHE_ENTRY.format(self.mode2.id)))
+
+    def test_vote_totals_are_not_recounted(self):
+        self.cache.set(NUMBER_OF_VOTES_CACHE_ENTRY.format(self.mode1.id), 5)
+        with mock.patch('opendebates.tasks.cache', new=self.cache):
+            with mock.patch('opendebates.counters.cache', new=self.cache):
+                update_recent_events()
+        self.assertEqual(5, self.cache.get(NUMBER_OF_VOTES_CACHE_ENTRY.format(self.mode1.id)))
+
+    def test_no_feed(self):
+        self.assertIsNone(feed.recent_events(self.mode1.id))
+        # Appending to a missing feed waits for the rebuild
+        feed.append_event(self.mode1.id, feed.vote_event(self.vote1))
+        self.assertIsNone(feed.recent_events(self.mode1.id))
+
+    def test_append_event(self):
+        feed.rebuild_feed(self.mode1)
+        vote = VoteFactory(submission=self.vote1.submission)
+        feed.append_event(self.mode1.id, feed.vote_event(vote))
+        events = feed.recent_events(self.mode1.id)
+        self.assertEqual(3, len(events))
+        self.assertEqual(feed.vote_event(vote), events[0])
+
+    def test_feed_keeps_newest_events(self):
+        feed.rebuild_feed(self.mode1)
+        votes = [VoteFactory(submission=self.vote1.submission)
+                 for i in range(feed.FEED_SIZE + 2)]
+        for vote in votes:
+            feed.append_event(self.mode1.id, feed.vote_event(vote))
+        events = feed.recent_events(self.mode1.id)
+        self.assertEqual(feed.FEED_SIZE, len(events))
+        self.assertEqual(
+            self.event_ids([feed.vote_event(vote) for vote in reversed(votes)][:feed.FEED_SIZE]),
+            self.event_ids(events))
+
+    def test_rebuild_keeps_sequence_and_new_events(self):
+        feed.rebuild_feed(self.mode1)
+        seq_key = feed.RECENT_EVENTS_SEQ_CACHE_ENTRY.format(self.mode1.id)
+        votes = [VoteFactory(submission=self.vote1.submission) for i in range(3)]
+        for vote in votes:
+            feed.append_event(self.mode1.id, feed.vote_event(vote))
+        seq = self.cache.get(seq_key)
+        # Appended while the rebuild runs, but not in what it reads
+        late = feed.vote_event(VoteFactory.build(submission=self.vote1.submission,
+                                                 voter=VoterFactory(),
+                                                 created_at=timezone.now()))
+        feed.append_event(self.mode1.id, late)
+
+        started = late['created_at'] - datetime.timedelta(seconds=1)
+        with mock.patch('opendebates.feed.timezone.now', return_value=started):
+            feed.rebuild_feed(self.mode1)
+
+        self.assertGreater(self.cache.get(seq_key), seq + 1)
+        events = feed.recent_events(self.mode1.id)
+        self.assertEqual(6, len(events))
+        self.assertEqual(late, events[0])
 
     def test_view_returns_events(self):
-        mock_cache = mock.MagicMock()
-
-        mock_cache.get.return_value = [
-            self.vote3,
-            self.vote3.submission,
-            self.vote2,
-            self.vote2.submission
-        ]
-        with mock.patch('opendebates.views.cache', new=mock_cache):
-            rsp = self.client.get(reverse('recent_activity',
-                                          kwargs={'prefix': self.mode2.prefix}))
-        mock_cache.get.assert_called_with(
-            RECENT_EVENTS_CACHE_ENTRY.format(self.mode2.id), default=[])
+        feed.rebuild_feed(self.mode2)
+        rsp = self.client.get(reverse('recent_activity',
+                                      kwargs={'prefix': self.mode2.prefix}))
         self.assertEqual(OK, rsp.status_code)
         html = rsp.content.decode('UTF-8')
         self.assertIn(self.vote3.submission.idea, html)
         self.assertIn(self.vote2.submission.idea, html)
         self.assertNotIn(self.vote1.submission.idea, html)
+
+    def test_view_without_feed(self):
+        rsp = self.client.get(reverse('recent_activity',
+                                      kwargs={'prefix': self.mode2.prefix}))
+        self.assertEqual(OK, rsp.status_code)
@@ -0,0 +1,29 @@
+from django.test import TestCase
+from django.urls import resolve, reverse
+
+from opendebates import views
+from opendebates.resolvers import UrlconfRegistry, get_prefixed_urlconf
+
+
+class PrefixedUrlconfTest(TestCase):
+    def test_same_urlconf_per_prefix(self):
+        self.assertIs(get_prefixed_urlconf('one'), get_prefixed_urlconf('one'))
+        self.assertIsNot(get_prefixed_urlconf('one'), get_prefixed_urlconf('two'))
+
+    def test_urlpatterns_built_once(self):
+        urlconf = get_prefixed_urlconf('one')
+        self.assertIs(urlconf.urlpatterns, urlconf.urlpatterns)
+
+    def test_resolve_and_reverse(self):
+        urlconf = get_prefixed_urlconf('one')
+        self.assertEqual(views.vote, resolve('/one/questions/5/vote/', urlconf=urlconf).func)
+        self.assertEqual('/one/questions/5/vote/', reverse('vote', kwargs={'id': 5}, urlconf=urlconf))
+
+    def test_registry_is_bounded(self):
+        registry = UrlconfRegistry(max_size=2)
+        first = registry.get('one')
+        registry.get('two')
+        # Using 'one' makes 'two' the least recently used
+        self.assertIs(first, registry.get('one'))
+        registry.get('three')
+        self.assertEqual(['one', 'three'], list(registry.urlconfs))
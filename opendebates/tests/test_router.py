@@ -1,3 +1,4 @@
+import threading
 from datetime import datetime, timedelta
 
 from django.conf import settings
@@ -5,12 +6,13 @@ from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpRequest
 from django.test import TestCase
 from django.test.utils import override_settings
-from mock import Mock
+from mock import Mock, patch
 
 from opendebates.models import Submission
 from opendebates.router import DBRouter, is_thread_readwrite, set_thread_readwrite_db, \
     set_thread_readonly_db, set_db_written_flag, was_db_written, clear_db_written_flag, \
-    DBRoutingMiddleware, PINNING_KEY, readwrite_db, readonly_db
+    DBRoutingMiddleware, PINNING_KEY, readwrite_db, readonly_db, get_read_db, ReplicaMonitor, \
+    parse_lsn, RoutingState
 
 
 class RouterMiddlewareTest(TestCase):
@@ -156,6 +158,176 @@ class DBRouterTest(TestCase):
         self.assertFalse(was_db_written())
 
 
+@patch('opendebates.router.MAX_LAG_SECONDS', 5)
+@patch.object(ReplicaMonitor, 'start')
+class LagAwareDBRouterTest(TestCase):
+    pool = {
+        'replica0': 1,
+        'replica1': 3,
+    }
+
+    def setUp(self):
+        if not hasattr(settings, 'MASTER_DATABASE'):
+            settings.MASTER_DATABASE = ''
+        set_thread_readonly_db()
+
+    def tearDown(self):
+        set_thread_readwrite_db()
+
+    def make_router(self, **lags):
+        with override_settings(DATABASE_POOL=self.pool, MASTER_DATABASE='master'):
+            router = DBRouter()
+        for db, lag in lags.items():
+            router.monitor.record(db, lag)
+        return router
+
+    def test_skips_lagging_replica(self, start):
+        router = self.make_router(replica0=1.0, replica1=30.0)
+        for i in range(10):
+            self.assertEqual('replica0', router.db_for_read(Submission))
+        self.assertEqual('replica0', get_read_db())
+        self.assertTrue(start.called)
+
+    def test_skips_unhealthy_replica(self, start):
+        router = self.make_router(replica0=None, replica1=0.0)
+        self.assertEqual('replica1', router.db_for_read(Submission))
+
+    def test_skips_replica_without_recent_sample(self, start):
+        router = self.make_router(replica1=0.0)
+        self.assertEqual('replica1', router.db_for_read(Submission))
+
+    def test_master_when_all_replicas_lag(self, start):
+        router = self.make_router(replica0=10.0, replica1=None)
+        self.assertEqual('master', router.db_for_read(Submission))
+        self.assertEqual('master', get_read_db())
+
+    def test_weighted_choice(self, start):
+        router = self.make_router(replica0=0.0, replica1=0.0)
+        with patch('opendebates.router.random.uniform', return_value=0.5):
+            self.assertEqual('replica0', router.db_for_read(Submission))
+        with patch('opendebates.router.random.uniform', return_value=2.0):
+            self.assertEqual('replica1', router.db_for_read(Submission))
+
+    def test_sample_failure_marks_replica_unhealthy(self, start):
+        router = self.make_router(replica0=0.0, replica1=0.0)
+        monitor = router.monitor
+        with patch.object(monitor, 'measure_lag', side_effect=[Exception, 2.0]):
+            with patch('opendebates.router.connections'):
+                monitor.sample()
+        lags = dict((db, monitor.lag(db)) for db in monitor.dbs)
+        self.assertIn(None, lags.values())
+        self.assertIn(2.0, lags.values())
+
+    def measure_lag(self, row):
+        monitor = ReplicaMonitor(['replica0'])
+        with patch('opendebates.router.current_lsn', return_value='0/3000000'):
+            with patch('opendebates.router.connections') as connections:
+                connection = connections.__getitem__.return_value
+                connection.pg_version = 100000
+                cursor = connection.cursor.return_value.__enter__.return_value
+                cursor.fetchone.return_value = row
+                lag = monitor.measure_lag('replica0')
+        self.assertEqual(['0/3000000'], cursor.execute.call_args[0][1])
+        return lag
+
+    def test_measure_lag(self, start):
+        # Caught up with the master, however old its last transaction
+        self.assertEqual(0.0, self.measure_lag((True, True, 3600.0)))
+        # Behind the master, e.g. because its WAL receiver disconnected
+        self.assertEqual(3600.0, self.measure_lag((True, False, 3600.0)))
+        self.assertIsNone(self.measure_lag((True, False, None)))
+        # Not a replica
+        self.assertEqual(0.0, self.measure_lag((False, None, None)))
+
+    def test_pinning_outlasts_max_lag(self, start):
+        with patch('opendebates.router.MAX_LAG_SECONDS', 60):
+            middleware = DBRoutingMiddleware()
+            request = Mock(spec=HttpRequest, method='POST', path='/')
+            request.session = {}
+            middleware.process_request(request)
+            set_db_written_flag()
+            middleware.process_response(request, Mock())
+        self.assertTrue(request.session[PINNING_KEY] > datetime.now() + timedelta(seconds=50))
+
+
+@override_settings(MASTER_DATABASE='master')
+@patch('opendebates.router.LSN_PINNING', True)
+class LSNPinningTest(TestCase):
+    pool = {
+        'replica0': 1,
+        'replica1': 1,
+    }
+
+    def setUp(self):
+        self.middleware = DBRoutingMiddleware()
+        clear_db_written_flag()
+
+    def tearDown(self):
+        set_thread_readwrite_db()
+
+    def make_request(self, method, lsn=None):
+        request = Mock(spec=HttpRequest, method=method)
+        request.session = {}
+        request.COOKIES = {PINNING_KEY: lsn} if lsn else {}
+        return request
+
+    def make_router(self):
+        with override_settings(DATABASE_POOL=self.pool):
+            return DBRouter()
+
+    def test_parse_lsn(self):
+        self.assertEqual(0x16B374D848, parse_lsn('16/B374D848'))
+        self.assertIsNone(parse_lsn('nonsense'))
+        self.assertIsNone(parse_lsn(None))
+
+    @patch('opendebates.router.current_lsn', return_value='0/3000060')
+    def test_write_sets_cookie(self, current_lsn):
+        request = self.make_request('POST')
+        self.middleware.process_request(request)
+        set_db_written_flag()
+        response = Mock()
+        self.middleware.process_response(request, response)
+        response.set_cookie.assert_called_with(PINNING_KEY, '0/3000060', max_age=60,
+                                               httponly=True)
+        # No session write
+        self.assertNotIn(PINNING_KEY, request.session)
+
+    @patch('opendebates.router.current_lsn', side_effect=Exception)
+    def test_write_falls_back_to_time(self, current_lsn):
+        request = self.make_request('POST')
+        self.middleware.process_request(request)
+        set_db_written_flag()
+        response = Mock()
+        self.middleware.process_response(request, response)
+        self.assertFalse(response.set_cookie.called)
+        self.assertTrue(request.session[PINNING_KEY] > datetime.now())
+
+    def test_read_from_caught_up_replica(self):
+        router = self.make_router()
+        self.middleware.process_request(self.make_request('GET', '0/3000060'))
+        self.assertFalse(is_thread_readwrite())
+        lsns = {'replica0': parse_lsn('0/3000000'), 'replica1': parse_lsn('0/3000060')}
+        with patch('opendebates.router.replay_lsn', side_effect=lsns.get) as replay_lsn:
+            self.assertEqual('replica1', router.db_for_read(Submission))
+            calls = replay_lsn.call_count
+            # The choice is kept for the rest of the request
+            self.assertEqual('replica1', router.db_for_read(Submission))
+            self.assertEqual(calls, replay_lsn.call_count)
+
+    def test_read_from_master_if_no_replica_caught_up(self):
+        router = self.make_router()
+        self.middleware.process_request(self.make_request('GET', '0/3000060'))
+        with patch('opendebates.router.replay_lsn', return_value=parse_lsn('0/3000000')):
+            self.assertEqual('master', router.db_for_read(Submission))
+
+    def test_read_without_cookie(self):
+        router = self.make_router()
+        self.middleware.process_request(self.make_request('GET'))
+        with patch('opendebates.router.replay_lsn') as replay_lsn:
+            self.assertIn(router.db_for_read(Submission), self.pool)
+        self.assertFalse(replay_lsn.called)
+
+
 class ContextManagerTest(TestCase):
     def test_with_readwrite_db_when_readonly(self):
         set_thread_readonly_db()
@@ -194,3 +366,54 @@ class ContextManagerTest(TestCase):
                 assert is_thread_readwrite()
             assert not is_thread_readwrite()
         assert is_thread_readwrite()
+
+    def test_readwrite_db_restores_after_exception(self):
+        set_thread_readonly_db()
+        with self.assertRaises(ValueError):
+            with readwrite_db():
+                raise ValueError
+        assert not is_thread_readwrite()
+
+    def test_readonly_db_restores_after_exception(self):
+        set_thread_readwrite_db()
+        with self.assertRaises(ValueError):
+            with readonly_db():
+                raise ValueError
+        assert is_thread_readwrite()
+
+
+class RoutingStateTest(TestCase):
+    def test_defaults(self):
+        state = RoutingState()
+        self.assertTrue(state.is_readwrite())
+        self.assertFalse(state.was_written())
+        self.assertIsNone(state.get_read_db())
+
+    def test_state_is_not_shared_between_threads(self):
+        state = RoutingState()
+        state.set_readonly()
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(state.is_readwrite()))
+        thread.start()
+        thread.join()
+        self.assertEqual([True], seen)
+        self.assertFalse(state.is_readwrite())
+
+    def test_round_robin_from_many_threads(self):
+        pool = dict(('replica%d' % n, 1) for n in range(3))
+        with override_settings(DATABASE_POOL=pool, MASTER_DATABASE='master'):
+            router = DBRouter()
+        chosen = []
+
+        def read():
+            for i in range(300):
+                chosen.append(router.roundrobin_readonly_db())
+
+        threads = [threading.Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Every replica got exactly its share
+        for db in pool:
+            self.assertEqual(400, chosen.count(db))
@@ -0,0 +1,184 @@
+import datetime
+
+from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.utils import timezone
+from mock import patch
+
+from opendebates import scoring, scoring_strategies
+from opendebates.models import Submission
+from .factories import CategoryFactory, SubmissionFactory, VoteFactory, SiteFactory, DebateFactory
+
+
+class TrendingScoresTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        category = CategoryFactory(debate=self.debate)
+        long_ago = timezone.now() - datetime.timedelta(days=2)
+        self.recent = SubmissionFactory(category=category, created_at=long_ago)
+        self.old = SubmissionFactory(category=category, created_at=long_ago)
+        for i in range(15):
+            VoteFactory(submission=self.recent, created_at=timezone.now())
+            VoteFactory(submission=self.old, created_at=long_ago)
+
+        patcher = patch('opendebates.scoring.cache', new=LocMemCache('scoring-test', {}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def score(self, submission):
+        return Submission.objects.get(pk=submission.pk).score
+
+    def test_first_run_is_full(self):
+        self.assertEqual(2, scoring.update_trending_scores(self.debate))
+        self.assertGreater(self.score(self.recent), 0)
+        self.assertGreater(self.score(self.old), 0)
+        # Recent votes weigh more
+        self.assertGreater(self.score(self.recent), self.score(self.old))
+
+    def test_incremental_run_only_updates_changed(self):
+        scoring.update_trending_scores(self.debate)
+        Submission.objects.update(score=0)
+        self.assertEqual(1, scoring.update_trending_scores(self.debate))
+        self.assertGreater(self.score(self.recent), 0)
+        self.assertEqual(0, self.score(self.old))
+
+    def test_forced_full_run(self):
+        scoring.update_trending_scores(self.debate)
+        Submission.objects.update(score=0)
+        self.assertEqual(2, scoring.update_trending_scores(self.debate, full=True))
+        self.assertGreater(self.score(self.old), 0)
+
+    def test_merge_marks_changed(self):
+        since = timezone.now()
+        self.assertEqual({self.recent.id}, scoring.changed_submission_ids(self.debate, since))
+        SubmissionFactory(category=self.old.category, duplicate_of=self.old,
+                          moderated_at=timezone.now())
+        self.assertEqual({self.recent.id, self.old.id},
+                         scoring.changed_submission_ids(self.debate, since))
+
+    def test_other_debates_untouched(self):
+        other = SubmissionFactory(category=CategoryFactory(debate=DebateFactory(site=self.site)))
+        for i in range(15):
+            VoteFactory(submission=other)
+        scoring.update_trending_scores(self.debate)
+        self.assertEqual(0, self.score(other))
+
+
+@patch('opendebates.scoring.SCORE_BACKEND', new='numpy')
+class NumpyTrendingScoresTest(TrendingScoresTest):
+    """
+    The same tests, with the numpy backend.
+    """
+
+    def test_formula(self):
+        now = timezone.now()
+        with patch.object(scoring.numpy.random, 'random_sample', new=scoring.numpy.zeros):
+            ids, scores = scoring.compute_scores(
+                scoring.DEBATE_WHERE, [self.debate.id], now, 'default')
+        scores = dict(zip(ids.tolist(), scores.tolist()))
+        age = (now - self.recent.created_at).total_seconds()
+        self.assertAlmostEqual(1, scores[self.recent.id] / ((15 + 15 * 200 + 15 * 100) / age ** 1.5))
+        self.assertAlmostEqual(1, scores[self.old.id] / (15 / age ** 1.5))
+
+    def test_age_at(self):
+        now = timezone.now()
+        age_at = now - datetime.timedelta(days=1)
+        with patch.object(scoring.numpy.random, 'random_sample', new=scoring.numpy.zeros):
+            ids, scores = scoring.compute_scores(
+                scoring.DEBATE_WHERE, [self.debate.id], now, 'default', age_at)
+        scores = dict(zip(ids.tolist(), scores.tolist()))
+        age = (age_at - self.old.created_at).total_seconds()
+        self.assertAlmostEqual(1, scores[self.old.id] / (15 / age ** 1.5))
+
+    @patch('opendebates.scoring.numpy', new=None)
+    def test_numpy_missing(self):
+        with self.assertRaises(ImproperlyConfigured):
+            scoring.update_trending_scores(self.debate, full=True)
+
+    def test_votes_of_missing_submission(self):
+        # A submission created between the two queries has votes but isn't
+        # in the submissions; it must not be counted on another one.
+        for missing, other in ((self.old, self.recent), (self.recent, self.old)):
+            submissions_sql = scoring.SUBMISSIONS_SQL.replace(
+                'ORDER BY', 'AND s."id" <> {}\nORDER BY'.format(missing.id))
+            with patch.object(scoring, 'SUBMISSIONS_SQL', new=submissions_sql):
+                with patch.object(scoring.numpy.random, 'random_sample', new=scoring.numpy.zeros):
+                    ids, scores = scoring.compute_scores(
+                        scoring.DEBATE_WHERE, [self.debate.id], timezone.now(), 'default')
+            self.assertEqual([other.id], ids.tolist())
+            age = (timezone.now() - other.created_at).total_seconds()
+            votes = 15 + 15 * 200 + 15 * 100 if other == self.recent else 15
+            self.assertAlmostEqual(1, scores[0] / (votes / age ** 1.5), places=3)
+
+
+class ScoringStrategiesTest(TrendingScoresTest):
+    """
+    The same tests, with a debate using another scoring strategy.
+    """
+
+    def setUp(self):
+        super(ScoringStrategiesTest, self).setUp()
+        self.debate.scoring_strategy = 'decay'
+        self.debate.save()
+
+    def test_vote_buckets(self):
+        now = timezone.now()
+        aggregates = scoring.vote_buckets(scoring.DEBATE_WHERE, [self.debate.id], now, 'default')
+        self.assertEqual([self.recent.id, self.old.id], [a.id for a in aggregates])
+        recent, old = aggregates
+        self.assertEqual(15, recent.buckets[0])
+        self.assertEqual(15, recent.recent(2 * 3600))
+        # Votes older than the buckets all go in the last one
+        self.assertEqual(15, old.buckets[scoring_strategies.NUM_BUCKETS])
+        self.assertEqual(0, old.recent(4 * 3600))
+        self.assertEqual(15, old.votes)
+        self.assertAlmostEqual(2 * 24 * 3600, recent.age, delta=60)
+
+    def test_vote_buckets_age_at(self):
+        now = timezone.now()
+        aggregates = scoring.vote_buckets(scoring.DEBATE_WHERE, [self.debate.id], now, 'default',
+                                          now - datetime.timedelta(days=1))
+        self.assertAlmostEqual(24 * 3600, aggregates[0].age, delta=60)
+        # The buckets are still relative to now
+        self.assertEqual(15, aggregates[0].buckets[0])
+
+    def test_every_strategy(self):
+        for name in scoring_strategies.STRATEGIES:
+            self.debate.scoring_strategy = name
+            self.debate.save()
+            Submission.objects.update(score=0)
+            self.assertEqual(2, scoring.update_trending_scores(self.debate, full=True))
+            self.assertGreater(self.score(self.recent), 0, name)
+            self.assertGreaterEqual(self.score(self.recent), self.score(self.old), name)
+
+    def aggregate(self, id, age_hours, buckets, local_votes=0):
+        submission = scoring_strategies.SubmissionVotes(id, age_hours * 3600, local_votes)
+        for bucket, count in buckets.items():
+            submission.buckets[bucket] = count
+        return submission
+
+    def test_local(self):
+        aggregates = [self.aggregate(1, 12, {10: 15}, local_votes=15)]
+        hot = scoring_strategies.compute_scores('hot', self.debate, aggregates)[1][0]
+        local = scoring_strategies.compute_scores('local', self.debate, aggregates)[1][0]
+        self.assertGreater(local, hot)
+
+    def test_bayesian(self):
+        established = self.aggregate(1, 48, {5: 100, 30: 100})
+        new = self.aggregate(2, 1, {0: 10})
+        with patch('opendebates.scoring_strategies.average_vote_rate', return_value=2.0):
+            ids, scores = scoring_strategies.compute_scores(
+                'bayesian', self.debate, [established, new])
+        # 10 votes in an hour don't outweigh 200 votes over two days yet
+        self.assertGreater(scores[0], scores[1])
+
+    def test_decay(self):
+        ids, scores = scoring_strategies.compute_scores(
+            'decay', self.debate, [self.aggregate(1, 24, {0: 10}), self.aggregate(2, 24, {12: 10})])
+        self.assertAlmostEqual(0.5, scores[1] / scores[0])
@@ -0,0 +1,85 @@
+from functools import partial
+
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from mock import patch
+
+from opendebates.models import Submission
+from .factories import SubmissionFactory, SiteFactory, DebateFactory, CategoryFactory
+from .utilities import patch_cache_templatetag
+
+
+# Force the reverse() used here in the tests to always use the full
+# urlconf, despite whatever machinations have taken place due to the
+# DebateMiddleware.
+old_reverse = reverse
+reverse = partial(old_reverse, urlconf='opendebates.urls')
+
+
+class RankedSearchTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.category = CategoryFactory(debate=self.debate)
+        self.close = SubmissionFactory(
+            category=self.category, idea='What will you do about immigration reform?', votes=0)
+        self.far = SubmissionFactory(
+            category=self.category,
+            idea='Reform of the tax code, and what about the border and immigration?', votes=10000)
+        self.other = SubmissionFactory(
+            category=self.category, idea='How will you fund the schools?', votes=100)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def ids(self, ideas):
+        return [idea.id for idea in ideas]
+
+    def test_ranked_by_relevance(self):
+        ideas = Submission.objects.ranked_search('immigration reform', votes_weight=0)
+        self.assertEqual([self.close.id, self.far.id], self.ids(ideas))
+
+    def test_votes_weight(self):
+        ideas = Submission.objects.ranked_search('immigration reform', votes_weight=10)
+        self.assertEqual([self.far.id, self.close.id], self.ids(ideas))
+
+    def test_prefix(self):
+        self.assertEqual([], self.ids(Submission.objects.ranked_search('immig')))
+        ideas = Submission.objects.ranked_search('immig ref', prefix=True, votes_weight=0)
+        self.assertEqual([self.close.id, self.far.id], self.ids(ideas))
+        self.assertEqual([self.other.id],
+                         self.ids(Submission.objects.search('sch', prefix=True)))
+
+    def test_prefix_ignores_tsquery_syntax(self):
+        ideas = Submission.objects.ranked_search("immig:* | ' (!fund", prefix=True)
+        self.assertEqual([], self.ids(ideas))
+
+    def test_search_view(self):
+        url = reverse('search_ideas', kwargs={'prefix': self.debate.prefix})
+        rsp = self.client.get(url + '?q=immig+ref&prefix=1')
+        self.assertEqual('relevance', rsp.context['sort'])
+        self.assertEqual([self.close.id, self.far.id], self.ids(rsp.context['ideas']))
+        self.assertContains(rsp, '<option value="relevance" selected>')
+        self.assertContains(rsp, '<input type="hidden" name="prefix" value="1">')
+
+    @patch('opendebates.models.SEARCH_VOTES_WEIGHT', 10)
+    def test_search_view_blends_votes(self):
+        url = reverse('search_ideas', kwargs={'prefix': self.debate.prefix})
+        rsp = self.client.get(url + '?q=immigration+reform')
+        self.assertEqual([self.far.id, self.close.id], self.ids(rsp.context['ideas']))
+
+    @patch_cache_templatetag()
+    def test_prefix_search_cache(self):
+        url = reverse('search_ideas', kwargs={'prefix': self.debate.prefix})
+        rsp = self.client.get(url + '?q=immig')
+        self.assertNotContains(rsp, 'id="i{}"'.format(self.close.id))
+        # The same term as a prefix doesn't get the cached list
+        rsp = self.client.get(url + '?q=immig&prefix=1')
+        self.assertContains(rsp, 'id="i{}"'.format(self.close.id))
+
+    def test_relevance_only_for_search(self):
+        url = reverse('list_ideas', kwargs={'prefix': self.debate.prefix})
+        rsp = self.client.get(url + '?sort=relevance')
+        self.assertIn(rsp.context['sort'], ['trending', 'random'])
+        self.assertNotContains(rsp, '<option value="relevance"')
@@ -0,0 +1,67 @@
+from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from opendebates.models import Submission
+from opendebates.search_cache import cached_search, normalize_search_term, search_key
+from .factories import SubmissionFactory, SiteFactory, DebateFactory, CategoryFactory
+
+
+@override_settings(SEARCH_CACHE=True)
+class SearchCacheTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.category = CategoryFactory(debate=self.debate)
+        self.first = SubmissionFactory(category=self.category, idea='Tax policy for farmers',
+                                       votes=5)
+        self.second = SubmissionFactory(category=self.category, idea='Farmers and water',
+                                        votes=10)
+        SubmissionFactory(category=self.category, idea='Something else')
+
+        self.cache = LocMemCache('search-cache-test', {})
+        patcher = patch('opendebates.search_cache.cache', new=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def search(self, term):
+        ideas = Submission.objects.filter(
+            category__debate=self.debate).order_by('-votes', '-id').search(term)
+        return cached_search(self.debate, term, 'votes', False, ideas)
+
+    def test_normalize(self):
+        self.assertEqual(u'farmers tax', normalize_search_term(u'  Tax, FARMERS tax! '))
+        self.assertEqual(search_key(1, u'tax farmers', 'votes', False),
+                         search_key(1, u'Farmers  TAX', 'votes', False))
+        self.assertNotEqual(search_key(1, u'tax', 'votes', False),
+                            search_key(2, u'tax', 'votes', False))
+
+    def test_repeated_search_uses_cache(self):
+        results = self.search('farmers')
+        self.assertEqual([self.second, self.first], list(results))
+        self.assertEqual(2, results.count())
+        with self.assertNumQueries(0):
+            results = self.search('FARMERS')
+            self.assertEqual(2, results.count())
+
+    def test_new_submission_invalidates(self):
+        self.assertEqual(2, self.search('farmers').count())
+        SubmissionFactory(category=self.category, idea='More farmers', votes=1)
+        self.assertEqual(3, self.search('farmers').count())
+
+    def test_removed_submission_invalidates(self):
+        self.assertEqual(2, self.search('farmers').count())
+        self.first.approved = False
+        self.first.save()
+        results = self.search('farmers')
+        self.assertEqual([self.second], list(results))
+
+    @override_settings(SEARCH_CACHE=False)
+    def test_disabled(self):
+        ideas = Submission.objects.all().search('farmers')
+        self.assertIs(ideas, cached_search(self.debate, 'farmers', 'votes', False, ideas))
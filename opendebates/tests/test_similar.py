@@ -0,0 +1,90 @@
+from functools import partial
+import json
+
+from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from mock import patch
+
+from opendebates.similar import similar_questions, similar_words
+from .factories import SubmissionFactory, SiteFactory, DebateFactory, CategoryFactory
+
+
+# Force the reverse() used here in the tests to always use the full
+# urlconf, despite whatever machinations have taken place due to the
+# DebateMiddleware.
+old_reverse = reverse
+reverse = partial(old_reverse, urlconf='opendebates.urls')
+
+
+class SimilarQuestionsTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.category = CategoryFactory(debate=self.debate)
+        self.first = SubmissionFactory(
+            category=self.category, headline='Immigration reform',
+            idea='What will you do about immigration reform?', votes=3)
+        self.second = SubmissionFactory(
+            category=self.category, headline='Border security',
+            idea='How will you pay for border security and immigration?', votes=7)
+        SubmissionFactory(category=self.category, idea='How will you fund the schools?')
+        SubmissionFactory(category=self.category, idea='Immigration reform now',
+                          approved=False)
+        other_debate = DebateFactory(site=self.site)
+        SubmissionFactory(category=CategoryFactory(debate=other_debate),
+                          idea='Immigration reform elsewhere')
+
+        self.url = reverse('similar_questions', kwargs={'prefix': self.debate.prefix})
+
+        self.cache = LocMemCache('similar-questions-test', {})
+        for module in ['opendebates.similar', 'opendebates.search_cache']:
+            patcher = patch(module + '.cache', new=self.cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def test_words(self):
+        self.assertEqual([u'immigr', u'what'], similar_words(u'What do we do on IMMIGR'))
+
+    def test_similar(self):
+        questions = similar_questions(self.debate, u'What about immigr')
+        self.assertEqual([self.first.id, self.second.id], [q['id'] for q in questions])
+        self.assertEqual(u'Immigration reform', questions[0]['headline'])
+        self.assertEqual(self.first.get_absolute_url(), questions[0]['url'])
+
+    def test_limit(self):
+        questions = similar_questions(self.debate, u'immigration', limit=1)
+        self.assertEqual([self.first.id], [q['id'] for q in questions])
+
+    def test_no_words(self):
+        with self.assertNumQueries(0):
+            self.assertEqual([], similar_questions(self.debate, u'a to be'))
+
+    def test_cached(self):
+        similar_questions(self.debate, u'immigration reform')
+        with self.assertNumQueries(0):
+            questions = similar_questions(self.debate, u'Reform, immigration')
+        self.assertEqual(self.first.id, questions[0]['id'])
+
+    def test_new_submission_invalidates(self):
+        self.assertEqual(2, len(similar_questions(self.debate, u'immigration')))
+        SubmissionFactory(category=self.category, idea='More immigration')
+        self.assertEqual(3, len(similar_questions(self.debate, u'immigration')))
+
+    def test_view(self):
+        rsp = self.client.get(self.url, {'q': 'immigration ref'})
+        self.assertEqual(200, rsp.status_code)
+        questions = json.loads(rsp.content)['questions']
+        self.assertEqual([self.first.id, self.second.id], [q['id'] for q in questions])
+        self.assertEqual(3, questions[0]['votes'])
+
+    def test_view_hides_votes(self):
+        self.debate.show_question_votes = False
+        self.debate.save()
+        rsp = self.client.get(self.url, {'q': 'immigration'})
+        questions = json.loads(rsp.content)['questions']
+        self.assertEqual([None, None], [q['votes'] for q in questions])
@@ -17,9 +17,7 @@ class TestScores(TestCase):
         sub1 = SubmissionFactory()
         for i in range(30):
             VoteFactory(submission=sub1)
-        self.assertEqual(0, sub1.random_id)
         self.assertEqual(0.0, sub1.score)
         update_trending_scores()
         sub1 = Submission.objects.get(pk=sub1.pk)
-        self.assertNotEqual(0, sub1.random_id)
         self.assertGreater(sub1.score, 0.0)
@@ -2,8 +2,12 @@ from django.contrib.sites.models import Site
 from django.test import TestCase, override_settings
 from mock import Mock, patch
 
-from opendebates.tests.factories import VoteFactory, DebateFactory, SiteFactory
-from opendebates.utils import registration_needs_captcha, vote_needs_captcha
+from opendebates.models import Submission
+from opendebates.tests.factories import (VoteFactory, DebateFactory, SiteFactory,
+                                         SubmissionFactory)
+from opendebates.utils import (DebateLookup, RANDOM_SORT_SECONDS, get_debate, random_key,
+                               random_seed, registration_needs_captcha, sort_list,
+                               vote_needs_captcha)
 
 
 @override_settings(USE_CAPTCHA=True)
@@ -57,3 +61,72 @@ class TestCaptchaUtils(TestCase):
         with patch('opendebates.utils.get_voter') as mock_get_voter:
             mock_get_voter.return_value = {'email': email}
             self.assertFalse(vote_needs_captcha(self.mock_request))
+
+
+class DebateLookupTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.request = Mock(path='/%s/questions/' % self.debate.prefix)
+        self.request.get_host.return_value = self.site.domain
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def test_lookup_is_cached(self):
+        self.assertEqual(self.debate, get_debate(self.request))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.debate, get_debate(self.request))
+
+    def test_unknown_prefix(self):
+        self.request.path = '/no-such-debate/'
+        self.assertIsNone(get_debate(self.request))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_debate(self.request))
+
+    def test_saving_debate_invalidates(self):
+        get_debate(self.request)
+        self.debate.hashtag = 'changed'
+        self.debate.save()
+        self.assertEqual('changed', get_debate(self.request).hashtag)
+
+    def test_version_change_invalidates(self):
+        lookup = DebateLookup(ttl=0)
+        with patch('opendebates.utils.cache') as mock_cache:
+            mock_cache.get.return_value = 1
+            lookup.get(self.site.domain, self.debate.prefix)
+            with self.assertNumQueries(0):
+                lookup.get(self.site.domain, self.debate.prefix)
+            mock_cache.get.return_value = 2
+            with self.assertNumQueries(1):
+                lookup.get(self.site.domain, self.debate.prefix)
+
+
+class RandomSortTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def test_window(self):
+        self.assertEqual(random_seed(0), random_seed(RANDOM_SORT_SECONDS - 1))
+        self.assertNotEqual(random_seed(0), random_seed(RANDOM_SORT_SECONDS))
+        self.assertNotEqual([random_key(id, 1) for id in range(1, 11)],
+                            [random_key(id, 2) for id in range(1, 11)])
+
+    def test_permutation(self):
+        # Consecutive ids are spread over the whole range, not in a few
+        # evenly spaced runs
+        keys = [random_key(id, random_seed()) for id in range(1, 1001)]
+        self.assertEqual(1000, len(set(keys)))
+        self.assertTrue(all(-2 ** 31 <= key < 2 ** 31 for key in keys))
+        ascending = sum(1 for a, b in zip(keys, keys[1:]) if a < b)
+        self.assertTrue(400 < ascending < 600, ascending)
+
+    @patch('opendebates.utils.random_seed', return_value=42)
+    def test_sort_list(self, seed):
+        ids = [SubmissionFactory().id for i in range(5)]
+        expected = sorted(ids, key=lambda id: (random_key(id, 42), id), reverse=True)
+        ideas = sort_list(False, 'random', Submission.objects.all())
+        self.assertEqual(expected, [idea.id for idea in ideas])
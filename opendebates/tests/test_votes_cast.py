@@ -0,0 +1,71 @@
+from django.contrib.sites.models import Site
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from mock import patch
+
+from opendebates.models import Vote
+
+from opendebates.votes_cast import add_vote_cast, get_votes_cast, invalidate_merged_votes_cast
+from .factories import SubmissionFactory, VoterFactory, VoteFactory, SiteFactory, DebateFactory
+
+
+class VotesCastTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site)
+        self.voter = VoterFactory()
+        self.submissions = [SubmissionFactory() for i in range(3)]
+        VoteFactory(voter=self.voter, submission=self.submissions[2])
+        VoteFactory(voter=self.voter, submission=self.submissions[0])
+        VoteFactory(submission=self.submissions[1])
+
+        patcher = patch('opendebates.votes_cast.cache', new=LocMemCache('votes-cast-test', {}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def test_miss_queries_once(self):
+        expected = [self.submissions[0].id, self.submissions[2].id]
+        with self.assertNumQueries(1):
+            self.assertEqual(expected, get_votes_cast(self.voter.email))
+        with self.assertNumQueries(0):
+            self.assertEqual(expected, get_votes_cast(self.voter.email))
+
+    def test_add_vote(self):
+        get_votes_cast(self.voter.email)
+        VoteFactory(voter=self.voter, submission=self.submissions[1])
+        add_vote_cast(self.voter.email, self.submissions[1].id)
+        with self.assertNumQueries(1):
+            self.assertEqual([s.id for s in self.submissions], get_votes_cast(self.voter.email))
+
+    def test_concurrent_votes(self):
+        # Two requests by the voter have read the same cached list, then
+        # both vote
+        get_votes_cast(self.voter.email)
+        VoteFactory(voter=self.voter, submission=self.submissions[1])
+        add_vote_cast(self.voter.email, self.submissions[1].id)
+        other = SubmissionFactory()
+        VoteFactory(voter=self.voter, submission=other)
+        add_vote_cast(self.voter.email, other.id)
+        self.assertEqual([s.id for s in self.submissions] + [other.id],
+                         get_votes_cast(self.voter.email))
+
+    def test_invalidate_merged(self):
+        other_voter = VoterFactory()
+        get_votes_cast(self.voter.email)
+        get_votes_cast(other_voter.email)
+        # As if self.submissions[2] had been merged into self.submissions[1]
+        Vote.objects.filter(submission=self.submissions[2]).update(
+            submission=self.submissions[1], original_merged_submission=self.submissions[2])
+        invalidate_merged_votes_cast(self.submissions[2], self.submissions[1])
+        with self.assertNumQueries(1):
+            self.assertEqual([self.submissions[0].id, self.submissions[1].id],
+                             get_votes_cast(self.voter.email))
+        # Voters whose votes didn't move keep their entry
+        with self.assertNumQueries(0):
+            get_votes_cast(other_voter.email)
+
+    def test_no_votes(self):
+        self.assertEqual([], get_votes_cast('nobody@example.com'))
@@ -0,0 +1,84 @@
+from django.contrib.sites.models import Site
+from django.test import TestCase
+
+from opendebates.models import Submission, Vote, Voter, ZipCode
+from opendebates.voting import record_vote
+from .factories import SubmissionFactory, SiteFactory, DebateFactory, VoterFactory
+
+
+class RecordVoteTest(TestCase):
+    def setUp(self):
+        self.site = SiteFactory()
+        self.debate = DebateFactory(site=self.site, debate_state='NY')
+        self.submission = SubmissionFactory()
+        ZipCode.objects.create(zip='11111', city="Examplepolis", state="NY")
+        ZipCode.objects.create(zip='22222', city="Examplepolis", state="FL")
+
+    def tearDown(self):
+        Site.objects.clear_cache()
+
+    def refetch(self):
+        return Submission.objects.get(pk=self.submission.pk)
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            record_vote(self.submission, self.debate, 'new@example.com', '11111',
+                        sessionid='abc')
+
+    def test_new_voter(self):
+        result = record_vote(self.submission, self.debate, 'new@example.com', '11111',
+                             sessionid='abc')
+        self.assertFalse(result.duplicate_session)
+        self.assertTrue(result.is_local)
+        voter = Voter.objects.get(email='new@example.com')
+        self.assertEqual(voter.pk, result.voter.pk)
+        self.assertEqual('NY', voter.state)
+        vote = Vote.objects.get(pk=result.vote.pk)
+        self.assertEqual(voter, vote.voter)
+        self.assertEqual('abc', vote.sessionid)
+        refetched = self.refetch()
+        self.assertEqual(self.submission.votes + 1, refetched.votes)
+        self.assertEqual(refetched.votes, result.votes)
+        self.assertEqual(self.submission.current_votes + 1, refetched.current_votes)
+        self.assertEqual(self.submission.local_votes + 1, refetched.local_votes)
+
+    def test_existing_voter_changes_zip(self):
+        voter = VoterFactory(email='old@example.com', zip='11111', state='NY')
+        result = record_vote(self.submission, self.debate, voter.email, '22222')
+        self.assertEqual(voter.pk, result.voter.pk)
+        self.assertFalse(result.is_local)
+        voter = Voter.objects.get(pk=voter.pk)
+        self.assertEqual('22222', voter.zip)
+        self.assertEqual('FL', voter.state)
+        self.assertEqual(self.submission.local_votes, self.refetch().local_votes)
+
+    def test_existing_voter_same_zip(self):
+        voter = VoterFactory(email='old@example.com', zip='11111', state='NY')
+        result = record_vote(self.submission, self.debate, voter.email, '11111')
+        self.assertEqual(voter.pk, result.voter.pk)
+        self.assertIsNotNone(result.vote)
+
+    def test_voter_already_voted(self):
+        record_vote(self.submission, self.debate, 'new@example.com', '11111', sessionid='abc')
+        result = record_vote(self.submission, self.debate, 'new@example.com', '11111',
+                             sessionid='def')
+        self.assertFalse(result.duplicate_session)
+        self.assertIsNone(result.vote)
+        self.assertIsNone(result.votes)
+        self.assertEqual(self.submission.votes + 1, self.refetch().votes)
+
+    def test_duplicate_session(self):
+        record_vote(self.submission, self.debate, 'new@example.com', '11111', sessionid='abc')
+        result = record_vote(self.submission, self.debate, 'other@example.com', '11111',
+                             sessionid='abc')
+        self.assertTrue(result.duplicate_session)
+        self.assertIsNone(result.voter)
+        self.assertFalse(Voter.objects.filter(email='other@example.com').exists())
+        self.assertEqual(self.submission.votes + 1, self.refetch().votes)
+
+    def test_without_tallies(self):
+        result = record_vote(self.submission, self.debate, 'new@example.com', '11111',
+                             update_tallies=False)
+        self.assertIsNotNone(result.vote)
+        self.assertIsNone(result.votes)
+        self.assertEqual(self.submission.votes, self.refetch().votes)
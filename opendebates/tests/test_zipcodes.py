@@ -0,0 +1,86 @@
+import os
+import tempfile
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from mock import patch
+
+from opendebates.models import ZipCode
+from opendebates.zipcodes import (ZipCodeLookup, ZipCodeTable, ZIPCODE_VERSION_CACHE_ENTRY,
+                                  state_from_zip)
+
+
+class ZipCodeTableTest(TestCase):
+    def test_get(self):
+        table = ZipCodeTable([('22222', 'FL'), ('00210', 'NH'), ('11111', 'NY'), ('A1B', 'XX')])
+        self.assertEqual(4, len(table))
+        self.assertEqual('NH', table.get('00210'))
+        self.assertEqual('NY', table.get('11111'))
+        self.assertEqual('FL', table.get('22222'))
+        self.assertEqual('XX', table.get('A1B'))
+        self.assertIsNone(table.get('33333'))
+        self.assertEqual('', table.get('11111-1234', ''))
+
+    def test_empty(self):
+        self.assertIsNone(ZipCodeTable([]).get('11111'))
+
+
+class ZipCodeLookupTest(TestCase):
+    def setUp(self):
+        ZipCode.objects.create(zip='11111', city="Examplepolis", state="NY")
+        self.cache = LocMemCache('zipcode-test', {})
+        patcher = patch('opendebates.zipcodes.cache', new=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_table_is_built_once(self):
+        lookup = ZipCodeLookup(ttl=60)
+        self.assertEqual('NY', lookup.get_table().get('11111'))
+        with self.assertNumQueries(0):
+            self.assertEqual('NY', lookup.get_table().get('11111'))
+
+    def test_version_change_rebuilds(self):
+        lookup = ZipCodeLookup(ttl=0)
+        table = lookup.get_table()
+        self.assertIs(table, lookup.get_table())
+        self.cache.set(ZIPCODE_VERSION_CACHE_ENTRY, 'changed')
+        self.assertIsNot(table, lookup.get_table())
+
+    def test_saving_a_zipcode_invalidates(self):
+        self.assertEqual('', state_from_zip('22222'))
+        ZipCode.objects.create(zip='22222', city="Examplepolis", state="FL")
+        self.assertEqual('FL', state_from_zip('22222'))
+
+
+class LoadZipcodeDatabaseTest(TestCase):
+    def setUp(self):
+        ZipCode.objects.create(zip='11111', city="Examplepolis", state="NY")
+        ZipCode.objects.create(zip='33333', city="Oldtown", state="GA")
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as fp:
+            fp.write('11111,Examplepolis,NY\n22222,Examplepolis,FL\n33333,Newtown,GA\n')
+        self.addCleanup(os.remove, self.path)
+
+    def load(self, *args):
+        out = StringIO()
+        call_command('load_zipcode_database', self.path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_merge(self):
+        output = self.load()
+        self.assertIn('1 inserted, 1 updated, 0 deleted', output)
+        self.assertEqual('FL', ZipCode.objects.get(zip='22222').state)
+        self.assertEqual('Newtown', ZipCode.objects.get(zip='33333').city)
+        self.assertEqual('FL', state_from_zip('22222'))
+
+    def test_replace(self):
+        ZipCode.objects.create(zip='44444', city="Gone", state="TX")
+        output = self.load('--mode', 'replace')
+        self.assertIn('1 inserted, 1 updated, 1 deleted', output)
+        self.assertFalse(ZipCode.objects.filter(zip='44444').exists())
+
+    def test_reload_changes_nothing(self):
+        self.load()
+        self.assertIn('0 inserted, 0 updated, 0 deleted', self.load())
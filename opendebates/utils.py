@@ -1,7 +1,19 @@
+import array
+import datetime
+import hashlib
 import json
 import random
+import threading
+import time
 
 from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes
+from django.utils.functional import cached_property
 
 from .models import Vote, Voter, Debate
 
@@ -95,13 +107,78 @@ def get_ip_address_from_request(request):
     return ip_address
 
 
-def choose_sort(request, sort):
+def choose_sort(request, sort, search=False):
+    # Search results are ordered by relevance unless asked otherwise; the
+    # other lists can't be.
+    if search and not sort:
+        return "relevance"
+    if sort == "relevance" and not search:
+        sort = None
     sort = sort or random.choice(["trending", "trending", "random"])
     if sort.endswith('votes') and not request.debate.allow_sorting_by_votes:
         sort = 'trending'
     return sort
 
 
+# The ordering for each sort option. Every ordering ends with "id" in the
+# same direction as the sort column, so that it's a total order that can be
+# used for keyset pagination.
+SORT_ORDERINGS = {
+    "editors": ("-editors_pick", "-id"),
+    "trending": ("-score", "-id"),
+    "random": ("-random_order", "-id"),
+    "-date": ("-created_at", "-id"),
+    "+date": ("created_at", "id"),
+    "-votes": ("-votes", "-id"),
+    "+votes": ("votes", "id"),
+    "-local_votes": ("-local_votes", "-id"),
+    "-current_votes": ("-current_votes", "-id"),
+}
+DEFAULT_ORDERING = ("-id",)
+
+CURSOR_SALT = 'opendebates.cursor'
+
+# Array typecode for packed ids: a 4-byte signed int.
+ID_TYPECODE = 'i'
+
+
+# The random sort orders the submissions by an md5 hash of the id, salted
+# with the number of the current window of RANDOM_SORT_SECONDS, so the order
+# holds still while someone pages through it, and then reshuffles without
+# writing anything to the database. The hash is truncated to a signed 4-byte
+# int the same way in Python and in SQL.
+RANDOM_SORT_SECONDS = int(getattr(settings, 'RANDOM_SORT_SECONDS', 600))
+
+
+def random_seed(now=None):
+    """
+    Return the number of the random sort window at ``now`` (a timestamp,
+    by default the current time).
+    """
+    if now is None:
+        now = time.time()
+    return int(now // RANDOM_SORT_SECONDS)
+
+
+def random_key(id, seed):
+    """
+    Return the position of ``id`` in the random sort of window ``seed``,
+    in Python.
+    """
+    key = int(hashlib.md5(force_bytes('%d-%d' % (seed, id))).hexdigest()[:8], 16)
+    return key - 2 ** 32 if key >= 2 ** 31 else key
+
+
+def random_order(seed=None):
+    """
+    Return the random sort position of a submission, as an expression.
+    """
+    if seed is None:
+        seed = random_seed()
+    return RawSQL('(\'x\' || SUBSTR(MD5(%s || "opendebates_submission"."id"::text), 1, 8))'
+                  '::bit(32)::int', ('%d-' % seed,))
+
+
 def sort_list(citations_only, sort, ideas):
     ideas = ideas.filter(
         approved=True,
@@ -111,32 +188,258 @@ def sort_list(citations_only, sort, ideas):
     if citations_only:
         ideas = ideas.filter(citation_verified=True)
 
-    if sort == "editors":
-        ideas = ideas.order_by("-editors_pick")
-    elif sort == "trending":
-        ideas = ideas.order_by("-score")
-    elif sort == "random":
-        ideas = ideas.order_by("-random_id")
-    elif sort == "-date":
-        ideas = ideas.order_by("-created_at")
-    elif sort == "+date":
-        ideas = ideas.order_by("created_at")
-    elif sort == "-votes":
-        ideas = ideas.order_by("-votes")
-    elif sort == "+votes":
-        ideas = ideas.order_by("votes")
-    elif sort == "-local_votes":
-        ideas = ideas.order_by("-local_votes")
-    elif sort == "-current_votes":
-        ideas = ideas.order_by("-current_votes")
+    if sort == "random":
+        ideas = ideas.annotate(random_order=random_order())
+
+    if sort in SORT_ORDERINGS:
+        ideas = ideas.order_by(*SORT_ORDERINGS[sort])
 
     return ideas
 
 
+def search_list(term, sort, ideas, prefix=False):
+    """
+    Search a sorted list for ``term``, matching its words as prefixes if
+    ``prefix``. The relevance sort orders the results by rank.
+    """
+    term = term.replace("%", "")
+    if sort == "relevance":
+        return ideas.ranked_search(term, prefix=prefix)
+    return ideas.search(term, prefix=prefix)
+
+
+class KeysetPage(object):
+    """
+    The page of ``ideas`` after the ``cursor`` in the request's query
+    string, with a link to the next page. Nothing is queried until
+    ``object_list`` or ``next_url`` is used, so a page the template serves
+    from its fragment cache costs no query.
+
+    The random sort is paged through ``random_ranking(seed=seed)``, a
+    ranking.RankedSubmissions of the list, if given.
+    """
+
+    def __init__(self, request, ideas, sort, per_page, random_ranking=None):
+        self.request = request
+        self.ideas = ideas
+        self.sort = sort
+        self.per_page = per_page
+        self.random_ranking = random_ranking
+
+    def _ranked_page(self, cursor, seed):
+        ranked = self.random_ranking(seed=seed)
+        start = 0
+        if cursor:
+            try:
+                start = ranked.ids.index(cursor[1]) + 1
+            except ValueError:  # Not in this ranking: seek in the database
+                return None
+        return ranked[start:start + self.per_page + 1]
+
+    @cached_property
+    def _page(self):
+        cursor = load_cursor(self.sort, self.request.GET.get('cursor'))
+        # The random sort pages through the window it started in
+        seed = None
+        if self.sort == 'random':
+            seed = cursor[2] if cursor and cursor[2] is not None else random_seed()
+        ideas = None
+        if self.sort == 'random' and self.random_ranking is not None:
+            ideas = self._ranked_page(cursor, seed)
+        if ideas is None:
+            ideas = list(seek(self.ideas, self.sort, cursor, seed)[:self.per_page + 1])
+        next_url = None
+        if len(ideas) > self.per_page:
+            ideas = ideas[:self.per_page]
+            query = self.request.GET.copy()
+            query.pop('page', None)
+            query['cursor'] = make_cursor(self.sort, ideas[-1], seed)
+            next_url = '?' + query.urlencode()
+        return ideas, next_url
+
+    @property
+    def object_list(self):
+        return self._page[0]
+
+    @property
+    def next_url(self):
+        return self._page[1]
+
+
+def make_cursor(sort, obj, seed=None):
+    """
+    Return an opaque token pointing just after ``obj`` in the ``sort``
+    order, and for the random sort, in its window ``seed``.
+    """
+    column = SORT_ORDERINGS.get(sort, DEFAULT_ORDERING)[0].lstrip('-')
+    if column == 'random_order':
+        # Not annotated on the submissions of a ranking
+        value = random_key(obj.id, seed)
+    else:
+        value = getattr(obj, column)
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return signing.dumps([sort, value, obj.id, seed], salt=CURSOR_SALT)
+
+
+def load_cursor(sort, cursor):
+    """
+    Return the (value, last_id, seed) of a cursor made by ``make_cursor``,
+    or None if it is invalid or was made for a different sort.
+    """
+    if not cursor:
+        return None
+    try:
+        cursor = signing.loads(cursor, salt=CURSOR_SALT)
+        cursor_sort, value, last_id = cursor[:3]
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if cursor_sort != sort:
+        return None
+    # Cursors made before the seed was stored don't have one
+    seed = cursor[3] if len(cursor) > 3 else None
+    return value, last_id, seed
+
+
+def seek(ideas, sort, cursor, seed=None):
+    """
+    Filter ``ideas`` down to the ones after ``cursor`` (as returned by
+    ``load_cursor``) in the ``sort`` order, and apply that order. The
+    random sort is ordered by the window ``seed``. Without a cursor, the
+    list starts at the beginning.
+    """
+    if sort == 'random' and seed is not None:
+        ideas = ideas.annotate(random_order=random_order(seed))
+    ordering = SORT_ORDERINGS.get(sort, DEFAULT_ORDERING)
+    ideas = ideas.order_by(*ordering)
+    if not cursor:
+        return ideas
+    value, last_id, _ = cursor
+
+    column = ordering[0].lstrip('-')
+    op = 'lt' if ordering[0].startswith('-') else 'gt'
+    if column == 'id':
+        return ideas.filter(**{'id__' + op: last_id})
+    if column == 'created_at':
+        value = parse_datetime(value)
+    # "column <= value" (or >=) can use the column's index for an ordered
+    # scan; the ties are then filtered on id.
+    return ideas.filter(
+        Q(**{column + '__' + op + 'e': value}),
+        Q(**{column + '__' + op: value}) | Q(**{'id__' + op: last_id}),
+    )
+
+
+def keyset_page(request, ideas, sort, per_page=None, random_ranking=None):
+    """
+    Return the page of ``ideas`` after the ``cursor`` in the request's
+    query string, as a KeysetPage.
+    """
+    return KeysetPage(request, ideas, sort, per_page or settings.SUBMISSIONS_PER_PAGE,
+                      random_ranking)
+
+
+def use_keyset_pagination(request, sort=None):
+    # Relevance isn't a column that a cursor could seek to.
+    if sort == 'relevance':
+        return False
+    # Old ?page= links keep using offset pagination.
+    if 'cursor' in request.GET:
+        return True
+    return settings.KEYSET_PAGINATION and 'page' not in request.GET
+
+
+def pack_ids(ids):
+    """
+    Pack a list of ids into a compact string for the cache.
+    """
+    packed = array.array(ID_TYPECODE, ids)
+    return packed.tobytes() if hasattr(packed, 'tobytes') else packed.tostring()
+
+
+def unpack_ids(data):
+    ids = array.array(ID_TYPECODE)
+    if hasattr(ids, 'frombytes'):
+        ids.frombytes(data)
+    else:
+        ids.fromstring(data)
+    return ids
+
+
+DEBATE_VERSION_CACHE_ENTRY = 'debate_version'
+
+# How often each process checks the shared version key for changes to
+# Debates or Sites.
+DEBATE_LOOKUP_SECONDS = int(getattr(settings, 'DEBATE_LOOKUP_SECONDS', 30))
+
+# Lookups of unknown prefixes are cached too; don't let them grow forever.
+DEBATE_LOOKUP_MAX_ENTRIES = 1000
+
+
+class DebateLookup(object):
+    """
+    Per-process table of (domain, prefix) -> Debate (or None).
+
+    At most every ``ttl`` seconds, compares the version in the shared
+    cache with the one the table was built with, and starts over if it
+    changed. The version is bumped whenever a Debate or Site is saved
+    (see ``opendebates.signals``).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.debates = {}
+            self.version = None
+            self.checked_at = 0
+
+    def check_version(self):
+        now = time.time()
+        if now - self.checked_at < self.ttl:
+            return
+        version = cache.get(DEBATE_VERSION_CACHE_ENTRY)
+        with self.lock:
+            if version != self.version:
+                self.debates = {}
+                self.version = version
+            self.checked_at = now
+
+    def get(self, domain, prefix):
+        self.check_version()
+        key = (domain, prefix)
+        try:
+            return self.debates[key]
+        except KeyError:
+            pass
+        try:
+            debate = Debate.objects.select_related('site').get(prefix=prefix, site__domain=domain)
+        except Debate.DoesNotExist:
+            debate = None
+        with self.lock:
+            if len(self.debates) >= DEBATE_LOOKUP_MAX_ENTRIES:
+                self.debates = {}
+            self.debates[key] = debate
+        return debate
+
+
+debate_lookup = DebateLookup(DEBATE_LOOKUP_SECONDS)
+
+
+def invalidate_debates():
+    """
+    Make every process drop its cached Debates.
+    """
+    debate_lookup.clear()
+    cache.set(DEBATE_VERSION_CACHE_ENTRY, time.time(), None)
+
+
 def get_debate(request):
     domain = request.get_host().lower().strip('.')
     path = request.path.split('/')[1:]
-    try:
-        return Debate.objects.select_related('site').get(prefix=path[0], site__domain=domain)
-    except (Debate.DoesNotExist, IndexError):
+    if not path:
         return
+    return debate_lookup.get(domain, path[0])
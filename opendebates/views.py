@@ -1,16 +1,17 @@
 import datetime
 import json
 import logging
+from functools import partial
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import REDIRECT_FIELD_NAME, get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import logout
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.db import connections
-from django.db.models import DateField, F, Q
+from django.db.models import DateField, Q
 from django.db.models.functions import Trunc
 from django.utils import timezone
 from django.utils.translation import ugettext as _
@@ -20,12 +21,21 @@ from django.views.decorators.cache import cache_page
 from djangohelpers.lib import rendered_with, allow_http
 from registration.backends.simple.views import RegistrationView
 
+from .counters import buffer_vote, count_vote, pending_votes
+from .feed import append_event, recent_events, submission_event, vote_event
 from .forms import OpenDebatesRegistrationForm, VoterForm, QuestionForm, MergeFlagForm
 from .models import (Candidate, Category, Debate, Flag, Submission, Vote, Voter,
-                     TopSubmissionCategory, ZipCode, RECENT_EVENTS_CACHE_ENTRY)
+                     TopSubmissionCategory)
+from .ranking import get_random_ranking, get_ranked_submissions
 from .router import readonly_db
+from .search_cache import cached_search
+from .similar import similar_questions
 from .utils import (get_ip_address_from_request, get_headers_from_request, choose_sort, sort_list,
-                    vote_needs_captcha, registration_needs_captcha, get_voter)
+                    search_list, vote_needs_captcha, registration_needs_captcha, get_voter,
+                    keyset_page, use_keyset_pagination)
+from .votes_cast import add_vote_cast
+from .voting import record_vote, update_tallies
+from .zipcodes import state_from_zip
 from opendebates_emails.models import send_email
 
 
@@ -55,11 +65,14 @@ def health_check(request):
         return HttpResponseServerError('Configuration Error')
 
 
-def state_from_zip(zip):
-    try:
-        return ZipCode.objects.get(zip=zip).state
-    except ZipCode.DoesNotExist:
-        return ''
+def vote_tally(idea):
+    """
+    Return the number of votes to show for ``idea``, including any votes
+    that are still buffered in the cache (see ``opendebates.counters``).
+    """
+    if settings.VOTE_BUFFERING:
+        return idea.votes + pending_votes(idea.id)
+    return idea.votes
 
 
 def root_redirect(request):
@@ -87,7 +100,7 @@ def root_redirect(request):
 @allow_http("GET")
 @rendered_with("opendebates/snippets/recent_activity.html")
 def recent_activity(request):
-    entries = cache.get(RECENT_EVENTS_CACHE_ENTRY.format(request.debate.id), default=[])
+    entries = recent_events(request.debate.id) or []
     return {
         "recent_activity": entries
     }
@@ -100,11 +113,16 @@ def list_ideas(request):
     sort = choose_sort(request, request.GET.get('sort'))
 
     ideas = sort_list(citations_only, sort, ideas)
+    if not use_keyset_pagination(request):
+        ideas = get_ranked_submissions(request.debate, sort, citations_only) or ideas
+    random_ranking = partial(get_random_ranking, request.debate, citations_only)
 
     return {
         'ideas': ideas,
         'sort': sort,
         'url_name': reverse('list_ideas'),
+        'page': (keyset_page(request, ideas, sort, random_ranking=random_ranking)
+                 if use_keyset_pagination(request) else None),
         'stashed_submission': request.session.pop(
             "opendebates.stashed_submission", None) if request.user.is_authenticated else None,
     }
@@ -118,12 +136,19 @@ def list_category(request, cat_id):
     sort = choose_sort(request, request.GET.get('sort'))
 
     ideas = sort_list(citations_only, sort, ideas)
+    if not use_keyset_pagination(request):
+        ideas = get_ranked_submissions(request.debate, sort, citations_only,
+                                       category_id=category.id) or ideas
+    random_ranking = partial(get_random_ranking, request.debate, citations_only,
+                             category_id=category.id)
 
     return {
         'ideas': ideas,
         'sort': sort,
         'url_name': reverse("list_category", kwargs={'cat_id': cat_id}),
-        'category': category
+        'category': category,
+        'page': (keyset_page(request, ideas, sort, random_ranking=random_ranking)
+                 if use_keyset_pagination(request) else None),
     }
 
 
@@ -138,15 +163,23 @@ def search_ideas(request):
     ideas = Submission.objects.filter(category__debate=request.debate)
     citations_only = request.GET.get("citations_only")
 
-    sort = choose_sort(request, request.GET.get('sort'))
+    prefix = bool(request.GET.get("prefix"))
+
+    sort = choose_sort(request, request.GET.get('sort'), search=True)
     ideas = sort_list(citations_only, sort, ideas)
-    ideas = ideas.search(search_term.replace("%", ""))
+    ideas = search_list(search_term, sort, ideas, prefix=prefix)
+    keyset = use_keyset_pagination(request, sort)
+    if not keyset:
+        ideas = cached_search(request.debate, search_term, sort, citations_only, ideas,
+                              prefix=prefix)
 
     return {
         'ideas': ideas,
         'search_term': search_term,
+        'prefix': prefix,
         'sort': sort,
         'url_name': reverse('search_ideas'),
+        'page': keyset_page(request, ideas, sort) if keyset else None,
     }
 
 
@@ -155,17 +188,24 @@ def category_search(request, cat_id):
     ideas = Submission.objects.filter(category__debate=request.debate, category=cat_id)
     citations_only = request.GET.get("citations_only")
     search_term = request.GET['q']
+    prefix = bool(request.GET.get("prefix"))
 
-    sort = choose_sort(request, request.GET.get('sort'))
+    sort = choose_sort(request, request.GET.get('sort'), search=True)
 
     ideas = sort_list(citations_only, sort, ideas)
-    ideas = ideas.search(search_term.replace("%", ""))
+    ideas = search_list(search_term, sort, ideas, prefix=prefix)
+    keyset = use_keyset_pagination(request, sort)
+    if not keyset:
+        ideas = cached_search(request.debate, search_term, sort, citations_only, ideas,
+                              category_id=cat_id, prefix=prefix)
 
     return {
         'ideas': ideas,
         'search_term': search_term,
+        'prefix': prefix,
         'sort': sort,
-        'url_name': reverse("list_category", kwargs={'cat_id': cat_id})
+        'url_name': reverse("list_category", kwargs={'cat_id': cat_id}),
+        'page': keyset_page(request, ideas, sort) if keyset else None,
     }
 
 
@@ -227,31 +267,41 @@ def vote(request, id):
             'form': form,
             'idea': idea,
         }
-    state = state_from_zip(form.cleaned_data['zipcode'])
-
     is_fraudulent = False
+    result = None
 
-    session_key = request.session.session_key or ''
-    if session_key and Vote.objects.filter(submission=idea,
-                                           sessionid=session_key).exists():
+    session_voter = get_voter(request)
+    if session_voter and session_voter['email'] != form.cleaned_data['email']:
+        # This can only happen with an manually-created POST request.
+        is_fraudulent = True
+    else:
+        session_key = request.session.session_key or ''
+        result = record_vote(
+            idea, request.debate,
+            email=form.cleaned_data['email'],
+            zip=form.cleaned_data['zipcode'],
+            state=state_from_zip(form.cleaned_data['zipcode']),
+            user=request.user if request.user.is_authenticated else None,
+            source=request.COOKIES.get('opendebates.source'),
+            ip_address=get_ip_address_from_request(request),
+            sessionid=session_key,
+            request_headers=get_headers_from_request(request),
+            # When buffering, the tallies are updated by flush_vote_buffer
+            update_tallies=not settings.VOTE_BUFFERING,
+        )
         # Django creates a session for both signed-in users and anonymous, so
         # we should be able to rely on this.  If it is duplicated on a given
         # question, it's because they are scripting votes.  Behave the same
         # way as if it was a normal email duplicate, i.e. don't increment but
         # return without error.
-        is_fraudulent = True
-
-    session_voter = get_voter(request)
-    if session_voter and session_voter['email'] != form.cleaned_data['email']:
-        # This can only happen with an manually-created POST request.
-        is_fraudulent = True
+        is_fraudulent = result.duplicate_session
 
     if is_fraudulent:
         # Pretend like everything is fine, but don't increment the tally or
         # create a Vote.  Deny attackers any information about how they are failing.
         if request.is_ajax():
             result = {"status": "200",
-                      "tally": idea.votes if request.debate.show_question_votes else '',
+                      "tally": vote_tally(idea) if request.debate.show_question_votes else '',
                       "id": idea.id}
             return HttpResponse(
                 json.dumps(result),
@@ -260,57 +310,28 @@ def vote(request, id):
         url = reverse("vote", kwargs={'id': id})
         return redirect(url)
 
-    voter, created = Voter.objects.get_or_create(
-        email=form.cleaned_data['email'],
-        defaults=dict(
-            source=request.COOKIES.get('opendebates.source'),
-            state=state,
-            zip=form.cleaned_data['zipcode'],
-            user=request.user if request.user.is_authenticated else None,
-        )
-    )
-
-    if not created and voter.zip != form.cleaned_data['zipcode']:
-        voter.zip = form.cleaned_data['zipcode']
-        voter.state = state
-        voter.save()
-
-    vote, created = Vote.objects.get_or_create(
-        submission=idea,
-        voter=voter,
-        defaults=dict(
-            created_at=timezone.now(),
-            source=request.COOKIES.get('opendebates.source'),
-            ip_address=get_ip_address_from_request(request),
-            sessionid=session_key,
-            request_headers=get_headers_from_request(request),
-            is_suspicious=False,
-            is_invalid=False,
-        )
-    )
-
-    previous_debate_time = request.debate.previous_debate_time
-    if created:
-        # update the DB with the real tally
-        Submission.objects.filter(category__debate=request.debate, id=id).update(
-            votes=F('votes')+1,
-            current_votes=F('current_votes')+(
-                1 if previous_debate_time is None or vote.created_at > previous_debate_time
-                else 0
-            ),
-            local_votes=F('local_votes')+(
-                1 if voter.state and voter.state == request.debate.debate_state
-                else 0)
-        )
-        # also calculate a simple increment tally for the client
-        idea.votes += 1
+    voter, vote = result.voter, result.vote
+    if vote is not None:
+        if settings.VOTE_BUFFERING:
+            previous_debate_time = request.debate.previous_debate_time
+            is_current = previous_debate_time is None or vote.created_at > previous_debate_time
+            # vote_tally() picks this vote up from the cache.
+            if not buffer_vote(idea.id, is_current, result.is_local):
+                update_tallies(idea, request.debate, vote, result.is_local)
+                idea.votes += 1
+        else:
+            idea.votes = result.votes
+        count_vote(request.debate.id)
+        add_vote_cast(voter.email, idea.id)
+        idea._cached_debate = request.debate
+        append_event(request.debate.id, vote_event(vote))
 
     if 'voter' not in request.session:
         request.session['voter'] = {"email": voter.email, "zip": voter.zip}
 
     if request.is_ajax():
         result = {"status": "200",
-                  "tally": idea.votes if request.debate.show_question_votes else '',
+                  "tally": vote_tally(idea) if request.debate.show_question_votes else '',
                   "id": idea.id}
         return HttpResponse(
             json.dumps(result),
@@ -320,6 +341,21 @@ def vote(request, id):
     return redirect(url)
 
 
+@allow_http("GET")
+def similar(request):
+    """
+    The approved questions similar to the headline being written in the
+    question form, as JSON.
+    """
+    with readonly_db():
+        questions = similar_questions(request.debate, request.GET.get("q", ""))
+    if not request.debate.show_question_votes:
+        questions = [dict(question, votes=None) for question in questions]
+    return HttpResponse(
+        json.dumps({"questions": questions}),
+        content_type="application/json")
+
+
 @rendered_with("opendebates/list_ideas.html")
 @allow_http("GET", "POST")
 def questions(request):
@@ -392,6 +428,10 @@ def questions(request):
         is_suspicious=False,
         is_invalid=False,
     )
+    count_vote(request.debate.id)
+    add_vote_cast(voter.email, idea.id)
+    idea._cached_debate = request.debate
+    append_event(request.debate.id, submission_event(idea))
 
     send_email("submitted_new_idea", {"idea": idea})
     send_email("notify_moderators_submitted_new_idea", {"idea": idea})
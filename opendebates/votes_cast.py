@@ -0,0 +1,69 @@
+"""
+Per-voter list of the submissions they voted for.
+
+Every page embeds this list (VOTES_CAST in base.html) so the browser can
+mark the questions the visitor already voted on. It's kept in the cache
+as a sorted, packed array of submission ids per voter email, dropped when
+the voter votes, and rebuilt with one ``values_list`` query on a miss.
+
+Merges move votes between submissions for many voters at once;
+``invalidate_merged_votes_cast`` drops the entries of just those voters.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
+
+from .models import Vote
+from .utils import pack_ids, unpack_ids
+
+
+VOTES_CAST_CACHE_ENTRY = 'votes_cast_ids-{}'
+
+VOTES_CAST_TIMEOUT = 24 * 3600
+
+
+def _key(email):
+    # Emails can contain characters memcached doesn't allow in keys
+    return VOTES_CAST_CACHE_ENTRY.format(hashlib.md5(force_bytes(email)).hexdigest())
+
+
+def get_votes_cast(email):
+    """
+    Return the sorted ids of the submissions that ``email`` voted for.
+    """
+    key = _key(email)
+    packed = cache.get(key)
+    if packed is not None:
+        return list(unpack_ids(packed))
+
+    ids = sorted(Vote.objects.filter(
+        voter__email=email,
+    ).values_list('submission_id', flat=True))
+    cache.set(key, pack_ids(ids), VOTES_CAST_TIMEOUT)
+    return ids
+
+
+def add_vote_cast(email, submission_id):
+    """
+    Make the votes of ``email`` include ``submission_id``, which it just
+    voted for.
+
+    The cached entry is dropped rather than updated in place: two votes
+    by the same voter at once (several tabs, fast clicks) would each write
+    back a list without the other's vote. The next read rebuilds it from
+    the votes, which are committed by now.
+    """
+    cache.delete(_key(email))
+
+
+def invalidate_merged_votes_cast(to_remove, duplicate_of):
+    """
+    Drop the cached votes of the voters whose votes were moved from
+    ``to_remove`` to ``duplicate_of`` by a merge.
+    """
+    emails = Vote.objects.filter(
+        submission=duplicate_of,
+        original_merged_submission=to_remove,
+    ).values_list('voter__email', flat=True).distinct()
+    cache.delete_many([_key(email) for email in emails])
@@ -0,0 +1,150 @@
+"""
+The write path of a vote.
+
+``record_vote`` does in a single SQL statement what the vote view used to
+do in up to five queries: create or update the Voter, check that the session hasn't already voted
+for the submission, create the Vote and add it to the tallies of the
+submission. Being one statement, it is also one transaction. Voters and
+votes are created with ``INSERT ... ON CONFLICT``, so concurrent votes
+from the same voter can't fail on the unique constraints.
+
+The ``benchmark_vote`` command reports the queries and time per vote.
+"""
+from collections import namedtuple
+
+from django.db import connections, router
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Submission, Vote, Voter
+
+
+# duplicate_session: the session already voted for the submission, so
+#   nothing was written and voter is None.
+# voter: the Voter who voted (only the fields selected below are loaded).
+# vote: the new Vote, or None if the voter had already voted.
+# votes: the new tally of the submission, or None if it wasn't updated.
+# is_local: whether the vote counts towards local_votes.
+VoteResult = namedtuple('VoteResult', ['duplicate_session', 'voter', 'vote', 'votes', 'is_local'])
+
+RECORD_VOTE_SQL = """
+WITH duplicate AS (
+    SELECT EXISTS (
+        SELECT 1 FROM {vote} WHERE submission_id = %(submission)s
+        AND %(sessionid)s <> '' AND sessionid = %(sessionid)s
+    ) AS found
+),
+upserted AS (
+    INSERT INTO {voter} AS r (email, zip, state, source, user_id, created_at,
+                              phone_number, unsubscribed)
+    SELECT %(email)s, %(zip)s, %(state)s, %(source)s, %(user)s, %(now)s, '', false
+    FROM duplicate
+    WHERE NOT duplicate.found
+    ON CONFLICT (email) DO UPDATE SET zip = excluded.zip, state = excluded.state
+    WHERE r.zip IS DISTINCT FROM excluded.zip
+    RETURNING r.id, r.email, r.zip, r.state, r.user_id, r.display_name
+),
+voter AS (
+    SELECT * FROM upserted
+    UNION ALL
+    SELECT r.id, r.email, r.zip, r.state, r.user_id, r.display_name
+    FROM {voter} AS r, duplicate
+    WHERE r.email = %(email)s AND NOT duplicate.found
+    AND NOT EXISTS (SELECT 1 FROM upserted)
+),
+inserted AS (
+    INSERT INTO {vote} (submission_id, voter_id, created_at, source, ip_address,
+                        sessionid, request_headers, is_suspicious, is_invalid)
+    SELECT %(submission)s, voter.id, %(now)s, %(source)s, %(ip_address)s,
+           %(sessionid)s, %(request_headers)s, false, false
+    FROM voter
+    ON CONFLICT (submission_id, voter_id) DO NOTHING
+    RETURNING id
+),
+bumped AS (
+    UPDATE {submission} AS s
+    SET votes = s.votes + 1,
+        current_votes = s.current_votes + %(current)s,
+        local_votes = s.local_votes + (CASE WHEN voter.state = %(local_state)s THEN 1 ELSE 0 END)
+    FROM inserted, voter
+    WHERE s.id = %(submission)s AND %(update_tallies)s
+    RETURNING s.votes
+)
+SELECT duplicate.found, voter.id, voter.email, voter.zip, voter.state, voter.user_id,
+       voter.display_name, (SELECT id FROM inserted), (SELECT votes FROM bumped)
+FROM duplicate LEFT JOIN voter ON true
+"""
+
+
+def record_vote(submission, debate, email, zip, state='', user=None, source=None,
+                ip_address='', sessionid='', request_headers=None, update_tallies=True):
+    """
+    Record the vote of ``email`` for ``submission`` and return a VoteResult.
+    ``state`` is the state of ``zip``, which is stored with the Voter.
+
+    If the session already voted for the submission, nothing is written.
+    If ``update_tallies`` is False, the tallies of the submission are left
+    for the caller to update (e.g. when votes are buffered in the cache).
+    """
+    now = timezone.now()
+    previous_debate_time = debate.previous_debate_time
+    is_current = previous_debate_time is None or now > previous_debate_time
+    params = {
+        'submission': submission.id,
+        'email': email,
+        'zip': zip,
+        'state': state,
+        'user': user.id if user else None,
+        'source': source,
+        'now': now,
+        'ip_address': ip_address,
+        'sessionid': sessionid,
+        'request_headers': request_headers,
+        'current': 1 if is_current else 0,
+        'local_state': debate.debate_state or None,
+        'update_tallies': update_tallies,
+    }
+    sql = RECORD_VOTE_SQL.format(
+        vote=Vote._meta.db_table,
+        voter=Voter._meta.db_table,
+        submission=Submission._meta.db_table,
+    )
+    # Also tells the DB router that this request wrote to the database
+    db = router.db_for_write(Vote)
+    # A single statement is atomic by itself, no need for a transaction
+    with connections[db].cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        if row[0] is False and row[1] is None:
+            # A concurrent request created the voter after this statement
+            # started, so its row wasn't visible to us and nothing was
+            # written; it is visible to a new statement.
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+
+    duplicate, voter_id, email, zip, state, user_id, display_name, vote_id, votes = row
+    if duplicate:
+        return VoteResult(True, None, None, None, False)
+
+    voter = Voter(id=voter_id, email=email, zip=zip, state=state, user_id=user_id,
+                  display_name=display_name)
+    vote = None
+    if vote_id is not None:
+        vote = Vote(id=vote_id, submission=submission, voter=voter, created_at=now,
+                    source=source, ip_address=ip_address, sessionid=sessionid)
+    is_local = bool(state and state == debate.debate_state)
+    return VoteResult(False, voter, vote, votes, is_local)
+
+
+def update_tallies(submission, debate, vote, is_local):
+    """
+    Add ``vote`` to the tallies of ``submission``, for votes recorded with
+    ``update_tallies=False`` that could not be buffered after all.
+    """
+    previous_debate_time = debate.previous_debate_time
+    is_current = previous_debate_time is None or vote.created_at > previous_debate_time
+    Submission.objects.filter(id=submission.id).update(
+        votes=F('votes') + 1,
+        current_votes=F('current_votes') + (1 if is_current else 0),
+        local_votes=F('local_votes') + (1 if is_local else 0),
+    )
@@ -0,0 +1,109 @@
+"""
+In-process ZIP code -> state lookup.
+
+Votes and registrations need the state of the voter's ZIP code. Instead
+of a cache or database round trip for each of them, every process loads
+the whole ZipCode table (about 43k rows) once into a ZipCodeTable: a
+sorted array of the 5-digit ZIP codes as ints, and a parallel array of
+indexes into the (few dozen) distinct states.
+
+At most every ``ZIPCODE_LOOKUP_SECONDS``, the table compares the version
+in the shared cache with the one it was built with, and is rebuilt if it
+changed. The version is bumped whenever a ZipCode is saved or deleted
+(see ``opendebates.signals``).
+"""
+import array
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ZipCode
+
+
+ZIPCODE_VERSION_CACHE_ENTRY = 'zipcode_version'
+
+# How often each process checks the shared version key for changes to
+# ZipCodes.
+ZIPCODE_LOOKUP_SECONDS = int(getattr(settings, 'ZIPCODE_LOOKUP_SECONDS', 60))
+
+
+class ZipCodeTable(object):
+    """
+    An immutable mapping of ZIP code -> state.
+    """
+
+    def __init__(self, rows):
+        numeric = []
+        self.other = {}
+        for zip, state in rows:
+            if len(zip) == 5 and zip.isdigit():
+                numeric.append((int(zip), state))
+            else:
+                self.other[zip] = state
+        numeric.sort()
+        self.states = sorted(set(state for zip, state in numeric), key=lambda state: state or '')
+        indexes = dict((state, n) for n, state in enumerate(self.states))
+        self.zips = array.array('i', [zip for zip, state in numeric])
+        self.state_indexes = array.array('H', [indexes[state] for zip, state in numeric])
+
+    def __len__(self):
+        return len(self.zips) + len(self.other)
+
+    def get(self, zip, default=None):
+        if len(zip) != 5 or not zip.isdigit():
+            return self.other.get(zip, default)
+        number = int(zip)
+        index = bisect.bisect_left(self.zips, number)
+        if index < len(self.zips) and self.zips[index] == number:
+            return self.states[self.state_indexes[index]]
+        return default
+
+
+class ZipCodeLookup(object):
+    """
+    The ZipCodeTable of this process, loaded on first use and reloaded
+    when the shared version changes.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.table = None
+            self.version = None
+            self.checked_at = 0
+
+    def get_table(self):
+        now = time.time()
+        # Read once: clear() may run in another thread in between
+        table = self.table
+        if table is not None and now - self.checked_at < self.ttl:
+            return table
+        version = cache.get(ZIPCODE_VERSION_CACHE_ENTRY)
+        with self.lock:
+            if self.table is None or version != self.version:
+                self.table = ZipCodeTable(ZipCode.objects.values_list('zip', 'state').iterator())
+                self.version = version
+            self.checked_at = now
+            return self.table
+
+
+zipcode_lookup = ZipCodeLookup(ZIPCODE_LOOKUP_SECONDS)
+
+
+def invalidate_zipcodes():
+    """
+    Make every process reload its ZipCodeTable.
+    """
+    zipcode_lookup.clear()
+    cache.set(ZIPCODE_VERSION_CACHE_ENTRY, time.time(), None)
+
+
+def state_from_zip(zip):
+    return zipcode_lookup.get_table().get(zip, '')